@@ -31,6 +31,16 @@ _C.INPUT.INTERPOLATION = "bilinear"
 _C.INPUT.TRANSFORMS = ()
 # If True, tfm_train and tfm_test will be None
 _C.INPUT.NO_TRANSFORM = False
+# Decode JPEGs at 1/2, 1/4 or 1/8 scale when the transforms' first resize
+# or resized crop does not need more pixels (see transforms.decode_size)
+_C.INPUT.REDUCED_DECODE = False
+# Workers only resize training images and return them as uint8; the random
+# transforms (see dassl.data.transforms.batch_transforms.BATCH_CHOICES) and
+# normalization run on whole batches, on the GPU if used
+_C.INPUT.BATCH_TRANSFORM = False
+# Side of the square images the workers return when random_resized_crop is
+# used (crops are resampled from them); 0 uses 2 * max(SIZE)
+_C.INPUT.BATCH_TRANSFORM_SIZE = 0
 # Mean and std (default: ImageNet)
 _C.INPUT.PIXEL_MEAN = [0.485, 0.456, 0.406]
 _C.INPUT.PIXEL_STD = [0.229, 0.224, 0.225]
@@ -86,6 +96,16 @@ _C.DATASET.CIFAR_C_TYPE = ""
 _C.DATASET.CIFAR_C_LEVEL = 1
 # Use all data in the unlabeled data set (e.g. FixMatch)
 _C.DATASET.ALL_AS_UNLABELED = False
+# Check that every image file of the splits exists when the dataset is built
+# (in parallel). Datasets that skip the per-Datum check otherwise only fail
+# when a missing image is read
+_C.DATASET.CHECK_FILES = False
+# Save the splits a dataset builds (after few-shot sampling and class
+# subsampling) in DIR and load them directly next time; a file covers one
+# combination of DATASET options, SEED, TRAINER.NAME and TRAINER.MODAL and
+# one state (size, mtime) of the split files at the top of the dataset
+# directory and of the few-shot split file. Empty disables the cache
+_C.DATASET.SPLIT_CACHE_DIR = ""
 
 ###########################
 # Dataloader
@@ -97,6 +117,35 @@ _C.DATALOADER.K_TRANSFORMS = 1
 # img0 denotes image tensor without augmentation
 # Useful for consistency learning
 _C.DATALOADER.RETURN_IMG0 = False
+# Workers return uint8 images, 4x fewer bytes through worker IPC, pinned
+# memory and host-to-device copies; the trainer scales, normalizes and casts
+# them to INPUT_DTYPE ("float32", "float16" or "bfloat16") on the device
+# (see SimpleTrainer.prepare_input)
+_C.DATALOADER.UINT8 = False
+_C.DATALOADER.INPUT_DTYPE = "float32"
+# Number of training batches prepared ahead on a background thread
+# (pinned, moved to the device on a side CUDA stream and converted as
+# above) while the current one is trained on; 0 (default) disables it.
+# The batched augmentation (INPUT.BATCH_TRANSFORM) then also draws its
+# random numbers on that thread
+_C.DATALOADER.PREFETCH = 0
+# Decode every image once and keep it, resized, in uint8 shards under DIR
+# (empty disables the cache). SIZE is the smaller edge after resizing;
+# 0 uses max(INPUT.SIZE), which leaves the test transform's output unchanged.
+# Training loaders crop from the cached images, so they use the cache only
+# when SIZE is set, preferably well above INPUT.SIZE (e.g. 256 or more for
+# 224, >= 1.15x); with SIZE = 0 they decode the full-resolution images.
+# Caches are keyed by the paths, sizes and mtimes of the images
+_C.DATALOADER.IMAGE_CACHE = CN()
+_C.DATALOADER.IMAGE_CACHE.DIR = ""
+_C.DATALOADER.IMAGE_CACHE.SIZE = 0
+_C.DATALOADER.IMAGE_CACHE.SHARD_MB = 1024
+# Read splits from the tar shards under DIR (see dassl.data.shards and
+# tools/make_shards.py) when they have been written; empty reads image files.
+# Training shuffles through a buffer of SHUFFLE_BUFFER items
+_C.DATALOADER.SHARDS = CN()
+_C.DATALOADER.SHARDS.DIR = ""
+_C.DATALOADER.SHARDS.SHUFFLE_BUFFER = 10000
 # Setting for the train_x data-loader
 _C.DATALOADER.TRAIN_X = CN()
 _C.DATALOADER.TRAIN_X.SAMPLER = "RandomSampler"
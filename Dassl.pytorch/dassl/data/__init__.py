@@ -1 +1,2 @@
+from .prefetcher import Prefetcher
 from .data_manager import DataManager, DatasetWrapper
@@ -1,13 +1,21 @@
+import io
+import random
+import os.path as osp
+import json
 import torch
 import torchvision.transforms as T
 from tabulate import tabulate
 from torch.utils.data import Dataset as TorchDataset
+from torch.utils.data import IterableDataset
 
 from dassl.utils import read_image
 
 from .datasets import build_dataset
+from .image_cache import build_image_cache
 from .samplers import build_sampler
-from .transforms import INTERPOLATION_MODES, build_transform
+from .shards import ShardSampler, epoch_seed, find_shards, read_shard
+from .transforms import INTERPOLATION_MODES, build_transform, decode_size
+from .transforms.batch_transforms import build_batch_transform, build_precrop_transform
 
 
 def build_data_loader(
@@ -33,6 +41,33 @@ def build_data_loader(
 
     if dataset_wrapper is None:
         dataset_wrapper = DatasetWrapper
+        shard_dir = None
+        if cfg.DATALOADER.SHARDS.DIR and data_source:
+            shard_dir = find_shards(cfg.DATALOADER.SHARDS.DIR, data_source)
+            if shard_dir is None:
+                print(f"No shards of this split in {cfg.DATALOADER.SHARDS.DIR}, reading image files")
+            elif sampler_type not in ["RandomSampler", "SequentialSampler"]:
+                print(f"{sampler_type} cannot read shards, reading image files")
+                shard_dir = None
+        if shard_dir is not None:
+            # Shards are read in their own order, shuffled for training
+            dataset = ShardDatasetWrapper(cfg, data_source, shard_dir, transform=tfm, is_train=is_train)
+            num_workers = cfg.DATALOADER.NUM_WORKERS
+            if num_workers > len(dataset.shards):
+                # A worker without a shard would sit idle
+                print(f"Only {len(dataset.shards)} shards, reading them with as many workers")
+                num_workers = len(dataset.shards)
+            data_loader = torch.utils.data.DataLoader(
+                dataset,
+                batch_size=batch_size,
+                num_workers=num_workers,
+                pin_memory=(torch.cuda.is_available() and cfg.USE_CUDA)
+            )
+            data_loader = ShardBatchLoader(
+                data_loader, batch_size, drop_last=is_train and len(data_source) >= batch_size
+            )
+            assert len(data_loader) > 0
+            return data_loader
 
     # Build data loader
     data_loader = torch.utils.data.DataLoader(
@@ -55,14 +90,20 @@ class DataManager:
         cfg,
         custom_tfm_train=None,
         custom_tfm_test=None,
-        dataset_wrapper=None
+        dataset_wrapper=None,
+        custom_batch_tfm_train=None
     ):
         # Load dataset
         dataset = build_dataset(cfg)
 
         # Build transform
+        batch_tfm_train = custom_batch_tfm_train
         if custom_tfm_train is None:
-            tfm_train = build_transform(cfg, is_train=True)
+            if cfg.INPUT.BATCH_TRANSFORM:
+                tfm_train = build_precrop_transform(cfg)
+                batch_tfm_train = build_batch_transform(cfg)
+            else:
+                tfm_train = build_transform(cfg, is_train=True)
         else:
             print("* Using custom transform for training")
             tfm_train = custom_tfm_train
@@ -136,6 +177,13 @@ class DataManager:
             dataset_wrapper=dataset_wrapper
         )
 
+        # Augment training batches after collation
+        if batch_tfm_train is not None:
+            device = "cuda" if torch.cuda.is_available() and cfg.USE_CUDA else "cpu"
+            train_loader_x = BatchTransformLoader(train_loader_x, batch_tfm_train, device)
+            if train_loader_u is not None:
+                train_loader_u = BatchTransformLoader(train_loader_u, batch_tfm_train, device)
+
         # Attributes
         self._num_classes = dataset.num_classes
         self._num_source_domains = len(cfg.DATASET.SOURCE_DOMAINS)
@@ -185,6 +233,120 @@ class DataManager:
         print(tabulate(table))
 
 
+class BatchTransformLoader:
+    """Data loader whose batches of uint8 images are augmented by
+    ``batch_tfm`` (see dassl.data.transforms.batch_transforms) on ``device``.
+
+    ``batch_tfm`` can be a list: its transforms then augment the same images
+    into "img", "img2", ... (e.g. the weak and strong views of FixMatch).
+
+    Other attributes are those of the wrapped data loader.
+    """
+
+    def __init__(self, data_loader, batch_tfm, device):
+        self.data_loader = data_loader
+        if not isinstance(batch_tfm, (list, tuple)):
+            batch_tfm = [batch_tfm]
+        self.batch_tfms = batch_tfm
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __getattr__(self, name):
+        if name == "data_loader":
+            raise AttributeError(name)
+        return getattr(self.data_loader, name)
+
+    def _to_device(self, imgs):
+        if isinstance(imgs, list):
+            # K_TRANSFORMS > 1
+            return [self._to_device(img) for img in imgs]
+        return imgs.to(self.device, non_blocking=True)
+
+    def _transform(self, batch_tfm, imgs, img_sizes):
+        if isinstance(imgs, list):
+            return [self._transform(batch_tfm, img, img_sizes) for img in imgs]
+        return batch_tfm(imgs, img_sizes)
+
+    def __iter__(self):
+        for batch in self.data_loader:
+            imgs = self._to_device(batch["img"])
+            for i, batch_tfm in enumerate(self.batch_tfms):
+                keyname = "img" if i == 0 else f"img{i + 1}"
+                batch[keyname] = self._transform(batch_tfm, imgs, batch["img_size"])
+            yield batch
+
+
+def _batch_size(batch):
+    return len(batch["index"])
+
+
+def _concat_batches(batches):
+    first = batches[0]
+    if torch.is_tensor(first):
+        return torch.cat(batches)
+    if isinstance(first, dict):
+        return {k: _concat_batches([batch[k] for batch in batches]) for k in first}
+    if isinstance(first, list) and torch.is_tensor(first[0]):
+        # K_TRANSFORMS > 1: one tensor per augmentation
+        return [_concat_batches(imgs) for imgs in zip(*batches)]
+    return [item for batch in batches for item in batch]
+
+
+def _slice_batch(batch, start, stop):
+    if isinstance(batch, dict):
+        return {k: _slice_batch(v, start, stop) for k, v in batch.items()}
+    if isinstance(batch, list) and batch and torch.is_tensor(batch[0]):
+        return [img[start:stop] for img in batch]
+    return batch[start:stop]
+
+
+class ShardBatchLoader:
+    """Data loader over shards whose batches all hold ``batch_size`` items.
+
+    Every worker batches the items of its own shards, so each one ends the
+    epoch with an incomplete batch. These are merged here into full batches
+    (the last one dropped with ``drop_last``), which makes len() exact
+    whatever shards the workers get.
+
+    Other attributes are those of the wrapped data loader.
+    """
+
+    def __init__(self, data_loader, batch_size, drop_last=False):
+        self.data_loader = data_loader
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+
+    def __len__(self):
+        n = len(self.data_loader.dataset)
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def __getattr__(self, name):
+        if name == "data_loader":
+            raise AttributeError(name)
+        return getattr(self.data_loader, name)
+
+    def __iter__(self):
+        rest, n_rest = [], 0
+        for batch in self.data_loader:
+            n = _batch_size(batch)
+            if n == self.batch_size:
+                yield batch
+                continue
+            rest.append(batch)
+            n_rest += n
+            if n_rest >= self.batch_size:
+                batch = _concat_batches(rest)
+                yield _slice_batch(batch, 0, self.batch_size)
+                n_rest -= self.batch_size
+                rest = [_slice_batch(batch, self.batch_size, None)] if n_rest else []
+        if n_rest and not self.drop_last:
+            yield _concat_batches(rest)
+
+
 class DatasetWrapper(TorchDataset):
 
     def __init__(self, cfg, data_source, transform=None, is_train=False):
@@ -206,14 +368,32 @@ class DatasetWrapper(TorchDataset):
         interp_mode = INTERPOLATION_MODES[cfg.INPUT.INTERPOLATION]
         to_tensor = []
         to_tensor += [T.Resize(cfg.INPUT.SIZE, interpolation=interp_mode)]
-        to_tensor += [T.ToTensor()]
-        if "normalize" in cfg.INPUT.TRANSFORMS:
+        if cfg.DATALOADER.UINT8:
+            # Scaled and normalized on the device, like the other images
+            to_tensor += [T.PILToTensor()]
+        else:
+            to_tensor += [T.ToTensor()]
+        if "normalize" in cfg.INPUT.TRANSFORMS and not cfg.DATALOADER.UINT8:
             normalize = T.Normalize(
                 mean=cfg.INPUT.PIXEL_MEAN, std=cfg.INPUT.PIXEL_STD
             )
             to_tensor += [normalize]
         self.to_tensor = T.Compose(to_tensor)
 
+        # Pre-decoded, resized images (see DATALOADER.IMAGE_CACHE)
+        self.image_cache = build_image_cache(cfg, data_source, is_train)
+
+        # Original image sizes, needed by the batched random resized crop
+        self.return_img_size = is_train and cfg.INPUT.BATCH_TRANSFORM
+
+        # Decode JPEGs only at the resolution the transforms need
+        self.decode_size = None
+        if cfg.INPUT.REDUCED_DECODE and transform is not None:
+            tfms = list(transform) if isinstance(transform, (list, tuple)) else [transform]
+            if self.return_img0:
+                tfms.append(self.to_tensor)
+            self.decode_size = decode_size(tfms)
+
     def __len__(self):
         return len(self.data_source)
 
@@ -227,7 +407,16 @@ class DatasetWrapper(TorchDataset):
             "index": idx
         }
 
-        img0 = read_image(item.impath)
+        if self.image_cache is not None:
+            img0 = self.image_cache[idx]
+        else:
+            img0 = read_image(item.impath, self.decode_size)
+
+        return self._add_images(output, img0)
+
+    def _add_images(self, output, img0):
+        if self.return_img_size:
+            output["img_size"] = torch.tensor([img0.height, img0.width])
 
         if self.transform is not None:
             if isinstance(self.transform, (list, tuple)):
@@ -259,3 +448,55 @@ class DatasetWrapper(TorchDataset):
             img = img[0]
 
         return img
+
+
+class ShardDatasetWrapper(DatasetWrapper, IterableDataset):
+    """DatasetWrapper that reads the shards of its data source (see
+    dassl.data.shards) front to back instead of the image files.
+
+    Each data loader worker reads its own shards. For training, the shard
+    order changes every epoch and items leave through a buffer of
+    DATALOADER.SHARDS.SHUFFLE_BUFFER items in random order. Batches are
+    formed per worker; ShardBatchLoader merges their incomplete last ones.
+    """
+
+    def __init__(self, cfg, data_source, directory, transform=None, is_train=False):
+        # Image files are neither read nor cached
+        super().__init__(cfg, None, transform=transform, is_train=is_train)
+        self.data_source = data_source
+        self.directory = directory
+        with open(osp.join(directory, "index.json")) as f:
+            self.shards = json.load(f)["shards"]
+        self.sampler = ShardSampler(len(self.shards), shuffle=is_train)
+        self.shuffle_buffer = cfg.DATALOADER.SHARDS.SHUFFLE_BUFFER if is_train else 0
+
+    def __getitem__(self, idx):
+        raise TypeError("Shards can only be read sequentially")
+
+    def _read_shard(self, shard):
+        path = osp.join(self.directory, self.shards[shard]["name"])
+        for record, data in read_shard(path):
+            output = {
+                "label": record["label"],
+                "domain": record["domain"],
+                "impath": record["impath"],
+                "index": record["index"]
+            }
+            img0 = read_image(io.BytesIO(data), self.decode_size)
+            yield self._add_images(output, img0)
+
+    def __iter__(self):
+        seed, worker_id, num_workers = epoch_seed()
+        rng = random.Random(seed + worker_id)
+        buffer = []
+        for shard in self.sampler.worker_shards(seed, worker_id, num_workers):
+            for output in self._read_shard(shard):
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(output)
+                    continue
+                if buffer:
+                    i = rng.randrange(len(buffer))
+                    buffer[i], output = output, buffer[i]
+                yield output
+        rng.shuffle(buffer)
+        yield from buffer
@@ -1,5 +1,5 @@
-from .build import DATASET_REGISTRY, build_dataset  # isort:skip
-from .base_dataset import Datum, DatasetBase  # isort:skip
+from .build import DATASET_REGISTRY, build_dataset, cache_datasets  # isort:skip
+from .base_dataset import Datum, DatasetBase, DatasetIndex  # isort:skip
 
 from .da import *
 from .dg import *
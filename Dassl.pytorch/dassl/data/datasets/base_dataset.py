@@ -1,10 +1,14 @@
 import os
+import pickle
 import random
 import os.path as osp
 import tarfile
 import zipfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import gdown
+import torch
 
 from dassl.utils import check_isfile
 
@@ -17,11 +21,14 @@ class Datum:
         label (int): class label.
         domain (int): domain label.
         classname (str): class name.
+        check_file (bool): assert that impath is a file. Datasets with many
+            images can skip it and use DatasetBase.check_files() instead.
     """
 
-    def __init__(self, impath="", label=0, domain=0, classname=""):
+    def __init__(self, impath="", label=0, domain=0, classname="", check_file=True):
         assert isinstance(impath, str)
-        assert check_isfile(impath)
+        if check_file:
+            assert check_isfile(impath)
 
         self._impath = impath
         self._label = label
@@ -45,6 +52,151 @@ class Datum:
         return self._classname
 
 
+class DatasetIndex:
+    """Columnar, read-only data source that replaces a list of Datum objects.
+
+    Labels and domains are integer arrays, image paths are packed into one
+    byte string with offsets, and classnames are stored once and referenced
+    by id. Indexing and iteration give Datum objects, created on access, so
+    code written for lists of Datum objects keeps working.
+
+    The columns are tensors: data loader workers forked from the main process
+    share them without copy-on-write page faults (there are no per-item
+    Python objects whose reference counts change), and spawned workers receive
+    them through shared memory instead of a pickled copy.
+
+    Args:
+        impaths (list): image paths.
+        labels (list or np.ndarray): class labels.
+        domains (list or np.ndarray, optional): domain labels, 0 by default.
+        classnames (list, optional): classname of every item.
+    """
+
+    def __init__(self, impaths, labels, domains=None, classnames=None):
+        n = len(impaths)
+        encoded = [impath.encode() for impath in impaths]
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in encoded], out=offsets[1:])
+        self._paths = torch.from_numpy(np.frombuffer(b"".join(encoded), dtype=np.uint8).copy())
+        self._offsets = torch.from_numpy(offsets)
+
+        self._labels = torch.as_tensor(np.asarray(labels, dtype=np.int64).reshape(n))
+        if domains is None:
+            domains = np.zeros(n, dtype=np.int64)
+        self._domains = torch.as_tensor(np.asarray(domains, dtype=np.int64).reshape(n))
+
+        if classnames is None:
+            classnames = [""] * n
+        self._classnames, ids = np.unique(np.asarray(classnames, dtype=object), return_inverse=True)
+        self._classnames = self._classnames.tolist()
+        self._classname_ids = torch.as_tensor(ids.astype(np.int32).reshape(n))
+
+    @classmethod
+    def from_items(cls, items):
+        """Build the index of a list of Datum objects."""
+        return cls(
+            [item.impath for item in items],
+            [item.label for item in items],
+            [item.domain for item in items],
+            [item.classname for item in items],
+        )
+
+    @property
+    def labels(self):
+        return self._labels.numpy()
+
+    @property
+    def domains(self):
+        return self._domains.numpy()
+
+    @property
+    def impaths(self):
+        return [self.impath(i) for i in range(len(self))]
+
+    def impath(self, idx):
+        start, end = self._offsets.numpy()[idx:idx + 2].tolist()
+        return self._paths.numpy()[start:end].tobytes().decode()
+
+    @property
+    def classnames(self):
+        """Distinct classnames, referenced by ``classname_ids``."""
+        return self._classnames
+
+    @property
+    def classname_ids(self):
+        return self._classname_ids.numpy()
+
+    def classname(self, idx):
+        return self._classnames[self.classname_ids[idx]]
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.take(np.arange(len(self))[idx])
+        if isinstance(idx, (list, np.ndarray, torch.Tensor)):
+            return self.take(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"index {idx} out of range for {len(self)} items")
+        return Datum(
+            impath=self.impath(idx),
+            label=int(self.labels[idx]),
+            domain=int(self.domains[idx]),
+            classname=self.classname(idx),
+            check_file=False
+        )
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __add__(self, other):
+        if not isinstance(other, DatasetIndex):
+            other = DatasetIndex.from_items(other)
+        return DatasetIndex(
+            self.impaths + other.impaths,
+            np.concatenate([self.labels, other.labels]),
+            np.concatenate([self.domains, other.domains]),
+            [self.classname(i) for i in range(len(self))]
+            + [other.classname(i) for i in range(len(other))],
+        )
+
+    def take(self, indices):
+        """Return the index of the items at ``indices``, in that order."""
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        offsets = self._offsets.numpy()
+        starts = offsets[indices]
+        lengths = offsets[indices + 1] - starts
+        new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=new_offsets[1:])
+        # Position in the path table of every byte of the taken paths
+        positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+
+        index = DatasetIndex.__new__(DatasetIndex)
+        index._paths = torch.from_numpy(self._paths.numpy()[positions])
+        index._offsets = torch.from_numpy(new_offsets)
+        index._labels = torch.from_numpy(self.labels[indices])
+        index._domains = torch.from_numpy(self.domains[indices])
+        index._classnames = self._classnames
+        index._classname_ids = torch.from_numpy(self.classname_ids[indices])
+        return index
+
+    def missing_files(self, num_workers=32, chunk_size=1024):
+        """Return the image paths that are not files, checking chunks of
+        paths in parallel (stat calls release the GIL)."""
+        impaths = self.impaths
+        chunks = [impaths[i:i + chunk_size] for i in range(0, len(impaths), chunk_size)]
+
+        def _check(chunk):
+            return [impath for impath in chunk if not osp.isfile(impath)]
+
+        with ThreadPoolExecutor(num_workers) as pool:
+            return [impath for missing in pool.map(_check, chunks) for impath in missing]
+
+
 class DatasetBase:
     """A unified dataset class for
     1) domain adaptation
@@ -56,13 +208,48 @@ class DatasetBase:
     domains = []  # string names of all domains
 
     def __init__(self, train_x=None, train_u=None, val=None, test=None):
-        self._train_x = train_x  # labeled training data
-        self._train_u = train_u  # unlabeled training data (optional)
-        self._val = val  # validation data (optional)
-        self._test = test  # test data
+        # Splits given as lists of Datum objects are stored as DatasetIndex;
+        # a list passed for two splits (e.g. val=test) is converted once
+        converted = {}
+
+        def _index(data_source):
+            if data_source is None or isinstance(data_source, DatasetIndex):
+                return data_source
+            if id(data_source) not in converted:
+                converted[id(data_source)] = DatasetIndex.from_items(data_source)
+            return converted[id(data_source)]
+
+        self._train_x = _index(train_x)  # labeled training data
+        self._train_u = _index(train_u)  # unlabeled training data (optional)
+        self._val = _index(val)  # validation data (optional)
+        self._test = _index(test)  # test data
         self._num_classes = self.get_num_classes(train_x)
         self._lab2cname, self._classnames = self.get_lab2cname(train_x)
 
+    def save_splits(self, fpath):
+        """Save the splits, e.g. to skip reading and subsampling them with
+        from_splits() next time."""
+        splits = {
+            "train_x": self.train_x,
+            "train_u": self.train_u,
+            "val": self.val,
+            "test": self.test
+        }
+        tmp_fpath = f"{fpath}.{os.getpid()}.tmp"
+        with open(tmp_fpath, "wb") as f:
+            pickle.dump(splits, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fpath, fpath)
+
+    @classmethod
+    def from_splits(cls, fpath):
+        """Return a dataset of this class with the splits saved by
+        save_splits(), without running its __init__()."""
+        with open(fpath, "rb") as f:
+            splits = pickle.load(f)
+        dataset = cls.__new__(cls)
+        DatasetBase.__init__(dataset, **splits)
+        return dataset
+
     @property
     def train_x(self):
         return self._train_x
@@ -98,6 +285,8 @@ class DatasetBase:
         Args:
             data_source (list): a list of Datum objects.
         """
+        if isinstance(data_source, DatasetIndex):
+            return int(data_source.labels.max()) + 1
         label_set = set()
         for item in data_source:
             label_set.add(item.label)
@@ -110,15 +299,37 @@ class DatasetBase:
         Args:
             data_source (list): a list of Datum objects.
         """
-        container = set()
-        for item in data_source:
-            container.add((item.label, item.classname))
+        if isinstance(data_source, DatasetIndex):
+            container = set(zip(
+                data_source.labels.tolist(), data_source.classname_ids.tolist()
+            ))
+            container = {(label, data_source.classnames[i]) for label, i in container}
+        else:
+            container = set()
+            for item in data_source:
+                container.add((item.label, item.classname))
         mapping = {label: classname for label, classname in container}
         labels = list(mapping.keys())
         labels.sort()
         classnames = [mapping[label] for label in labels]
         return mapping, classnames
 
+    def check_files(self, num_workers=32):
+        """Raise FileNotFoundError if an image file of a split is missing.
+
+        The files are checked in parallel, which is much faster than one
+        stat per Datum on network storage.
+        """
+        data_sources = [self.train_x, self.train_u, self.val, self.test]
+        missing = set()
+        for data_source in {id(d): d for d in data_sources if d is not None}.values():
+            missing.update(data_source.missing_files(num_workers))
+        if missing:
+            missing = sorted(missing)
+            raise FileNotFoundError(
+                f"{len(missing)} image files are missing, e.g. {missing[:5]}"
+            )
+
     def check_input_domains(self, source_domains, target_domains):
         assert len(source_domains) > 0, "source_domains (list) is empty"
         assert len(target_domains) > 0, "target_domains (list) is empty"
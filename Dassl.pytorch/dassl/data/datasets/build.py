@@ -1,11 +1,115 @@
+import hashlib
+import os
+import os.path as osp
+import threading
+
 from dassl.utils import Registry, check_availability
 
 DATASET_REGISTRY = Registry("DATASET")
 
+_cache_key = None
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cache_datasets(key=None):
+    """Keep built datasets in memory under ``key(cfg)``, so that a process
+    building many trainers reads and splits every dataset once.
+
+    ``key`` must cover every config option the datasets depend on.
+    ``key=None`` disables the cache and drops the cached datasets.
+    """
+    global _cache_key
+    with _cache_lock:
+        _cache_key = key
+        _cache.clear()
+
+
+# DATASET options that do not change the splits
+_SPLIT_CACHE_IGNORED = ("SPLIT_CACHE_DIR", "CHECK_FILES")
+
+
+def _file_source(fpath):
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        return f"{fpath} missing"
+    return f"{fpath} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def split_sources(cfg):
+    """Return path, size and mtime of the files the splits of ``cfg`` are
+    read from: the files at the top of the dataset's directory (split JSON,
+    preprocessed pickles, class lists) and the few-shot split file."""
+    dataset_dir = getattr(DATASET_REGISTRY.get(cfg.DATASET.NAME), "dataset_dir", None)
+    if dataset_dir is None:
+        return []
+    root = osp.abspath(osp.expanduser(cfg.DATASET.ROOT))
+    dataset_dir = osp.join(root, dataset_dir)
+    cache_dir = osp.abspath(cfg.DATASET.SPLIT_CACHE_DIR)
+    sources = []
+    if osp.isdir(dataset_dir):
+        for name in sorted(os.listdir(dataset_dir)):
+            fpath = osp.join(dataset_dir, name)
+            if osp.isfile(fpath) and osp.dirname(fpath) != cache_dir:
+                sources.append(_file_source(fpath))
+    if cfg.DATASET.NUM_SHOTS >= 1:
+        fname = f"shot_{cfg.DATASET.NUM_SHOTS}-seed_{cfg.SEED}.pkl"
+        sources.append(_file_source(osp.join(dataset_dir, "split_fewshot", fname)))
+    return sources
+
+
+def split_cache_path(cfg):
+    """Return the file of DATASET.SPLIT_CACHE_DIR holding the splits built
+    for ``cfg``, or None if the cache is disabled."""
+    if not cfg.DATASET.SPLIT_CACHE_DIR:
+        return None
+    # The options the splits depend on: dataset options, seed (few-shot
+    # sampling) and, for the trainers that split by it, TRAINER.MODAL; and
+    # the files they are read from, so that regenerated splits are not
+    # loaded stale
+    dataset_cfg = cfg.DATASET.clone()
+    dataset_cfg.defrost()
+    for name in _SPLIT_CACHE_IGNORED:
+        dataset_cfg.pop(name)
+    options = [dataset_cfg.dump(), str(cfg.SEED), cfg.TRAINER.NAME, str(cfg.TRAINER.get("MODAL"))]
+    options += split_sources(cfg)
+    key = hashlib.sha1("\n".join(options).encode()).hexdigest()[:16]
+    return osp.join(cfg.DATASET.SPLIT_CACHE_DIR, f"{cfg.DATASET.NAME}_{key}.pkl")
+
+
+def _build_dataset(cfg):
+    dataset_cls = DATASET_REGISTRY.get(cfg.DATASET.NAME)
+    fpath = split_cache_path(cfg)
+    if fpath is not None and osp.isfile(fpath):
+        if cfg.VERBOSE:
+            print("Loading dataset: {} (splits from {})".format(cfg.DATASET.NAME, fpath))
+        dataset = dataset_cls.from_splits(fpath)
+    else:
+        if cfg.VERBOSE:
+            print("Loading dataset: {}".format(cfg.DATASET.NAME))
+        dataset = dataset_cls(cfg)
+        if fpath is not None:
+            # Building may have written split files (e.g. the few-shot
+            # split); the cache is keyed by their final state
+            fpath = split_cache_path(cfg)
+            os.makedirs(cfg.DATASET.SPLIT_CACHE_DIR, exist_ok=True)
+            dataset.save_splits(fpath)
+    if cfg.DATASET.CHECK_FILES:
+        dataset.check_files()
+    return dataset
+
 
 def build_dataset(cfg):
     avai_datasets = DATASET_REGISTRY.registered_names()
     check_availability(cfg.DATASET.NAME, avai_datasets)
-    if cfg.VERBOSE:
-        print("Loading dataset: {}".format(cfg.DATASET.NAME))
-    return DATASET_REGISTRY.get(cfg.DATASET.NAME)(cfg)
+    if _cache_key is None:
+        return _build_dataset(cfg)
+
+    key = _cache_key(cfg)
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = _build_dataset(cfg)
+        elif cfg.VERBOSE:
+            print("Reusing dataset: {}".format(cfg.DATASET.NAME))
+        return _cache[key]
@@ -2,7 +2,7 @@ import math
 import random
 import os.path as osp
 
-from dassl.utils import listdir_nohidden
+from dassl.utils import listdir_nohidden, scan_dirs
 
 from ..build import DATASET_REGISTRY
 from ..base_dataset import Datum, DatasetBase
@@ -44,11 +44,15 @@ class CIFAR10(DatasetBase):
         class_names = listdir_nohidden(data_dir)
         class_names.sort()
         num_labeled_per_class = num_labeled / len(class_names)
+        listings = scan_dirs(
+            [osp.join(data_dir, class_name) for class_name in class_names],
+            manifest=osp.join(self.dataset_dir, "dir_manifest.json")
+        )
         items_x, items_u, items_v = [], [], []
 
         for label, class_name in enumerate(class_names):
             class_dir = osp.join(data_dir, class_name)
-            imnames = listdir_nohidden(class_dir)
+            imnames = listings[class_dir]
 
             # Split into train and val following Oliver et al. 2018
             # Set cfg.DATASET.VAL_PERCENT to 0 to not use val data
@@ -61,7 +65,7 @@ class CIFAR10(DatasetBase):
 
             for i, imname in enumerate(imnames_train):
                 impath = osp.join(class_dir, imname)
-                item = Datum(impath=impath, label=label)
+                item = Datum(impath=impath, label=label, check_file=False)
 
                 if (i + 1) <= num_labeled_per_class:
                     items_x.append(item)
@@ -71,7 +75,7 @@ class CIFAR10(DatasetBase):
 
             for imname in imnames_val:
                 impath = osp.join(class_dir, imname)
-                item = Datum(impath=impath, label=label)
+                item = Datum(impath=impath, label=label, check_file=False)
                 items_v.append(item)
 
         return items_x, items_u, items_v
@@ -79,15 +83,19 @@ class CIFAR10(DatasetBase):
     def _read_data_test(self, data_dir):
         class_names = listdir_nohidden(data_dir)
         class_names.sort()
+        listings = scan_dirs(
+            [osp.join(data_dir, class_name) for class_name in class_names],
+            manifest=osp.join(self.dataset_dir, "dir_manifest.json")
+        )
         items = []
 
         for label, class_name in enumerate(class_names):
             class_dir = osp.join(data_dir, class_name)
-            imnames = listdir_nohidden(class_dir)
+            imnames = listings[class_dir]
 
             for imname in imnames:
                 impath = osp.join(class_dir, imname)
-                item = Datum(impath=impath, label=label)
+                item = Datum(impath=impath, label=label, check_file=False)
                 items.append(item)
 
         return items
@@ -0,0 +1,160 @@
+"""
+Decoded images cached as resized uint8 arrays.
+
+Every image of a data source is decoded once, its smaller edge resized to
+``size`` (as ``Resize(size)`` of the test transform does) and the HxWx3
+pixels are appended to memory-mapped shard files. An offset index maps each
+item to its pixels. Later epochs and later runs read the shards instead of
+decoding full-size JPEGs, then apply the usual random or center crops.
+A cache is keyed by the paths, sizes and mtimes of its images, so changed
+images get a new cache directory; the old one can be deleted.
+
+Layout of a cache directory:
+    shard_00000.bin, shard_00001.bin, ...  raw uint8 pixels
+    index.npy                              (N, 4) int64: shard, offset, height, width
+"""
+import hashlib
+import os
+import os.path as osp
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torchvision.transforms as T
+from PIL import Image
+from torch.utils.data import Dataset as TorchDataset
+
+from dassl.utils import read_image
+
+from .transforms import INTERPOLATION_MODES
+
+
+class _Decoder(TorchDataset):
+
+    def __init__(self, impaths, resize):
+        self.impaths = impaths
+        self.resize = resize
+
+    def __len__(self):
+        return len(self.impaths)
+
+    def __getitem__(self, idx):
+        img = self.resize(read_image(self.impaths[idx]))
+        return torch.from_numpy(np.array(img, dtype=np.uint8))
+
+
+class ImageCache:
+    """Read-only view of a built cache; ``cache[i]`` is the i-th image as a
+    PIL image."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = np.load(osp.join(directory, "index.npy"))
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        shard, offset, height, width = self.index[idx].tolist()
+        if shard not in self._shards:
+            # Opened lazily, so that every data loader worker maps the shards itself
+            path = osp.join(self.directory, f"shard_{shard:05d}.bin")
+            self._shards[shard] = np.memmap(path, dtype=np.uint8, mode="r")
+        pixels = self._shards[shard][offset:offset + height * width * 3]
+        return Image.fromarray(np.array(pixels).reshape(height, width, 3))
+
+    def __getstate__(self):
+        # Workers re-open the shards instead of pickling the mappings
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    @staticmethod
+    def key(impaths, size, interpolation, num_workers=32, chunk_size=4096):
+        """Hash of the cached images: their paths, sizes and mtimes (so that
+        an image replaced at the same path is decoded again) and the resize
+        options. The files are stat-ed in parallel chunks (stat calls release
+        the GIL)."""
+
+        def _stat(chunk):
+            stats = []
+            for impath in chunk:
+                try:
+                    stat = os.stat(impath)
+                    stats.append(f"{impath} {stat.st_size} {stat.st_mtime_ns}\n")
+                except OSError:
+                    stats.append(f"{impath} missing\n")
+            return stats
+
+        chunks = [impaths[i:i + chunk_size] for i in range(0, len(impaths), chunk_size)]
+        h = hashlib.sha1(f"{size} {interpolation}\n".encode())
+        with ThreadPoolExecutor(num_workers) as pool:
+            for stats in pool.map(_stat, chunks):
+                h.update("".join(stats).encode())
+        return h.hexdigest()[:16]
+
+    @classmethod
+    def build(cls, root, impaths, size, interpolation="bilinear", shard_mb=1024, num_workers=4):
+        """Return the cache of ``impaths`` under ``root``, decoding the images
+        first if it does not exist yet."""
+        directory = osp.join(root, cls.key(impaths, size, interpolation))
+        if osp.isfile(osp.join(directory, "index.npy")):
+            return cls(directory)
+
+        print(f"Caching {len(impaths):,} decoded images (smaller edge {size}) in {directory}")
+        resize = T.Resize(size, interpolation=INTERPOLATION_MODES[interpolation])
+        loader = torch.utils.data.DataLoader(
+            _Decoder(impaths, resize), batch_size=None, num_workers=num_workers
+        )
+
+        tmp_dir = f"{directory}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        shard_bytes = shard_mb * 2**20
+        index = np.zeros((len(impaths), 4), dtype=np.int64)
+        shard, offset = 0, 0
+        f = open(osp.join(tmp_dir, f"shard_{shard:05d}.bin"), "wb")
+        try:
+            for i, pixels in enumerate(loader):
+                nbytes = pixels.numel()
+                if offset > 0 and offset + nbytes > shard_bytes:
+                    f.close()
+                    shard, offset = shard + 1, 0
+                    f = open(osp.join(tmp_dir, f"shard_{shard:05d}.bin"), "wb")
+                f.write(pixels.numpy().tobytes())
+                index[i] = [shard, offset, pixels.shape[0], pixels.shape[1]]
+                offset += nbytes
+        finally:
+            f.close()
+        np.save(osp.join(tmp_dir, "index.npy"), index)
+
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Built concurrently by another process
+            shutil.rmtree(tmp_dir)
+        return cls(directory)
+
+
+def build_image_cache(cfg, data_source, is_train=False):
+    """Return the ImageCache of ``data_source`` if DATALOADER.IMAGE_CACHE.DIR
+    is set, else None.
+
+    Training data is only cached at an explicit IMAGE_CACHE.SIZE: random
+    crops taken from images resized to the output size would lose most of
+    their resolution.
+    """
+    cache_cfg = cfg.DATALOADER.IMAGE_CACHE
+    if not cache_cfg.DIR or not data_source:
+        return None
+    if is_train and cache_cfg.SIZE <= 0:
+        return None
+    size = cache_cfg.SIZE if cache_cfg.SIZE > 0 else max(cfg.INPUT.SIZE)
+    return ImageCache.build(
+        cache_cfg.DIR,
+        [item.impath for item in data_source],
+        size,
+        interpolation=cfg.INPUT.INTERPOLATION,
+        shard_mb=cache_cfg.SHARD_MB,
+        num_workers=cfg.DATALOADER.NUM_WORKERS,
+    )
@@ -0,0 +1,155 @@
+"""
+Prepare the next batches of a data loader on a background thread, so that
+moving them to the device overlaps with the training step.
+
+Only image batches (4-D tensors, also inside lists such as the K_TRANSFORMS
+images) are prepared: they are pinned, copied to the device and converted
+(e.g. by the DATALOADER.UINT8 input transform). On CUDA this runs on a side
+stream; the training stream waits for a batch's copies only when it takes
+the batch. Labels, domains and the other small fields stay on the host.
+"""
+import queue
+import threading
+import contextlib
+import torch
+
+_END = object()
+
+
+class _Error:
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def map_images(batch, fn):
+    """Apply ``fn`` to the image tensors (4-D) of a (nested) batch."""
+    if torch.is_tensor(batch):
+        return fn(batch) if batch.dim() == 4 else batch
+    if isinstance(batch, dict):
+        return {k: map_images(v, fn) for k, v in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(map_images(v, fn) for v in batch)
+    return batch
+
+
+def _prepare(img, device, convert):
+    if device.type == "cuda" and not img.is_pinned():
+        img = img.pin_memory()
+    img = img.to(device, non_blocking=True)
+    if convert is not None:
+        img = convert(img)
+    return img
+
+
+def _put(out_queue, stop, item):
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(loader, out_queue, stop, device, convert):
+    # Runs on the background thread; it holds no reference to the
+    # Prefetcher, so that dropping the Prefetcher stops it
+    stream = None
+    context = contextlib.nullcontext()
+    if device.type == "cuda":
+        stream = torch.cuda.Stream(device)
+        context = torch.cuda.stream(stream)
+    prepare = lambda img: _prepare(img, device, convert)
+    try:
+        with context:
+            for batch in loader:
+                batch = map_images(batch, prepare)
+                event = None
+                if stream is not None:
+                    event = torch.cuda.Event()
+                    event.record(stream)
+                if not _put(out_queue, stop, (batch, event)):
+                    return
+    except Exception as exc:
+        _put(out_queue, stop, _Error(exc))
+        return
+    _put(out_queue, stop, _END)
+
+
+class Prefetcher:
+    """Iterate once over ``loader`` with up to ``num_batches`` batches
+    prepared ahead on a background thread.
+
+    With ``num_batches=0`` the batches are passed through unchanged, as by
+    iterating over ``loader`` itself.
+
+    Args:
+        loader (iterable): data loader.
+        device (torch.device): device the image batches are moved to.
+        num_batches (int): number of batches prepared ahead.
+        convert (callable, optional): applied to every image batch on the
+            device.
+    """
+
+    def __init__(self, loader, device, num_batches=2, convert=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_batches = num_batches
+        self.convert = convert
+        self._iter = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._queue = queue.Queue(maxsize=max(1, num_batches))
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self._iter is None and self._thread is None:
+            if self.num_batches > 0:
+                self._thread = threading.Thread(
+                    target=_produce,
+                    args=(
+                        self.loader, self._queue, self._stop, self.device,
+                        self.convert
+                    ),
+                    daemon=True
+                )
+                self._thread.start()
+            else:
+                self._iter = iter(self.loader)
+        return self
+
+    def __next__(self):
+        if self._thread is None:
+            if self._iter is None:
+                iter(self)
+            return next(self._iter)
+
+        item = self._queue.get()
+        if item is _END:
+            self._queue.put(_END)
+            raise StopIteration
+        if isinstance(item, _Error):
+            self._queue.put(item)
+            raise item.exc
+
+        batch, event = item
+        if event is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(event)
+            # The batch is now used on the training stream
+            map_images(batch, lambda img: img.record_stream(stream))
+        return batch
+
+    def close(self):
+        """Stop the background thread, e.g. when the iteration is left
+        before the end of the loader."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self._iter = None
+
+    def __del__(self):
+        self._stop.set()
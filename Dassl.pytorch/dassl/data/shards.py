@@ -0,0 +1,145 @@
+"""
+Dataset splits packed into large tar shards that are read sequentially.
+
+``write_shards`` copies the image files of a data source, byte for byte, into
+tar files of about ``shard_mb`` MB. Every image is preceded by a JSON record
+of its Datum (index, impath, label, domain, classname), so labels, domains
+and class names are exactly those of the Datum-based path. Training then
+streams whole shards instead of opening one small file per image.
+
+Layout of a shard directory:
+    shard_00000.tar, shard_00001.tar, ...  00000000.json, 00000000.jpg, ...
+    index.json                             number of items and items per shard
+
+The directory is named after ``split_key(data_source)``, which covers the
+order, paths and labels of the items, so a data loader only picks up shards
+written from the very same split.
+"""
+import io
+import os
+import json
+import random
+import hashlib
+import os.path as osp
+import shutil
+import tarfile
+import torch
+from torch.utils.data import get_worker_info
+
+
+def split_key(data_source):
+    h = hashlib.sha1()
+    for item in data_source:
+        record = f"{item.impath}\t{item.label}\t{item.domain}\t{item.classname}\n"
+        h.update(record.encode())
+    return h.hexdigest()[:16]
+
+
+def _add_file(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(root, data_source, shard_mb=1024):
+    """Pack ``data_source`` into tar shards under ``root`` and return their
+    directory. Existing shards of the same split are kept."""
+    directory = osp.join(root, split_key(data_source))
+    if osp.isfile(osp.join(directory, "index.json")):
+        return directory
+
+    print(f"Packing {len(data_source):,} images into shards in {directory}")
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    shard_bytes = shard_mb * 2**20
+    shards = []
+    tar, nbytes = None, 0
+    try:
+        for idx, item in enumerate(data_source):
+            if tar is None or nbytes >= shard_bytes:
+                if tar is not None:
+                    tar.close()
+                name = f"shard_{len(shards):05d}.tar"
+                tar = tarfile.open(osp.join(tmp_dir, name), "w")
+                shards.append({"name": name, "count": 0})
+                nbytes = 0
+
+            record = {
+                "index": idx,
+                "impath": item.impath,
+                "label": item.label,
+                "domain": item.domain,
+                "classname": item.classname,
+            }
+            record = json.dumps(record).encode()
+            with open(item.impath, "rb") as f:
+                data = f.read()
+            ext = osp.splitext(item.impath)[1].lower()
+            _add_file(tar, f"{idx:08d}.json", record)
+            _add_file(tar, f"{idx:08d}{ext}", data)
+            shards[-1]["count"] += 1
+            nbytes += len(record) + len(data)
+    finally:
+        if tar is not None:
+            tar.close()
+
+    with open(osp.join(tmp_dir, "index.json"), "w") as f:
+        json.dump({"num_items": len(data_source), "shards": shards}, f, indent=2)
+
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Written concurrently by another process
+        shutil.rmtree(tmp_dir)
+    return directory
+
+
+def find_shards(root, data_source):
+    """Return the shard directory of ``data_source`` under ``root``, or None
+    if it has not been written."""
+    directory = osp.join(root, split_key(data_source))
+    if osp.isfile(osp.join(directory, "index.json")):
+        return directory
+    return None
+
+
+def epoch_seed():
+    """Return (seed, worker id, number of workers) of the current epoch;
+    every worker of an epoch gets the same seed."""
+    info = get_worker_info()
+    if info is None:
+        seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        return seed, 0, 1
+    # Workers are seeded with base_seed + worker id, base_seed being new every epoch
+    return info.seed - info.id, info.id, info.num_workers
+
+
+class ShardSampler:
+    """Order in which the data loader workers read the shards.
+
+    Shards are dealt round-robin to the workers. With ``shuffle=True`` the
+    shard order is drawn anew every epoch; all workers of an epoch draw the
+    same permutation, so that together they read every shard once.
+    """
+
+    def __init__(self, num_shards, shuffle=False):
+        self.num_shards = num_shards
+        self.shuffle = shuffle
+
+    def worker_shards(self, seed, worker_id, num_workers):
+        order = list(range(self.num_shards))
+        if self.shuffle:
+            random.Random(seed).shuffle(order)
+        return order[worker_id::num_workers]
+
+
+def read_shard(path):
+    """Yield (record, image bytes) of the items of one shard, in order."""
+    with tarfile.open(path, "r|") as tar:
+        record = None
+        for member in tar:
+            data = tar.extractfile(member).read()
+            if member.name.endswith(".json"):
+                record = json.loads(data)
+            else:
+                yield record, data
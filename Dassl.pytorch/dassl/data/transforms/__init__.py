@@ -1 +1,6 @@
-from .transforms import INTERPOLATION_MODES, build_transform
+from .transforms import (
+    INTERPOLATION_MODES, decode_size, build_transform, build_input_transform
+)
+from .batch_transforms import (
+    build_batch_transform, build_precrop_transform, build_weak_strong_transforms
+)
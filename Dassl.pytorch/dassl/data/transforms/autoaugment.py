@@ -5,6 +5,109 @@ import numpy as np
 import random
 from PIL import Image, ImageOps, ImageEnhance
 
+# Sub-policies: (p1, operation1, magnitude_idx1, p2, operation2, magnitude_idx2)
+IMAGENET_POLICIES = [
+    (0.4, "posterize", 8, 0.6, "rotate", 9),
+    (0.6, "solarize", 5, 0.6, "autocontrast", 5),
+    (0.8, "equalize", 8, 0.6, "equalize", 3),
+    (0.6, "posterize", 7, 0.6, "posterize", 6),
+    (0.4, "equalize", 7, 0.2, "solarize", 4),
+    (0.4, "equalize", 4, 0.8, "rotate", 8),
+    (0.6, "solarize", 3, 0.6, "equalize", 7),
+    (0.8, "posterize", 5, 1.0, "equalize", 2),
+    (0.2, "rotate", 3, 0.6, "solarize", 8),
+    (0.6, "equalize", 8, 0.4, "posterize", 6),
+    (0.8, "rotate", 8, 0.4, "color", 0),
+    (0.4, "rotate", 9, 0.6, "equalize", 2),
+    (0.0, "equalize", 7, 0.8, "equalize", 8),
+    (0.6, "invert", 4, 1.0, "equalize", 8),
+    (0.6, "color", 4, 1.0, "contrast", 8),
+    (0.8, "rotate", 8, 1.0, "color", 2),
+    (0.8, "color", 8, 0.8, "solarize", 7),
+    (0.4, "sharpness", 7, 0.6, "invert", 8),
+    (0.6, "shearX", 5, 1.0, "equalize", 9),
+    (0.4, "color", 0, 0.6, "equalize", 3),
+    (0.4, "equalize", 7, 0.2, "solarize", 4),
+    (0.6, "solarize", 5, 0.6, "autocontrast", 5),
+    (0.6, "invert", 4, 1.0, "equalize", 8),
+    (0.6, "color", 4, 1.0, "contrast", 8),
+    (0.8, "equalize", 8, 0.6, "equalize", 3),
+]
+
+CIFAR10_POLICIES = [
+    (0.1, "invert", 7, 0.2, "contrast", 6),
+    (0.7, "rotate", 2, 0.3, "translateX", 9),
+    (0.8, "sharpness", 1, 0.9, "sharpness", 3),
+    (0.5, "shearY", 8, 0.7, "translateY", 9),
+    (0.5, "autocontrast", 8, 0.9, "equalize", 2),
+    (0.2, "shearY", 7, 0.3, "posterize", 7),
+    (0.4, "color", 3, 0.6, "brightness", 7),
+    (0.3, "sharpness", 9, 0.7, "brightness", 9),
+    (0.6, "equalize", 5, 0.5, "equalize", 1),
+    (0.6, "contrast", 7, 0.6, "sharpness", 5),
+    (0.7, "color", 7, 0.5, "translateX", 8),
+    (0.3, "equalize", 7, 0.4, "autocontrast", 8),
+    (0.4, "translateY", 3, 0.2, "sharpness", 6),
+    (0.9, "brightness", 6, 0.2, "color", 8),
+    (0.5, "solarize", 2, 0.0, "invert", 3),
+    (0.2, "equalize", 0, 0.6, "autocontrast", 0),
+    (0.2, "equalize", 8, 0.6, "equalize", 4),
+    (0.9, "color", 9, 0.6, "equalize", 6),
+    (0.8, "autocontrast", 4, 0.2, "solarize", 8),
+    (0.1, "brightness", 3, 0.7, "color", 0),
+    (0.4, "solarize", 5, 0.9, "autocontrast", 3),
+    (0.9, "translateY", 9, 0.7, "translateY", 9),
+    (0.9, "autocontrast", 2, 0.8, "solarize", 3),
+    (0.8, "equalize", 8, 0.1, "invert", 3),
+    (0.7, "translateY", 9, 0.9, "autocontrast", 1),
+]
+
+SVHN_POLICIES = [
+    (0.9, "shearX", 4, 0.2, "invert", 3),
+    (0.9, "shearY", 8, 0.7, "invert", 5),
+    (0.6, "equalize", 5, 0.6, "solarize", 6),
+    (0.9, "invert", 3, 0.6, "equalize", 3),
+    (0.6, "equalize", 1, 0.9, "rotate", 3),
+    (0.9, "shearX", 4, 0.8, "autocontrast", 3),
+    (0.9, "shearY", 8, 0.4, "invert", 5),
+    (0.9, "shearY", 5, 0.2, "solarize", 6),
+    (0.9, "invert", 6, 0.8, "autocontrast", 1),
+    (0.6, "equalize", 3, 0.9, "rotate", 3),
+    (0.9, "shearX", 4, 0.3, "solarize", 3),
+    (0.8, "shearY", 8, 0.7, "invert", 4),
+    (0.9, "equalize", 5, 0.6, "translateY", 6),
+    (0.9, "invert", 4, 0.6, "equalize", 7),
+    (0.3, "contrast", 3, 0.8, "rotate", 4),
+    (0.8, "invert", 5, 0.0, "translateY", 2),
+    (0.7, "shearY", 6, 0.4, "solarize", 8),
+    (0.6, "invert", 4, 0.8, "rotate", 4),
+    (0.3, "shearY", 7, 0.9, "translateX", 3),
+    (0.1, "shearX", 6, 0.6, "invert", 5),
+    (0.7, "solarize", 2, 0.6, "translateY", 7),
+    (0.8, "shearY", 4, 0.8, "invert", 8),
+    (0.7, "shearX", 9, 0.8, "translateY", 3),
+    (0.8, "shearY", 5, 0.7, "autocontrast", 3),
+    (0.7, "shearX", 2, 0.1, "invert", 5),
+]
+
+# Magnitude of every operation for magnitude_idx 0-9
+MAGNITUDE_RANGES = {
+    "shearX": np.linspace(0, 0.3, 10),
+    "shearY": np.linspace(0, 0.3, 10),
+    "translateX": np.linspace(0, 150 / 331, 10),
+    "translateY": np.linspace(0, 150 / 331, 10),
+    "rotate": np.linspace(0, 30, 10),
+    "color": np.linspace(0.0, 0.9, 10),
+    "posterize": np.round(np.linspace(8, 4, 10), 0).astype(int),
+    "solarize": np.linspace(256, 0, 10),
+    "contrast": np.linspace(0.0, 0.9, 10),
+    "sharpness": np.linspace(0.0, 0.9, 10),
+    "brightness": np.linspace(0.0, 0.9, 10),
+    "autocontrast": [0] * 10,
+    "equalize": [0] * 10,
+    "invert": [0] * 10,
+}
+
 
 class ImageNetPolicy:
     """Randomly choose one of the best 24 Sub-policies on ImageNet.
@@ -21,33 +124,7 @@ class ImageNetPolicy:
     """
 
     def __init__(self, fillcolor=(128, 128, 128)):
-        self.policies = [
-            SubPolicy(0.4, "posterize", 8, 0.6, "rotate", 9, fillcolor),
-            SubPolicy(0.6, "solarize", 5, 0.6, "autocontrast", 5, fillcolor),
-            SubPolicy(0.8, "equalize", 8, 0.6, "equalize", 3, fillcolor),
-            SubPolicy(0.6, "posterize", 7, 0.6, "posterize", 6, fillcolor),
-            SubPolicy(0.4, "equalize", 7, 0.2, "solarize", 4, fillcolor),
-            SubPolicy(0.4, "equalize", 4, 0.8, "rotate", 8, fillcolor),
-            SubPolicy(0.6, "solarize", 3, 0.6, "equalize", 7, fillcolor),
-            SubPolicy(0.8, "posterize", 5, 1.0, "equalize", 2, fillcolor),
-            SubPolicy(0.2, "rotate", 3, 0.6, "solarize", 8, fillcolor),
-            SubPolicy(0.6, "equalize", 8, 0.4, "posterize", 6, fillcolor),
-            SubPolicy(0.8, "rotate", 8, 0.4, "color", 0, fillcolor),
-            SubPolicy(0.4, "rotate", 9, 0.6, "equalize", 2, fillcolor),
-            SubPolicy(0.0, "equalize", 7, 0.8, "equalize", 8, fillcolor),
-            SubPolicy(0.6, "invert", 4, 1.0, "equalize", 8, fillcolor),
-            SubPolicy(0.6, "color", 4, 1.0, "contrast", 8, fillcolor),
-            SubPolicy(0.8, "rotate", 8, 1.0, "color", 2, fillcolor),
-            SubPolicy(0.8, "color", 8, 0.8, "solarize", 7, fillcolor),
-            SubPolicy(0.4, "sharpness", 7, 0.6, "invert", 8, fillcolor),
-            SubPolicy(0.6, "shearX", 5, 1.0, "equalize", 9, fillcolor),
-            SubPolicy(0.4, "color", 0, 0.6, "equalize", 3, fillcolor),
-            SubPolicy(0.4, "equalize", 7, 0.2, "solarize", 4, fillcolor),
-            SubPolicy(0.6, "solarize", 5, 0.6, "autocontrast", 5, fillcolor),
-            SubPolicy(0.6, "invert", 4, 1.0, "equalize", 8, fillcolor),
-            SubPolicy(0.6, "color", 4, 1.0, "contrast", 8, fillcolor),
-            SubPolicy(0.8, "equalize", 8, 0.6, "equalize", 3, fillcolor),
-        ]
+        self.policies = [SubPolicy(*policy, fillcolor) for policy in IMAGENET_POLICIES]
 
     def __call__(self, img):
         policy_idx = random.randint(0, len(self.policies) - 1)
@@ -72,33 +149,7 @@ class CIFAR10Policy:
     """
 
     def __init__(self, fillcolor=(128, 128, 128)):
-        self.policies = [
-            SubPolicy(0.1, "invert", 7, 0.2, "contrast", 6, fillcolor),
-            SubPolicy(0.7, "rotate", 2, 0.3, "translateX", 9, fillcolor),
-            SubPolicy(0.8, "sharpness", 1, 0.9, "sharpness", 3, fillcolor),
-            SubPolicy(0.5, "shearY", 8, 0.7, "translateY", 9, fillcolor),
-            SubPolicy(0.5, "autocontrast", 8, 0.9, "equalize", 2, fillcolor),
-            SubPolicy(0.2, "shearY", 7, 0.3, "posterize", 7, fillcolor),
-            SubPolicy(0.4, "color", 3, 0.6, "brightness", 7, fillcolor),
-            SubPolicy(0.3, "sharpness", 9, 0.7, "brightness", 9, fillcolor),
-            SubPolicy(0.6, "equalize", 5, 0.5, "equalize", 1, fillcolor),
-            SubPolicy(0.6, "contrast", 7, 0.6, "sharpness", 5, fillcolor),
-            SubPolicy(0.7, "color", 7, 0.5, "translateX", 8, fillcolor),
-            SubPolicy(0.3, "equalize", 7, 0.4, "autocontrast", 8, fillcolor),
-            SubPolicy(0.4, "translateY", 3, 0.2, "sharpness", 6, fillcolor),
-            SubPolicy(0.9, "brightness", 6, 0.2, "color", 8, fillcolor),
-            SubPolicy(0.5, "solarize", 2, 0.0, "invert", 3, fillcolor),
-            SubPolicy(0.2, "equalize", 0, 0.6, "autocontrast", 0, fillcolor),
-            SubPolicy(0.2, "equalize", 8, 0.6, "equalize", 4, fillcolor),
-            SubPolicy(0.9, "color", 9, 0.6, "equalize", 6, fillcolor),
-            SubPolicy(0.8, "autocontrast", 4, 0.2, "solarize", 8, fillcolor),
-            SubPolicy(0.1, "brightness", 3, 0.7, "color", 0, fillcolor),
-            SubPolicy(0.4, "solarize", 5, 0.9, "autocontrast", 3, fillcolor),
-            SubPolicy(0.9, "translateY", 9, 0.7, "translateY", 9, fillcolor),
-            SubPolicy(0.9, "autocontrast", 2, 0.8, "solarize", 3, fillcolor),
-            SubPolicy(0.8, "equalize", 8, 0.1, "invert", 3, fillcolor),
-            SubPolicy(0.7, "translateY", 9, 0.9, "autocontrast", 1, fillcolor),
-        ]
+        self.policies = [SubPolicy(*policy, fillcolor) for policy in CIFAR10_POLICIES]
 
     def __call__(self, img):
         policy_idx = random.randint(0, len(self.policies) - 1)
@@ -123,33 +174,7 @@ class SVHNPolicy:
     """
 
     def __init__(self, fillcolor=(128, 128, 128)):
-        self.policies = [
-            SubPolicy(0.9, "shearX", 4, 0.2, "invert", 3, fillcolor),
-            SubPolicy(0.9, "shearY", 8, 0.7, "invert", 5, fillcolor),
-            SubPolicy(0.6, "equalize", 5, 0.6, "solarize", 6, fillcolor),
-            SubPolicy(0.9, "invert", 3, 0.6, "equalize", 3, fillcolor),
-            SubPolicy(0.6, "equalize", 1, 0.9, "rotate", 3, fillcolor),
-            SubPolicy(0.9, "shearX", 4, 0.8, "autocontrast", 3, fillcolor),
-            SubPolicy(0.9, "shearY", 8, 0.4, "invert", 5, fillcolor),
-            SubPolicy(0.9, "shearY", 5, 0.2, "solarize", 6, fillcolor),
-            SubPolicy(0.9, "invert", 6, 0.8, "autocontrast", 1, fillcolor),
-            SubPolicy(0.6, "equalize", 3, 0.9, "rotate", 3, fillcolor),
-            SubPolicy(0.9, "shearX", 4, 0.3, "solarize", 3, fillcolor),
-            SubPolicy(0.8, "shearY", 8, 0.7, "invert", 4, fillcolor),
-            SubPolicy(0.9, "equalize", 5, 0.6, "translateY", 6, fillcolor),
-            SubPolicy(0.9, "invert", 4, 0.6, "equalize", 7, fillcolor),
-            SubPolicy(0.3, "contrast", 3, 0.8, "rotate", 4, fillcolor),
-            SubPolicy(0.8, "invert", 5, 0.0, "translateY", 2, fillcolor),
-            SubPolicy(0.7, "shearY", 6, 0.4, "solarize", 8, fillcolor),
-            SubPolicy(0.6, "invert", 4, 0.8, "rotate", 4, fillcolor),
-            SubPolicy(0.3, "shearY", 7, 0.9, "translateX", 3, fillcolor),
-            SubPolicy(0.1, "shearX", 6, 0.6, "invert", 5, fillcolor),
-            SubPolicy(0.7, "solarize", 2, 0.6, "translateY", 7, fillcolor),
-            SubPolicy(0.8, "shearY", 4, 0.8, "invert", 8, fillcolor),
-            SubPolicy(0.7, "shearX", 9, 0.8, "translateY", 3, fillcolor),
-            SubPolicy(0.8, "shearY", 5, 0.7, "autocontrast", 3, fillcolor),
-            SubPolicy(0.7, "shearX", 2, 0.1, "invert", 5, fillcolor),
-        ]
+        self.policies = [SubPolicy(*policy, fillcolor) for policy in SVHN_POLICIES]
 
     def __call__(self, img):
         policy_idx = random.randint(0, len(self.policies) - 1)
@@ -171,22 +196,7 @@ class SubPolicy(object):
         magnitude_idx2,
         fillcolor=(128, 128, 128),
     ):
-        ranges = {
-            "shearX": np.linspace(0, 0.3, 10),
-            "shearY": np.linspace(0, 0.3, 10),
-            "translateX": np.linspace(0, 150 / 331, 10),
-            "translateY": np.linspace(0, 150 / 331, 10),
-            "rotate": np.linspace(0, 30, 10),
-            "color": np.linspace(0.0, 0.9, 10),
-            "posterize": np.round(np.linspace(8, 4, 10), 0).astype(np.int),
-            "solarize": np.linspace(256, 0, 10),
-            "contrast": np.linspace(0.0, 0.9, 10),
-            "sharpness": np.linspace(0.0, 0.9, 10),
-            "brightness": np.linspace(0.0, 0.9, 10),
-            "autocontrast": [0] * 10,
-            "equalize": [0] * 10,
-            "invert": [0] * 10,
-        }
+        ranges = MAGNITUDE_RANGES
 
         # from https://stackoverflow.com/questions/5252170/specify-image-filling-color-when-rotating-in-python-with-pil-and-setting-expand
         def rotate_with_fill(img, magnitude):
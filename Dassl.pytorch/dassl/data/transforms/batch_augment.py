@@ -0,0 +1,369 @@
+"""
+RandAugment and AutoAugment on batches (see INPUT.BATCH_TRANSFORM).
+
+Batched counterparts of randaugment.py and autoaugment.py: every sample
+draws its own operations, magnitudes and signs as in the PIL versions, then
+the samples that drew the same operation are processed together, one call
+per operation (see ``apply_grouped``). Images are float tensors in [0, 1] of
+shape (B, 3, H, W), rounded to 1/255 steps after every operation like the
+uint8 PIL images.
+"""
+import math
+import torch
+import torch.nn.functional as F
+
+from .autoaugment import (
+    SVHN_POLICIES, CIFAR10_POLICIES, MAGNITUDE_RANGES, IMAGENET_POLICIES
+)
+from .batch_transforms import apply_grouped
+
+
+def quantize(imgs):
+    return imgs.mul(255).round_().div_(255)
+
+
+def _grayscale(imgs):
+    # PIL's "L" conversion in fixed point (exact in float32)
+    r, g, b = imgs.mul(255).round().unbind(dim=1)
+    gray = torch.floor((19595*r + 38470*g + 7471*b + 32768) / 65536)
+    return gray.unsqueeze(1) / 255
+
+
+def _enhance(degenerate, imgs, factors):
+    # PIL.ImageEnhance: degenerate + factor * (image - degenerate) on the
+    # 0-255 levels, truncated like Image.blend
+    degenerate = degenerate.mul(255).round()
+    factors = factors.view(-1, 1, 1, 1).to(imgs.dtype)
+    out = degenerate + factors * (imgs.mul(255).round() - degenerate)
+    return out.clamp_(0, 255).floor_().div_(255)
+
+
+def _random_sign(v):
+    return torch.where(torch.rand_like(v) < 0.5, -v, v)
+
+
+def _cubic_weights(d):
+    # PIL's cubic convolution kernel (a = -1) at offsets -1, 0, 1, 2
+    d2, d3 = d * d, d * d * d
+    return [-d + 2*d2 - d3, 1 - 2*d2 + d3, d + d2 - d3, d3 - d2]
+
+
+def _bicubic_sample(imgs, grid):
+    """Bicubic sampling as in PIL's Image.transform: the 4x4 neighbourhood
+    is clamped at the borders and the result truncated to integer levels."""
+    B, C, H, W = imgs.shape
+    u = ((grid[..., 0] + 1) * W - 1) / 2
+    v = ((grid[..., 1] + 1) * H - 1) / 2
+    x0, y0 = u.floor(), v.floor()
+    wx = _cubic_weights((u - x0).unsqueeze(1))
+    wy = _cubic_weights((v - y0).unsqueeze(1))
+    flat = imgs.reshape(B, C, H * W)
+    out = 0
+    for j in range(4):
+        y = (y0 + j - 1).clamp(0, H - 1).long()
+        row = 0
+        for i in range(4):
+            x = (x0 + i - 1).clamp(0, W - 1).long()
+            idx = (y*W + x).view(B, 1, -1).expand(-1, C, -1)
+            row = row + wx[i] * flat.gather(2, idx).view(B, C, *u.shape[1:])
+        out = out + wy[j] * row
+    return out.mul(255).floor_().clamp_(0, 255).div_(255)
+
+
+def affine(imgs, matrix, fill=0, mode="nearest"):
+    """PIL's Image.transform(size, AFFINE, data) for a batch: ``matrix``
+    (B, 2, 3) maps output to input pixel coordinates; pixels mapped outside
+    the input get the gray level ``fill`` (0-255). ``mode`` is "nearest" or
+    "bicubic"."""
+    B, _, H, W = imgs.shape
+    # Pixel coordinates to grid_sample's [-1, 1] coordinates
+    to_grid = imgs.new_tensor([[2 / W, 0, -1], [0, 2 / H, -1], [0, 0, 1]])
+    bottom = imgs.new_tensor([0, 0, 1]).expand(B, 1, 3)
+    matrix = torch.cat([matrix.to(imgs.dtype), bottom], dim=1)
+    theta = (to_grid @ matrix @ torch.linalg.inv(to_grid))[:, :2]
+
+    grid = F.affine_grid(theta, list(imgs.shape), align_corners=False)
+    if mode == "bicubic":
+        imgs = _bicubic_sample(imgs, grid)
+    else:
+        imgs = F.grid_sample(imgs, grid, mode=mode, padding_mode="border", align_corners=False)
+    outside = ((grid < -1) | (grid >= 1)).any(dim=3).unsqueeze(1)
+    return torch.where(outside, imgs.new_tensor(fill / 255), imgs)
+
+
+def _affine_matrix(v, entry):
+    matrix = v.new_tensor([[1, 0, 0], [0, 1, 0]]).repeat(len(v), 1, 1)
+    matrix[:, entry[0], entry[1]] = v
+    return matrix
+
+
+def shear_x(imgs, v, fill=0, mode="nearest"):
+    return affine(imgs, _affine_matrix(v, (0, 1)), fill, mode)
+
+
+def shear_y(imgs, v, fill=0, mode="nearest"):
+    return affine(imgs, _affine_matrix(v, (1, 0)), fill, mode)
+
+
+def translate_x(imgs, v, fill=0):
+    # v in pixels
+    return affine(imgs, _affine_matrix(v, (0, 2)), fill)
+
+
+def translate_y(imgs, v, fill=0):
+    return affine(imgs, _affine_matrix(v, (1, 2)), fill)
+
+
+def rotate(imgs, v, fill=0):
+    """PIL's Image.rotate(v) (degrees, counter-clockwise, about the center)."""
+    H, W = imgs.shape[2:]
+    a = -v * math.pi / 180
+    cos, sin = torch.cos(a), torch.sin(a)
+    cx, cy = W / 2, H / 2
+    matrix = torch.stack([
+        torch.stack([cos, sin, cx - cos * cx - sin * cy], dim=1),
+        torch.stack([-sin, cos, cy + sin * cx - cos * cy], dim=1),
+    ], dim=1)
+    return affine(imgs, matrix, fill)
+
+
+def brightness(imgs, v):
+    return _enhance(torch.zeros_like(imgs), imgs, v)
+
+
+def color(imgs, v):
+    return _enhance(_grayscale(imgs), imgs, v)
+
+
+def contrast(imgs, v):
+    mean = quantize(_grayscale(imgs).mean(dim=(1, 2, 3), keepdim=True))
+    return _enhance(mean, imgs, v)
+
+
+def sharpness(imgs, v):
+    # PIL's SMOOTH filter; the border pixels are kept
+    kernel = imgs.new_tensor([[1, 1, 1], [1, 5, 1], [1, 1, 1]]) / 13
+    kernel = kernel.expand(imgs.shape[1], 1, 3, 3)
+    smooth = quantize(F.conv2d(imgs, kernel, groups=imgs.shape[1]))
+    degenerate = imgs.clone()
+    degenerate[:, :, 1:-1, 1:-1] = smooth
+    return _enhance(degenerate, imgs, v)
+
+
+def autocontrast(imgs, v=None):
+    """PIL.ImageOps.autocontrast: stretch every channel to the full range."""
+    levels = imgs.mul(255).round().double()
+    lo = levels.amin(dim=(2, 3), keepdim=True)
+    hi = levels.amax(dim=(2, 3), keepdim=True)
+    # Same lookup table as PIL, computed in double and truncated
+    scale = torch.full_like(hi, 255) / (hi - lo).clamp(min=1)
+    out = (levels*scale - lo*scale).clamp(0, 255).floor()
+    return torch.where(hi > lo, out, levels).to(imgs.dtype) / 255
+
+
+def equalize(imgs, v=None):
+    """PIL.ImageOps.equalize: histogram equalization of every channel."""
+    B, C, H, W = imgs.shape
+    levels = imgs.mul(255).round().long().reshape(B * C, H * W)
+    hist = torch.zeros(B * C, 256, dtype=torch.long, device=imgs.device)
+    hist.scatter_add_(1, levels, torch.ones_like(levels))
+
+    # step = (number of pixels - count of the highest level present) // 255
+    highest = 255 - torch.argmax((hist.flip(1) > 0).long(), dim=1, keepdim=True)
+    step = (H * W - hist.gather(1, highest)) // 255
+    cumsum = torch.cumsum(hist, dim=1) - hist
+    lut = (step // 2 + cumsum) // step.clamp(min=1)
+    lut = torch.where(step > 0, lut.clamp(max=255), torch.arange(256, device=imgs.device))
+    return lut.gather(1, levels).view(B, C, H, W).to(imgs.dtype) / 255
+
+
+def invert(imgs, v=None):
+    return 1 - imgs
+
+
+def solarize(imgs, v):
+    # Levels at or above the threshold v (0-256) are inverted
+    inverted = imgs.mul(255).round() >= v.view(-1, 1, 1, 1)
+    return torch.where(inverted, 1 - imgs, imgs)
+
+
+def solarize_add(imgs, v, threshold=128):
+    imgs = (imgs + v.view(-1, 1, 1, 1) / 255).clamp(0, 1)
+    return solarize(imgs, torch.full_like(v, threshold))
+
+
+def posterize(imgs, v):
+    # Keep the v (4-8) most significant bits
+    shift = 2 ** (8 - v.floor()).view(-1, 1, 1, 1)
+    return torch.floor(imgs.mul(255).round() / shift) * shift / 255
+
+
+def cutout_abs(imgs, v, fill=(125, 123, 114)):
+    """Fill a square of side v pixels at a random position (clipped at the
+    borders) with ``fill``."""
+    B, _, H, W = imgs.shape
+    x0 = (torch.rand(B, device=imgs.device) * W - v / 2).clamp(min=0).floor()
+    y0 = (torch.rand(B, device=imgs.device) * H - v / 2).clamp(min=0).floor()
+    x1, y1 = x0 + v, y0 + v
+    x = torch.arange(W, device=imgs.device).view(1, 1, W)
+    y = torch.arange(H, device=imgs.device).view(1, H, 1)
+    inside = (
+        (x >= x0.view(-1, 1, 1)) & (x <= x1.view(-1, 1, 1))
+        & (y >= y0.view(-1, 1, 1)) & (y <= y1.view(-1, 1, 1))
+    ).unsqueeze(1)
+    fill = imgs.new_tensor(fill).view(1, 3, 1, 1) / 255
+    return torch.where(inside, fill, imgs)
+
+
+def identity(imgs, v=None):
+    return imgs
+
+
+# The operations of randaugment.py, with the random sign of the geometric ones
+RANDAUGMENT_OPS = {
+    "AutoContrast": autocontrast,
+    "Equalize": equalize,
+    "Invert": invert,
+    "Rotate": lambda x, v: rotate(x, _random_sign(v)),
+    "Posterize": posterize,
+    "Solarize": solarize,
+    "SolarizeAdd": solarize_add,
+    "Color": color,
+    "Contrast": contrast,
+    "Brightness": brightness,
+    "Sharpness": sharpness,
+    "ShearX": lambda x, v: shear_x(x, _random_sign(v)),
+    "ShearY": lambda x, v: shear_y(x, _random_sign(v)),
+    "CutoutAbs": cutout_abs,
+    "TranslateX": lambda x, v: translate_x(x, _random_sign(v) * x.shape[3]),
+    "TranslateY": lambda x, v: translate_y(x, _random_sign(v) * x.shape[2]),
+    "TranslateXabs": lambda x, v: translate_x(x, _random_sign(v)),
+    "TranslateYabs": lambda x, v: translate_y(x, _random_sign(v)),
+    "Identity": identity,
+}
+
+
+def _augment_list(augment_list):
+    return [(RANDAUGMENT_OPS[op.__name__], minval, maxval) for op, minval, maxval in augment_list]
+
+
+class BatchRandAugment:
+    """Batched RandAugment, RandAugment2 or RandAugmentFixMatch.
+
+    Args:
+        augment_list (list): (op, min, max) of randaugment.py, e.g.
+            randaugment_list().
+        n (int): number of operations applied to every sample.
+        m (int, optional): fixed magnitude (0-30); None draws the magnitude
+            of every operation uniformly.
+        p (float): probability that each drawn operation is applied.
+    """
+
+    def __init__(self, augment_list, n=2, m=None, p=1.0):
+        self.augment_list = _augment_list(augment_list)
+        self.n = n
+        self.m = m
+        self.p = p
+
+    def _op(self, op, minval, maxval, magnitudes):
+
+        def _apply(imgs, idx):
+            val = magnitudes[idx] * (maxval-minval) + minval
+            return quantize(op(imgs, val))
+
+        return _apply
+
+    def __call__(self, imgs, img_sizes):
+        B, device = len(imgs), imgs.device
+        imgs = quantize(imgs)
+        for _ in range(self.n):
+            op_ids = torch.randint(len(self.augment_list), (B, ), device=device)
+            if self.p < 1:
+                op_ids[torch.rand(B, device=device) > self.p] = -1
+            if self.m is None:
+                magnitudes = torch.rand(B, device=device)
+            else:
+                magnitudes = torch.full((B, ), self.m / 30, device=device)
+            ops = [self._op(*op, magnitudes) for op in self.augment_list]
+            imgs = apply_grouped(imgs, op_ids, ops)
+        return imgs
+
+
+def _policy_op(name, magnitude, fill):
+    """Operation ``name`` of autoaugment.SubPolicy at a fixed magnitude."""
+    signed = lambda x: _random_sign(x.new_full((len(x), ), float(magnitude)))
+    enhance = lambda op: lambda x: op(x, 1 + signed(x))
+    ops = {
+        "shearX": lambda x: shear_x(x, signed(x), fill, mode="bicubic"),
+        "shearY": lambda x: shear_y(x, signed(x), fill, mode="bicubic"),
+        "translateX": lambda x: translate_x(x, signed(x) * x.shape[3], fill),
+        "translateY": lambda x: translate_y(x, signed(x) * x.shape[2], fill),
+        "rotate": lambda x: rotate(x, x.new_full((len(x), ), float(magnitude)), fill=128),
+        "color": enhance(color),
+        "posterize": lambda x: posterize(x, x.new_full((len(x), ), float(magnitude))),
+        "solarize": lambda x: solarize(x, x.new_full((len(x), ), float(magnitude))),
+        "contrast": enhance(contrast),
+        "sharpness": enhance(sharpness),
+        "brightness": enhance(brightness),
+        "autocontrast": autocontrast,
+        "equalize": equalize,
+        "invert": invert,
+    }
+    op = ops[name]
+    return lambda imgs, idx: quantize(op(imgs))
+
+
+class BatchAutoAugment:
+    """Batched ImageNetPolicy, CIFAR10Policy or SVHNPolicy: every sample
+    draws one sub-policy, whose two operations are applied with their
+    probabilities."""
+
+    def __init__(self, policies, fillcolor=128):
+        self.probs = torch.tensor([[policy[0], policy[3]] for policy in policies])
+        self.ops = [
+            [
+                _policy_op(name, MAGNITUDE_RANGES[name][magnitude_idx], fillcolor)
+                for _, name, magnitude_idx in (policy[:3], policy[3:])
+            ]
+            for policy in policies
+        ]
+
+    def __call__(self, imgs, img_sizes):
+        B, device = len(imgs), imgs.device
+        imgs = quantize(imgs)
+        policy_ids = torch.randint(len(self.ops), (B, ), device=device)
+        probs = self.probs.to(device)[policy_ids]
+        for step in range(2):
+            applied = torch.rand(B, device=device) < probs[:, step]
+            op_ids = torch.where(applied, policy_ids, torch.full_like(policy_ids, -1))
+            imgs = apply_grouped(imgs, op_ids, [ops[step] for ops in self.ops])
+        return imgs
+
+
+AUTOAUGMENT_POLICIES = {
+    "imagenet_policy": IMAGENET_POLICIES,
+    "cifar10_policy": CIFAR10_POLICIES,
+    "svhn_policy": SVHN_POLICIES,
+}
+
+
+class Cutout:
+    """Batched transforms.Cutout: zero ``n_holes`` squares of side
+    ``length`` per sample, clipped at the borders."""
+
+    def __init__(self, n_holes=1, length=16):
+        self.n_holes = n_holes
+        self.length = length
+
+    def __call__(self, imgs, img_sizes):
+        B, _, H, W = imgs.shape
+        y = torch.arange(H, device=imgs.device).view(1, H, 1)
+        x = torch.arange(W, device=imgs.device).view(1, 1, W)
+        half = self.length // 2
+        mask = torch.ones(B, H, W, dtype=torch.bool, device=imgs.device)
+        for _ in range(self.n_holes):
+            cy = torch.randint(H, (B, 1, 1), device=imgs.device)
+            cx = torch.randint(W, (B, 1, 1), device=imgs.device)
+            hole = (y >= cy - half) & (y < cy + half) & (x >= cx - half) & (x < cx + half)
+            mask &= ~hole
+        return imgs * mask.unsqueeze(1)
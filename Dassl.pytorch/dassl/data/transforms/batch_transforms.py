@@ -0,0 +1,356 @@
+"""
+Training augmentation applied to whole batches (see INPUT.BATCH_TRANSFORM).
+
+Data loader workers only decode the images, resize them to a fixed square
+pre-crop size and return uint8 tensors together with the image sizes. After
+collation, ``BatchTransform`` draws the random parameters of every sample at
+once and applies crop, flip, RandAugment/AutoAugment (batch_augment.py),
+color jitter, grayscale, cutout and normalization as batched tensor ops, in
+the main process or on the GPU.
+
+The sampled parameters follow the torchvision transforms built by
+``build_transform``. Random resized crops are taken in the coordinates of the
+original image, so their scale and aspect-ratio distribution is unchanged;
+pixels are resampled from the pre-crop image with ``roi_align``.
+"""
+import math
+import torch
+from torchvision.ops import roi_align
+from torchvision.transforms import Compose, PILToTensor, Resize
+
+from .transforms import INTERPOLATION_MODES, build_transform
+from .randaugment import fixmatch_list, randaugment_list, randaugment_list2
+
+# Transforms that have a batched counterpart (in the order they are applied)
+BATCH_CHOICES = [
+    "random_resized_crop",
+    "random_flip",
+    "imagenet_policy",
+    "cifar10_policy",
+    "svhn_policy",
+    "randaugment",
+    "randaugment_fixmatch",
+    "randaugment2",
+    "colorjitter",
+    "randomgrayscale",
+    "cutout",
+    "normalize",
+]
+
+
+def precrop_size(cfg):
+    """Side of the square uint8 images returned by the workers."""
+    if "random_resized_crop" not in cfg.INPUT.TRANSFORMS:
+        return None
+    if cfg.INPUT.BATCH_TRANSFORM_SIZE > 0:
+        return cfg.INPUT.BATCH_TRANSFORM_SIZE
+    return 2 * max(cfg.INPUT.SIZE)
+
+
+def build_precrop_transform(cfg):
+    """Per-sample part of the training transform: resize and convert to a
+    uint8 tensor."""
+    interp_mode = INTERPOLATION_MODES[cfg.INPUT.INTERPOLATION]
+    side = precrop_size(cfg)
+    size = cfg.INPUT.SIZE if side is None else (side, side)
+    print(f"Building transform_train (per sample)\n+ resize to {size[0]}x{size[1]} (uint8)")
+    return Compose([Resize(size, interpolation=interp_mode), PILToTensor()])
+
+
+def build_batch_transform(cfg, choices=None):
+    """Batched part of the training transform, for the cfg.INPUT.TRANSFORMS
+    (or ``choices``) in BATCH_CHOICES."""
+    if choices is None:
+        choices = cfg.INPUT.TRANSFORMS
+    unsupported = [choice for choice in choices if choice not in BATCH_CHOICES]
+    if unsupported:
+        raise ValueError(
+            f"INPUT.BATCH_TRANSFORM supports {BATCH_CHOICES}, but got {unsupported}"
+        )
+
+    # batch_augment builds on the ops of this module
+    from .batch_augment import (
+        AUTOAUGMENT_POLICIES, Cutout, BatchAutoAugment, BatchRandAugment
+    )
+
+    print("Building transform_train (per batch)")
+    tfms = []
+    if "random_resized_crop" in choices:
+        print(f"+ random resized crop (size={cfg.INPUT.SIZE}, scale={cfg.INPUT.RRCROP_SCALE})")
+        tfms += [RandomResizedCrop(cfg.INPUT.SIZE, scale=cfg.INPUT.RRCROP_SCALE)]
+    if "random_flip" in choices:
+        print("+ random flip")
+        tfms += [RandomHorizontalFlip()]
+    for policy in ["imagenet_policy", "cifar10_policy", "svhn_policy"]:
+        if policy in choices:
+            print(f"+ {policy.replace('_', ' ')}")
+            tfms += [BatchAutoAugment(AUTOAUGMENT_POLICIES[policy])]
+    if "randaugment" in choices:
+        n_, m_ = cfg.INPUT.RANDAUGMENT_N, cfg.INPUT.RANDAUGMENT_M
+        print(f"+ randaugment (n={n_}, m={m_})")
+        tfms += [BatchRandAugment(randaugment_list(), n=n_, m=m_)]
+    if "randaugment_fixmatch" in choices:
+        n_ = cfg.INPUT.RANDAUGMENT_N
+        print(f"+ randaugment_fixmatch (n={n_})")
+        tfms += [BatchRandAugment(fixmatch_list(), n=n_)]
+    if "randaugment2" in choices:
+        n_ = cfg.INPUT.RANDAUGMENT_N
+        print(f"+ randaugment2 (n={n_})")
+        tfms += [BatchRandAugment(randaugment_list2(), n=n_, p=0.6)]
+    if "colorjitter" in choices:
+        print("+ color jitter")
+        tfms += [
+            ColorJitter(
+                brightness=cfg.INPUT.COLORJITTER_B,
+                contrast=cfg.INPUT.COLORJITTER_C,
+                saturation=cfg.INPUT.COLORJITTER_S,
+                hue=cfg.INPUT.COLORJITTER_H,
+            )
+        ]
+    if "randomgrayscale" in choices:
+        print("+ random gray scale")
+        tfms += [RandomGrayscale(p=cfg.INPUT.RGS_P)]
+    if "cutout" in choices:
+        n_, len_ = cfg.INPUT.CUTOUT_N, cfg.INPUT.CUTOUT_LEN
+        print(f"+ cutout (n_holes={n_}, length={len_})")
+        tfms += [Cutout(n_, len_)]
+    if "normalize" in choices:
+        print(f"+ normalization (mean={cfg.INPUT.PIXEL_MEAN}, std={cfg.INPUT.PIXEL_STD})")
+        tfms += [Normalize(cfg.INPUT.PIXEL_MEAN, cfg.INPUT.PIXEL_STD)]
+    return BatchTransform(tfms)
+
+
+def build_weak_strong_transforms(cfg, strong_choices):
+    """Training transforms of the trainers that augment every image weakly
+    (cfg.INPUT.TRANSFORMS, "img") and strongly (``strong_choices``, "img2").
+
+    Returns the per-sample transform(s) and, with INPUT.BATCH_TRANSFORM, the
+    batched transforms of both views (else None). Batched, both views are
+    augmented from the same uint8 pre-crop.
+    """
+    if not cfg.INPUT.BATCH_TRANSFORM:
+        tfm_train = build_transform(cfg, is_train=True)
+        tfm_train_strong = build_transform(cfg, is_train=True, choices=strong_choices)
+        return [tfm_train, tfm_train_strong], None
+
+    if ("random_resized_crop" in cfg.INPUT.TRANSFORMS) != ("random_resized_crop" in strong_choices):
+        # The pre-crop size depends on it
+        raise ValueError(
+            "INPUT.BATCH_TRANSFORM needs random_resized_crop in both or neither of "
+            "INPUT.TRANSFORMS and the strong transforms"
+        )
+    batch_tfms = [build_batch_transform(cfg), build_batch_transform(cfg, choices=strong_choices)]
+    return build_precrop_transform(cfg), batch_tfms
+
+
+class BatchTransform:
+    """Apply batched transforms to a uint8 batch of shape (B, C, H, W).
+
+    Every transform is called as ``tfm(imgs, img_sizes)``, ``img_sizes``
+    holding the (height, width) of the original images.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __call__(self, imgs, img_sizes):
+        imgs = imgs.float().div_(255)
+        img_sizes = img_sizes.to(imgs.device)
+        for tfm in self.transforms:
+            imgs = tfm(imgs, img_sizes)
+        return imgs
+
+
+def _uniform(n, low, high, device):
+    return torch.empty(n, device=device).uniform_(low, high)
+
+
+def apply_grouped(imgs, op_ids, ops):
+    """Apply ``ops[k](imgs[i], i)`` to the samples i with ``op_ids[i] == k``,
+    one batched call per op. ``i`` is a tensor of sample indices."""
+    out = imgs.clone()
+    for k, op in enumerate(ops):
+        idx = (op_ids == k).nonzero().squeeze(1)
+        if len(idx) > 0:
+            out[idx] = op(imgs[idx], idx)
+    return out
+
+
+class RandomResizedCrop:
+
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3.0 / 4.0, 4.0 / 3.0), n_trials=10):
+        self.size = tuple(size)
+        self.scale = scale
+        self.ratio = ratio
+        self.n_trials = n_trials
+
+    def get_params(self, img_sizes):
+        """Vectorized RandomResizedCrop.get_params: (top, left, height,
+        width) of every crop, in original image pixels."""
+        B, device = len(img_sizes), img_sizes.device
+        height, width = img_sizes[:, 0:1].float(), img_sizes[:, 1:2].float()
+        area = height * width
+
+        shape = (B, self.n_trials)
+        target_area = area * torch.empty(shape, device=device).uniform_(*self.scale)
+        log_ratio = torch.empty(shape, device=device).uniform_(
+            math.log(self.ratio[0]), math.log(self.ratio[1])
+        )
+        aspect_ratio = torch.exp(log_ratio)
+        w = torch.round(torch.sqrt(target_area * aspect_ratio))
+        h = torch.round(torch.sqrt(target_area / aspect_ratio))
+        valid = (w > 0) & (h > 0) & (w <= width) & (h <= height)
+        i = torch.floor(torch.rand(shape, device=device) * (height - h + 1))
+        j = torch.floor(torch.rand(shape, device=device) * (width - w + 1))
+
+        # First valid trial of every sample
+        first = torch.argmax(valid.int(), dim=1, keepdim=True)
+        found = valid.any(dim=1)
+        i, j, h, w = [t.gather(1, first).squeeze(1) for t in (i, j, h, w)]
+
+        # Fallback to central crop
+        height, width = height.squeeze(1), width.squeeze(1)
+        in_ratio = width / height
+        fw = torch.where(
+            in_ratio < min(self.ratio), width,
+            torch.where(in_ratio > max(self.ratio), torch.round(height * max(self.ratio)), width)
+        )
+        fh = torch.where(
+            in_ratio < min(self.ratio), torch.round(width / min(self.ratio)), height
+        )
+        fi = torch.div(height - fh, 2, rounding_mode="floor")
+        fj = torch.div(width - fw, 2, rounding_mode="floor")
+        return (
+            torch.where(found, i, fi), torch.where(found, j, fj),
+            torch.where(found, h, fh), torch.where(found, w, fw)
+        )
+
+    def __call__(self, imgs, img_sizes):
+        i, j, h, w = self.get_params(img_sizes)
+        # Crop boxes in pre-crop image pixels
+        scale_y = imgs.shape[2] / img_sizes[:, 0].float()
+        scale_x = imgs.shape[3] / img_sizes[:, 1].float()
+        batch_idx = torch.arange(len(imgs), device=imgs.device, dtype=imgs.dtype)
+        boxes = torch.stack(
+            [batch_idx, j * scale_x, i * scale_y, (j + w) * scale_x, (i + h) * scale_y], dim=1
+        )
+        return roi_align(imgs, boxes.to(imgs.dtype), self.size, aligned=True)
+
+
+class RandomHorizontalFlip:
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, imgs, img_sizes):
+        flip = torch.rand(len(imgs), device=imgs.device) < self.p
+        return torch.where(flip.view(-1, 1, 1, 1), imgs.flip(-1), imgs)
+
+
+def rgb_to_grayscale(imgs):
+    r, g, b = imgs.unbind(dim=1)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+
+
+def _blend(img1, img2, ratio):
+    ratio = ratio.view(-1, 1, 1, 1)
+    return (ratio * img1 + (1.0 - ratio) * img2).clamp(0, 1)
+
+
+def adjust_brightness(imgs, factors):
+    return _blend(imgs, torch.zeros_like(imgs), factors)
+
+
+def adjust_contrast(imgs, factors):
+    mean = rgb_to_grayscale(imgs).mean(dim=(1, 2, 3), keepdim=True)
+    return _blend(imgs, mean, factors)
+
+
+def adjust_saturation(imgs, factors):
+    return _blend(imgs, rgb_to_grayscale(imgs), factors)
+
+
+def _rgb_to_hsv(imgs):
+    r, g, b = imgs.unbind(dim=1)
+    maxc, _ = imgs.max(dim=1)
+    minc, _ = imgs.min(dim=1)
+    eqc = maxc == minc
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(eqc, ones, maxc)
+    cr_divisor = torch.where(eqc, ones, cr)
+    rc = (maxc - r) / cr_divisor
+    gc = (maxc - g) / cr_divisor
+    bc = (maxc - b) / cr_divisor
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return torch.stack((h, s, maxc), dim=1)
+
+
+def _hsv_to_rgb(imgs):
+    # Closed form: channel = v - v * s * clamp(min(k, 4 - k), 0, 1) with
+    # k = (n + 6 * h) mod 6 and n = 5, 3, 1 for red, green, blue
+    h, s, v = imgs.unbind(dim=1)
+    n = torch.tensor([5.0, 3.0, 1.0], device=imgs.device, dtype=imgs.dtype).view(1, 3, 1, 1)
+    k = torch.remainder(n + 6.0 * h.unsqueeze(1), 6.0)
+    k = torch.minimum(k, 4.0 - k).clamp(0.0, 1.0)
+    return v.unsqueeze(1) - (v * s).unsqueeze(1) * k
+
+
+def adjust_hue(imgs, factors):
+    hsv = _rgb_to_hsv(imgs)
+    h = torch.remainder(hsv[:, 0] + factors.view(-1, 1, 1), 1.0)
+    return _hsv_to_rgb(torch.stack((h, hsv[:, 1], hsv[:, 2]), dim=1))
+
+
+class ColorJitter:
+    """Brightness, contrast, saturation and hue jitter as torchvision's
+    ColorJitter: per-sample factors and a per-sample random order."""
+
+    def __init__(self, brightness=0, contrast=0, saturation=0, hue=0):
+        jitters = [
+            (adjust_brightness, max(0, 1 - brightness), 1 + brightness, 1),
+            (adjust_contrast, max(0, 1 - contrast), 1 + contrast, 1),
+            (adjust_saturation, max(0, 1 - saturation), 1 + saturation, 1),
+            (adjust_hue, -hue, hue, 0),
+        ]
+        # Like torchvision, skip the jitters that cannot change the image
+        self.jitters = [
+            (op, low, high) for op, low, high, identity in jitters
+            if (low, high) != (identity, identity)
+        ]
+
+    def __call__(self, imgs, img_sizes):
+        B, device = len(imgs), imgs.device
+        ops = []
+        for op, low, high in self.jitters:
+            factors = _uniform(B, low, high, device)
+            ops.append(lambda x, idx, op=op, factors=factors: op(x, factors[idx]))
+        order = torch.argsort(torch.rand(B, len(ops), device=device), dim=1)
+        for step in range(len(ops)):
+            imgs = apply_grouped(imgs, order[:, step], ops)
+        return imgs
+
+
+class RandomGrayscale:
+
+    def __init__(self, p=0.1):
+        self.p = p
+
+    def __call__(self, imgs, img_sizes):
+        gray = torch.rand(len(imgs), device=imgs.device) < self.p
+        return torch.where(gray.view(-1, 1, 1, 1), rgb_to_grayscale(imgs).expand_as(imgs), imgs)
+
+
+class Normalize:
+
+    def __init__(self, mean, std):
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+    def __call__(self, imgs, img_sizes):
+        mean = self.mean.to(imgs.device, imgs.dtype)
+        std = self.std.to(imgs.device, imgs.dtype)
+        return (imgs - mean) / std
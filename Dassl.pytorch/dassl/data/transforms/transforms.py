@@ -1,10 +1,11 @@
+import math
 import numpy as np
 import random
 import torch
 import torchvision.transforms.functional as F
 from torchvision.transforms import (
     Resize, Compose, ToTensor, Normalize, CenterCrop, RandomCrop, ColorJitter,
-    RandomApply, GaussianBlur, RandomGrayscale, RandomResizedCrop,
+    RandomApply, PILToTensor, GaussianBlur, RandomGrayscale, RandomResizedCrop,
     RandomHorizontalFlip
 )
 from torchvision.transforms.functional import InterpolationMode
@@ -39,6 +40,15 @@ INTERPOLATION_MODES = {
     "nearest": InterpolationMode.NEAREST,
 }
 
+# Transforms whose output cannot be stored as uint8 (see DATALOADER.UINT8)
+FLOAT_ONLY_CHOICES = ["instance_norm", "gaussian_noise"]
+
+INPUT_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
 
 class Random2DTranslation:
     """Given an image of (height, width), we resize it to
@@ -154,7 +164,7 @@ class Cutout:
             mask[y1:y2, x1:x2] = 0.0
 
         mask = torch.from_numpy(mask)
-        mask = mask.expand_as(img)
+        mask = mask.expand_as(img).to(img.dtype)
         return img * mask
 
 
@@ -193,6 +203,11 @@ def build_transform(cfg, is_train=True, choices=None):
     for choice in choices:
         assert choice in AVAI_CHOICES
 
+    if cfg.DATALOADER.UINT8:
+        float_only = [choice for choice in choices if choice in FLOAT_ONLY_CHOICES]
+        if float_only:
+            raise ValueError(f"DATALOADER.UINT8 cannot be used with {float_only}")
+
     target_size = f"{cfg.INPUT.SIZE[0]}x{cfg.INPUT.SIZE[1]}"
 
     normalize = Normalize(mean=cfg.INPUT.PIXEL_MEAN, std=cfg.INPUT.PIXEL_STD)
@@ -203,6 +218,85 @@ def build_transform(cfg, is_train=True, choices=None):
         return _build_transform_test(cfg, choices, target_size, normalize)
 
 
+def _to_tensor(cfg):
+    if cfg.DATALOADER.UINT8:
+        print("+ to uint8 torch tensor (scaled and normalized on the device)")
+        return PILToTensor()
+    print("+ to torch tensor of range [0, 1]")
+    return ToTensor()
+
+
+class InputTransform:
+    """Finish uint8 image batches (DATALOADER.UINT8) on their device: scale
+    to [0, 1], normalize if ``mean`` and ``std`` are given and cast to
+    ``dtype``. Batches that are already floating point are only cast."""
+
+    def __init__(self, mean=None, std=None, dtype=torch.float32):
+        self.mean = None if mean is None else torch.tensor(mean).view(-1, 1, 1)
+        self.std = None if std is None else torch.tensor(std).view(-1, 1, 1)
+        self.dtype = dtype
+
+    def __call__(self, imgs):
+        if imgs.dtype != torch.uint8:
+            return imgs.to(self.dtype)
+        # Computed in float32, then cast
+        imgs = imgs.float().div_(255)
+        if self.mean is not None:
+            mean = self.mean.to(imgs.device)
+            std = self.std.to(imgs.device)
+            imgs = imgs.sub_(mean).div_(std)
+        return imgs.to(self.dtype)
+
+
+def build_input_transform(cfg):
+    """Device-side stage of DATALOADER.UINT8, or None if it is off."""
+    if not cfg.DATALOADER.UINT8:
+        return None
+    if cfg.INPUT.NO_TRANSFORM:
+        raise ValueError("DATALOADER.UINT8 needs the image transforms (INPUT.NO_TRANSFORM is set)")
+    dtype = INPUT_DTYPES[cfg.DATALOADER.INPUT_DTYPE]
+    if "normalize" in cfg.INPUT.TRANSFORMS:
+        return InputTransform(cfg.INPUT.PIXEL_MEAN, cfg.INPUT.PIXEL_STD, dtype)
+    return InputTransform(dtype=dtype)
+
+
+def decode_size(tfm):
+    """Return the smallest (width, height) at which an image can be read for
+    ``tfm`` (a transform or a list of them) without losing any resolution,
+    or None if the full image is needed.
+
+    Only the leading geometric transform matters: ``Resize`` needs its output
+    size, ``RandomResizedCrop`` the size at which even its smallest crop (of
+    the most extreme aspect ratio) still covers the output.
+    """
+    if tfm is None:
+        return None
+
+    if isinstance(tfm, (list, tuple)):
+        sizes = [decode_size(t) for t in tfm]
+        if any(size is None for size in sizes):
+            return None
+        return max(size[0] for size in sizes), max(size[1] for size in sizes)
+
+    first = tfm.transforms[0] if isinstance(tfm, Compose) else tfm
+    if isinstance(first, Resize):
+        if first.max_size is not None:
+            return None
+        size = first.size
+        if isinstance(size, int):
+            return size, size
+        if len(size) == 1:
+            return size[0], size[0]
+        return size[1], size[0]
+
+    if isinstance(first, RandomResizedCrop):
+        ratio = max(first.ratio[1], 1.0 / first.ratio[0])
+        side = math.ceil(max(first.size) * math.sqrt(ratio / first.scale[0]))
+        return side, side
+
+    return None
+
+
 def _build_transform_train(cfg, choices, target_size, normalize):
     print("Building transform_train")
     tfm_train = []
@@ -293,8 +387,7 @@ def _build_transform_train(cfg, choices, target_size, normalize):
         gb_k, gb_p = cfg.INPUT.GB_K, cfg.INPUT.GB_P
         tfm_train += [RandomApply([GaussianBlur(gb_k)], p=gb_p)]
 
-    print("+ to torch tensor of range [0, 1]")
-    tfm_train += [ToTensor()]
+    tfm_train += [_to_tensor(cfg)]
 
     if "cutout" in choices:
         cutout_n = cfg.INPUT.CUTOUT_N
@@ -302,7 +395,7 @@ def _build_transform_train(cfg, choices, target_size, normalize):
         print(f"+ cutout (n_holes={cutout_n}, length={cutout_len})")
         tfm_train += [Cutout(cutout_n, cutout_len)]
 
-    if "normalize" in choices:
+    if "normalize" in choices and not cfg.DATALOADER.UINT8:
         print(
             f"+ normalization (mean={cfg.INPUT.PIXEL_MEAN}, std={cfg.INPUT.PIXEL_STD})"
         )
@@ -336,10 +429,9 @@ def _build_transform_test(cfg, choices, target_size, normalize):
     print(f"+ {target_size} center crop")
     tfm_test += [CenterCrop(input_size)]
 
-    print("+ to torch tensor of range [0, 1]")
-    tfm_test += [ToTensor()]
+    tfm_test += [_to_tensor(cfg)]
 
-    if "normalize" in choices:
+    if "normalize" in choices and not cfg.DATALOADER.UINT8:
         print(
             f"+ normalization (mean={cfg.INPUT.PIXEL_MEAN}, std={cfg.INPUT.PIXEL_STD})"
         )
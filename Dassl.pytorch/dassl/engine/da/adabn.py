@@ -30,7 +30,7 @@ class AdaBN(TrainerXU):
             self.done_reset_bn_stats = True
 
     def forward_backward(self, batch_x, batch_u):
-        input_u = batch_u["img"].to(self.device)
+        input_u = self.prepare_input(batch_u["img"])
 
         with torch.no_grad():
             self.model(input_u)
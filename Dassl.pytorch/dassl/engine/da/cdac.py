@@ -12,7 +12,7 @@ from dassl.engine import TRAINER_REGISTRY, TrainerXU
 from dassl.metrics import compute_accuracy
 from dassl.modeling.ops import ReverseGrad
 from dassl.engine.trainer import SimpleNet
-from dassl.data.transforms.transforms import build_transform
+from dassl.data.transforms import build_weak_strong_transforms
 
 
 def custom_scheduler(iter, max_iter=None, alpha=10, beta=0.75, init_lr=0.001):
@@ -80,12 +80,13 @@ class CDAC(TrainerXU):
     def build_data_loader(self):
 
         cfg = self.cfg
-        tfm_train = build_transform(cfg, is_train=True)
-        custom_tfm_train = [tfm_train]
         choices = cfg.TRAINER.CDAC.STRONG_TRANSFORMS
-        tfm_train_strong = build_transform(cfg, is_train=True, choices=choices)
-        custom_tfm_train += [tfm_train_strong]
-        self.dm = DataManager(self.cfg, custom_tfm_train=custom_tfm_train)
+        custom_tfm_train, custom_batch_tfm_train = build_weak_strong_transforms(cfg, choices)
+        self.dm = DataManager(
+            self.cfg,
+            custom_tfm_train=custom_tfm_train,
+            custom_batch_tfm_train=custom_batch_tfm_train
+        )
         self.train_loader_x = self.dm.train_loader_x
         self.train_loader_u = self.dm.train_loader_u
         self.val_loader = self.dm.val_loader
@@ -236,12 +237,12 @@ class CDAC(TrainerXU):
         input_us2 = batch_u["img2"][1]
         label_u = batch_u["label"]
 
-        input_x = input_x.to(self.device)
+        input_x = self.prepare_input(input_x)
         label_x = label_x.to(self.device)
 
-        input_u = input_u.to(self.device)
-        input_us = input_us.to(self.device)
-        input_us2 = input_us2.to(self.device)
+        input_u = self.prepare_input(input_u)
+        input_us = self.prepare_input(input_us)
+        input_us2 = self.prepare_input(input_us2)
         label_u = label_u.to(self.device)
 
         return input_x, label_x, input_u, input_us, input_us2, label_u
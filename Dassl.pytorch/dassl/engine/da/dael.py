@@ -7,7 +7,7 @@ from dassl.utils import count_num_param
 from dassl.engine import TRAINER_REGISTRY, TrainerXU
 from dassl.metrics import compute_accuracy
 from dassl.engine.trainer import SimpleNet
-from dassl.data.transforms import build_transform
+from dassl.data.transforms import build_weak_strong_transforms
 from dassl.modeling.ops.utils import create_onehot
 
 
@@ -52,12 +52,13 @@ class DAEL(TrainerXU):
 
     def build_data_loader(self):
         cfg = self.cfg
-        tfm_train = build_transform(cfg, is_train=True)
-        custom_tfm_train = [tfm_train]
         choices = cfg.TRAINER.DAEL.STRONG_TRANSFORMS
-        tfm_train_strong = build_transform(cfg, is_train=True, choices=choices)
-        custom_tfm_train += [tfm_train_strong]
-        dm = DataManager(self.cfg, custom_tfm_train=custom_tfm_train)
+        custom_tfm_train, custom_batch_tfm_train = build_weak_strong_transforms(cfg, choices)
+        dm = DataManager(
+            self.cfg,
+            custom_tfm_train=custom_tfm_train,
+            custom_batch_tfm_train=custom_batch_tfm_train
+        )
         self.train_loader_x = dm.train_loader_x
         self.train_loader_u = dm.train_loader_u
         self.val_loader = dm.val_loader
@@ -190,11 +191,11 @@ class DAEL(TrainerXU):
 
         label_x = create_onehot(label_x, self.num_classes)
 
-        input_x = input_x.to(self.device)
-        input_x2 = input_x2.to(self.device)
+        input_x = self.prepare_input(input_x)
+        input_x2 = self.prepare_input(input_x2)
         label_x = label_x.to(self.device)
-        input_u = input_u.to(self.device)
-        input_u2 = input_u2.to(self.device)
+        input_u = self.prepare_input(input_u)
+        input_u2 = self.prepare_input(input_u2)
 
         return input_x, input_x2, label_x, domain_x, input_u, input_u2
 
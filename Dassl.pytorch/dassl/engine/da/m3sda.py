@@ -192,9 +192,9 @@ class M3SDA(TrainerXU):
         domain_x = batch_x["domain"]
         input_u = batch_u["img"]
 
-        input_x = input_x.to(self.device)
+        input_x = self.prepare_input(input_x)
         label_x = label_x.to(self.device)
-        input_u = input_u.to(self.device)
+        input_u = self.prepare_input(input_u)
 
         return input_x, label_x, domain_x, input_u
 
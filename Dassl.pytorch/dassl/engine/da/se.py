@@ -70,9 +70,9 @@ class SE(TrainerXU):
         input_u = batch_u["img"]
         input_u1, input_u2 = input_u
 
-        input_x = input_x.to(self.device)
+        input_x = self.prepare_input(input_x)
         label_x = label_x.to(self.device)
-        input_u1 = input_u1.to(self.device)
-        input_u2 = input_u2.to(self.device)
+        input_u1 = self.prepare_input(input_u1)
+        input_u2 = self.prepare_input(input_u2)
 
         return input_x, label_x, input_u1, input_u2
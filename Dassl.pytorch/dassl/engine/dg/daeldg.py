@@ -7,7 +7,7 @@ from dassl.utils import count_num_param
 from dassl.engine import TRAINER_REGISTRY, TrainerX
 from dassl.metrics import compute_accuracy
 from dassl.engine.trainer import SimpleNet
-from dassl.data.transforms import build_transform
+from dassl.data.transforms import build_weak_strong_transforms
 from dassl.modeling.ops.utils import create_onehot
 
 
@@ -51,12 +51,13 @@ class DAELDG(TrainerX):
 
     def build_data_loader(self):
         cfg = self.cfg
-        tfm_train = build_transform(cfg, is_train=True)
-        custom_tfm_train = [tfm_train]
         choices = cfg.TRAINER.DAELDG.STRONG_TRANSFORMS
-        tfm_train_strong = build_transform(cfg, is_train=True, choices=choices)
-        custom_tfm_train += [tfm_train_strong]
-        dm = DataManager(self.cfg, custom_tfm_train=custom_tfm_train)
+        custom_tfm_train, custom_batch_tfm_train = build_weak_strong_transforms(cfg, choices)
+        dm = DataManager(
+            self.cfg,
+            custom_tfm_train=custom_tfm_train,
+            custom_batch_tfm_train=custom_batch_tfm_train
+        )
         self.train_loader_x = dm.train_loader_x
         self.train_loader_u = dm.train_loader_u
         self.val_loader = dm.val_loader
@@ -150,8 +151,8 @@ class DAELDG(TrainerX):
 
         label = create_onehot(label, self.num_classes)
 
-        input = input.to(self.device)
-        input2 = input2.to(self.device)
+        input = self.prepare_input(input)
+        input2 = self.prepare_input(input2)
         label = label.to(self.device)
 
         return input, input2, label, domain
@@ -45,7 +45,7 @@ class DomainMix(TrainerX):
         images = batch["img"]
         target = batch["label"]
         domain = batch["domain"]
-        images = images.to(self.device)
+        images = self.prepare_input(images)
         target = target.to(self.device)
         domain = domain.to(self.device)
         images, target_a, target_b, lam = self.domain_mix(
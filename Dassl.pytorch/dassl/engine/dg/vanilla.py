@@ -30,6 +30,6 @@ class Vanilla(TrainerX):
     def parse_batch_train(self, batch):
         input = batch["img"]
         target = batch["label"]
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         target = target.to(self.device)
         return input, target
@@ -4,7 +4,7 @@ from torch.nn import functional as F
 from dassl.data import DataManager
 from dassl.engine import TRAINER_REGISTRY, TrainerXU
 from dassl.metrics import compute_accuracy
-from dassl.data.transforms import build_transform
+from dassl.data.transforms import build_weak_strong_transforms
 
 
 @TRAINER_REGISTRY.register()
@@ -25,12 +25,13 @@ class FixMatch(TrainerXU):
 
     def build_data_loader(self):
         cfg = self.cfg
-        tfm_train = build_transform(cfg, is_train=True)
-        custom_tfm_train = [tfm_train]
         choices = cfg.TRAINER.FIXMATCH.STRONG_TRANSFORMS
-        tfm_train_strong = build_transform(cfg, is_train=True, choices=choices)
-        custom_tfm_train += [tfm_train_strong]
-        self.dm = DataManager(self.cfg, custom_tfm_train=custom_tfm_train)
+        custom_tfm_train, custom_batch_tfm_train = build_weak_strong_transforms(cfg, choices)
+        self.dm = DataManager(
+            self.cfg,
+            custom_tfm_train=custom_tfm_train,
+            custom_batch_tfm_train=custom_batch_tfm_train
+        )
         self.train_loader_x = self.dm.train_loader_x
         self.train_loader_u = self.dm.train_loader_u
         self.val_loader = self.dm.val_loader
@@ -102,11 +103,11 @@ class FixMatch(TrainerXU):
         # label_u is used only for evaluating pseudo labels' accuracy
         label_u = batch_u["label"]
 
-        input_x = input_x.to(self.device)
-        input_x2 = input_x2.to(self.device)
+        input_x = self.prepare_input(input_x)
+        input_x2 = self.prepare_input(input_x2)
         label_x = label_x.to(self.device)
-        input_u = input_u.to(self.device)
-        input_u2 = input_u2.to(self.device)
+        input_u = self.prepare_input(input_u)
+        input_u2 = self.prepare_input(input_u2)
         label_u = label_u.to(self.device)
 
         return input_x, input_x2, label_x, input_u, input_u2, label_u
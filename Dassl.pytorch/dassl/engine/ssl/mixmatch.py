@@ -91,8 +91,8 @@ class MixMatch(TrainerXU):
         label_x = create_onehot(label_x, self.num_classes)
         input_u = batch_u["img"]
 
-        input_x = input_x.to(self.device)
+        input_x = self.prepare_input(input_x)
         label_x = label_x.to(self.device)
-        input_u = [input_ui.to(self.device) for input_ui in input_u]
+        input_u = self.prepare_input(input_u)
 
         return input_x, label_x, input_u
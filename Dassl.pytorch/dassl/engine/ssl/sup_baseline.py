@@ -27,6 +27,6 @@ class SupBaseline(TrainerXU):
     def parse_batch_train(self, batch_x, batch_u):
         input = batch_x["img"]
         label = batch_x["label"]
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         label = label.to(self.device)
         return input, label
@@ -8,7 +8,8 @@ import torch.nn as nn
 from tqdm import tqdm
 from torch.utils.tensorboard import SummaryWriter
 
-from dassl.data import DataManager
+from dassl.data import DataManager, Prefetcher
+from dassl.data.transforms import build_input_transform
 from dassl.optim import build_optimizer, build_lr_scheduler
 from dassl.utils import (
     MetricMeter, AverageMeter, tolist_if_not, count_num_param, load_checkpoint,
@@ -116,9 +117,15 @@ class TrainerBase:
             return names_real
 
     def save_model(
-        self, epoch, directory, is_best=False, val_result=None, model_name=""
+        self,
+        epoch,
+        directory,
+        is_best=False,
+        val_result=None,
+        model_name="",
+        names=None
     ):
-        names = self.get_model_names()
+        names = self.get_model_names(names)
 
         for name in names:
             model_dict = self._models[name].state_dict()
@@ -315,6 +322,9 @@ class SimpleTrainer(TrainerBase):
         else:
             self.device = torch.device("cpu")
 
+        # Converts uint8 image batches on the device (see DATALOADER.UINT8)
+        self.input_tfm = build_input_transform(cfg)
+
         # Save as attributes some frequently used variables
         self.start_epoch = self.epoch = 0
         self.max_epoch = cfg.OPTIM.MAX_EPOCH
@@ -475,11 +485,28 @@ class SimpleTrainer(TrainerBase):
     def model_inference(self, input):
         return self.model(input)
 
+    def prepare_input(self, input):
+        """Move an image batch, or a list of them, to the device, where
+        uint8 batches are scaled and normalized (DATALOADER.UINT8)."""
+        if isinstance(input, (list, tuple)):
+            return [self.prepare_input(input_i) for input_i in input]
+        input = input.to(self.device)
+        if self.input_tfm is not None:
+            input = self.input_tfm(input)
+        return input
+
+    def prefetch(self, data_loader):
+        """Iterate once over a training loader with the next batches
+        already on the device (DATALOADER.PREFETCH)."""
+        return Prefetcher(
+            data_loader, self.device, self.cfg.DATALOADER.PREFETCH, self.input_tfm
+        )
+
     def parse_batch_test(self, batch):
         input = batch["img"]
         label = batch["label"]
 
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         label = label.to(self.device)
 
         return input, label
@@ -518,21 +545,21 @@ class TrainerXU(SimpleTrainer):
         else:
             raise ValueError
 
-        train_loader_x_iter = iter(self.train_loader_x)
-        train_loader_u_iter = iter(self.train_loader_u)
+        train_loader_x_iter = iter(self.prefetch(self.train_loader_x))
+        train_loader_u_iter = iter(self.prefetch(self.train_loader_u))
 
         end = time.time()
         for self.batch_idx in range(self.num_batches):
             try:
                 batch_x = next(train_loader_x_iter)
             except StopIteration:
-                train_loader_x_iter = iter(self.train_loader_x)
+                train_loader_x_iter = iter(self.prefetch(self.train_loader_x))
                 batch_x = next(train_loader_x_iter)
 
             try:
                 batch_u = next(train_loader_u_iter)
             except StopIteration:
-                train_loader_u_iter = iter(self.train_loader_u)
+                train_loader_u_iter = iter(self.prefetch(self.train_loader_u))
                 batch_u = next(train_loader_u_iter)
 
             data_time.update(time.time() - end)
@@ -568,14 +595,18 @@ class TrainerXU(SimpleTrainer):
 
             end = time.time()
 
+        # The loader that was not iterated to its end is still prefetching
+        train_loader_x_iter.close()
+        train_loader_u_iter.close()
+
     def parse_batch_train(self, batch_x, batch_u):
         input_x = batch_x["img"]
         label_x = batch_x["label"]
         input_u = batch_u["img"]
 
-        input_x = input_x.to(self.device)
+        input_x = self.prepare_input(input_x)
         label_x = label_x.to(self.device)
-        input_u = input_u.to(self.device)
+        input_u = self.prepare_input(input_u)
 
         return input_x, label_x, input_u
 
@@ -591,7 +622,7 @@ class TrainerX(SimpleTrainer):
         self.num_batches = len(self.train_loader_x)
 
         end = time.time()
-        for self.batch_idx, batch in enumerate(self.train_loader_x):
+        for self.batch_idx, batch in enumerate(self.prefetch(self.train_loader_x)):
             data_time.update(time.time() - end)
             loss_summary = self.forward_backward(batch)
             batch_time.update(time.time() - end)
@@ -630,7 +661,7 @@ class TrainerX(SimpleTrainer):
         label = batch["label"]
         domain = batch["domain"]
 
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         label = label.to(self.device)
         domain = domain.to(self.device)
 
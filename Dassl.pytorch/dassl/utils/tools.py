@@ -11,6 +11,7 @@ import random
 import os.path as osp
 import warnings
 from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
 import PIL
 import torch
 from PIL import Image
@@ -25,6 +26,7 @@ __all__ = [
     "read_image",
     "collect_env_info",
     "listdir_nohidden",
+    "scan_dirs",
     "get_most_similar_str_to_a_from_b",
     "check_availability",
     "tolist_if_not",
@@ -108,16 +110,23 @@ def download_url(url, dst):
     sys.stdout.write("\n")
 
 
-def read_image(path):
+def read_image(path, size=None):
     """Read image from path using ``PIL.Image``.
 
     Args:
-        path (str): path to an image.
+        path (str or file): path to an image, or the open image file.
+        size (tuple, optional): (width, height) the image is needed at. JPEGs
+            are then decoded at 1/2, 1/4 or 1/8 scale (draft mode) as long as
+            both sides stay at least this large. Default is None (full size).
 
     Returns:
         PIL image
     """
-    return Image.open(path).convert("RGB")
+    img = Image.open(path)
+    if size is not None:
+        # No-op for formats other than JPEG
+        img.draft("RGB", tuple(size))
+    return img.convert("RGB")
 
 
 def collect_env_info():
@@ -145,6 +154,50 @@ def listdir_nohidden(path, sort=False):
     return items
 
 
+def scan_dirs(paths, manifest=None, num_workers=32):
+    """List non-hidden items of many directories in parallel.
+
+    With ``manifest`` (a JSON file), the listings are saved together with
+    the mtime of every directory. Next time a directory is only stat'ed, and
+    listed again only if its mtime changed.
+
+    Args:
+        paths (list): directory paths.
+        manifest (str, optional): path to the manifest file.
+        num_workers (int): number of threads listing directories.
+
+    Returns:
+        dict: the items of each path, in ``listdir_nohidden`` order.
+    """
+    cached = {}
+    if manifest is not None and osp.isfile(manifest):
+        cached = read_json(manifest)
+
+    def _scan(path):
+        mtime = os.stat(path).st_mtime_ns
+        entry = cached.get(path)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+        with os.scandir(path) as it:
+            items = [f.name for f in it if not f.name.startswith(".")]
+        return {"mtime": mtime, "items": items}
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        entries = dict(zip(paths, pool.map(_scan, paths)))
+
+    if manifest is not None and any(cached.get(path) is not entry for path, entry in entries.items()):
+        cached.update(entries)
+        tmp_fpath = f"{manifest}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_fpath, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmp_fpath, manifest)
+        except OSError:
+            warnings.warn(f"Cannot write directory manifest {manifest}")
+
+    return {path: entry["items"] for path, entry in entries.items()}
+
+
 def get_most_similar_str_to_a_from_b(a, b):
     """Return the most similar string to a in b.
 
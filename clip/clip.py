@@ -1,16 +1,21 @@
 import hashlib
+import json
 import os
 import urllib
+import urllib.error
+import urllib.request
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union, List
 
+import numpy as np
 import torch
 from PIL import Image
 from torchvision.transforms import Compose, Resize, CenterCrop, ToTensor, Normalize
 from tqdm import tqdm
 
 from .model import build_model
-from .simple_tokenizer import SimpleTokenizer as _Tokenizer
+from .simple_tokenizer import get_tokenizer
 
 try:
     from torchvision.transforms import InterpolationMode
@@ -22,8 +27,7 @@ except ImportError:
 if torch.__version__.split(".") < ["1", "7", "1"]:
     warnings.warn("PyTorch version 1.7.1 or higher is recommended")
 
-__all__ = ["available_models", "load", "tokenize"]
-_tokenizer = _Tokenizer()
+__all__ = ["available_models", "load", "tokenize", "tokenize_batch"]
 
 _MODELS = {
     "RN50": "https://openaipublic.azureedge.net/clip/models/afeb0e10f9e5a86da6080e35cf09123aca3b358a0c3e3b6c78a7b63bc04b6762/RN50.pt",
@@ -37,35 +41,127 @@ _MODELS = {
 }
 
 
-def _download(url: str, root: str = os.path.expanduser("~/.cache/clip")):
+def _sha256(path: str, chunk_size: int = 1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buffer in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(buffer)
+    return sha256.hexdigest()
+
+
+def _sidecar_key(path: str):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _is_verified(path: str, expected_sha256: str):
+    """Check ``path`` against its ``.sha256`` sidecar, hashing only when the
+    sidecar is missing or the file changed since it was written."""
+    try:
+        with open(path + ".sha256") as f:
+            sidecar = json.load(f)
+        if sidecar == dict(sha256=expected_sha256, **_sidecar_key(path)):
+            return True
+    except (OSError, ValueError):
+        pass
+
+    if _sha256(path) != expected_sha256:
+        return False
+    _write_sidecar(path, expected_sha256)
+    return True
+
+
+def _write_sidecar(path: str, sha256: str):
+    tmp_path = f"{path}.sha256.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(dict(sha256=sha256, **_sidecar_key(path)), f)
+        os.replace(tmp_path, path + ".sha256")
+    except OSError:
+        # Read-only location: the file is simply re-hashed next time
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _download(url: str, root: str = os.path.expanduser("~/.cache/clip"), mirror: str = None,
+              expected_sha256: str = None, chunk_size: int = 1 << 20):
+    """Download ``url`` into ``root`` and return the local path
+
+    The checkpoint is hashed while it streams in and a ``.sha256`` sidecar records
+    the verified hash, so later calls return without reading the file. Data goes to
+    ``<file>.part`` first, which is resumed with an HTTP Range request after an
+    interruption and moved into place only once the hash matches.
+
+    ``mirror`` (default: $CLIP_MIRROR) is either a local directory holding the
+    checkpoint files, which is used in place, or a base URL to fetch them from.
+    ``expected_sha256`` defaults to the hash embedded in the OpenAI URL.
+    """
     os.makedirs(root, exist_ok=True)
     filename = os.path.basename(url)
 
-    expected_sha256 = url.split("/")[-2]
+    expected_sha256 = expected_sha256 or url.split("/")[-2]
     download_target = os.path.join(root, filename)
 
     if os.path.exists(download_target) and not os.path.isfile(download_target):
         raise RuntimeError(f"{download_target} exists and is not a regular file")
 
     if os.path.isfile(download_target):
-        if hashlib.sha256(open(download_target, "rb").read()).hexdigest() == expected_sha256:
+        if _is_verified(download_target, expected_sha256):
             return download_target
         else:
             warnings.warn(f"{download_target} exists, but the SHA256 checksum does not match; re-downloading the file")
 
-    with urllib.request.urlopen(url) as source, open(download_target, "wb") as output:
-        with tqdm(total=int(source.info().get("Content-Length")), ncols=80, unit='iB', unit_scale=True) as loop:
-            while True:
-                buffer = source.read(8192)
-                if not buffer:
-                    break
+    mirror = mirror or os.environ.get("CLIP_MIRROR")
+    if mirror and os.path.isdir(mirror):
+        mirror_path = os.path.join(mirror, filename)
+        if os.path.isfile(mirror_path) and _is_verified(mirror_path, expected_sha256):
+            return mirror_path
+        warnings.warn(f"{mirror_path} is missing or does not match the SHA256 checksum; downloading from {url}")
+    elif mirror:
+        url = mirror.rstrip("/") + "/" + filename
+
+    part_path = download_target + ".part"
+    sha256 = hashlib.sha256()
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    request = urllib.request.Request(url)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
 
+    try:
+        source = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # The partial file does not fit the remote one; start over
+        os.remove(part_path)
+        return _download(url, root, None, expected_sha256, chunk_size)
+
+    with source:
+        if offset > 0 and source.status == 206:
+            # Resume: the bytes already on disk still have to go through the hash
+            with open(part_path, "rb") as f:
+                for buffer in iter(lambda: f.read(chunk_size), b""):
+                    sha256.update(buffer)
+            mode = "ab"
+        else:
+            offset = 0
+            mode = "wb"
+
+        length = source.info().get("Content-Length")
+        total = offset + int(length) if length is not None else None
+        with open(part_path, mode) as output, \
+                tqdm(total=total, initial=offset, ncols=80, unit='iB', unit_scale=True) as loop:
+            for buffer in iter(lambda: source.read(chunk_size), b""):
+                sha256.update(buffer)
                 output.write(buffer)
                 loop.update(len(buffer))
 
-    if hashlib.sha256(open(download_target, "rb").read()).hexdigest() != expected_sha256:
+    if sha256.hexdigest() != expected_sha256:
+        os.remove(part_path)
         raise RuntimeError(f"Model has been downloaded but the SHA256 checksum does not not match")
 
+    os.replace(part_path, download_target)
+    _write_sidecar(download_target, expected_sha256)
     return download_target
 
 
@@ -183,9 +279,37 @@ def load(name: str, device: Union[str, torch.device] = "cuda" if torch.cuda.is_a
     return model, _transform(model.input_resolution.item())
 
 
-def tokenize(texts: Union[str, List[str]], context_length: int = 77, truncate: bool = False) -> torch.LongTensor:
+def _tokenize_into(out, eot, texts, truncate):
+    _tokenizer = get_tokenizer()
+    sot_token = _tokenizer.encoder["<|startoftext|>"]
+    eot_token = _tokenizer.encoder["<|endoftext|>"]
+    context_length = out.shape[1]
+
+    for i, text in enumerate(texts):
+        tokens = _tokenizer.encode(text)
+        n = len(tokens) + 2
+        if n > context_length:
+            if not truncate:
+                raise RuntimeError(f"Input {text} is too long for context length {context_length}")
+            tokens = tokens[:context_length - 2]
+            n = context_length
+        out[i, 0] = sot_token
+        out[i, 1:n - 1] = tokens
+        out[i, n - 1] = eot_token
+        eot[i] = n - 1
+
+
+def _tokenize_chunk(texts, context_length, truncate):
+    out = np.zeros((len(texts), context_length), dtype=np.int64)
+    eot = np.empty(len(texts), dtype=np.int64)
+    _tokenize_into(out, eot, texts, truncate)
+    return out, eot
+
+
+def tokenize_batch(texts: Union[str, List[str]], context_length: int = 77, truncate: bool = False,
+                   num_workers: int = 0, chunk_size: int = 4096):
     """
-    Returns the tokenized representation of given input string(s)
+    Tokenize a batch of strings straight into a preallocated int64 array
 
     Parameters
     ----------
@@ -198,25 +322,60 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 77, truncate: b
     truncate: bool
         Whether to truncate the text in case its encoding is longer than the context length
 
+    num_workers : int
+        Number of worker processes; 0 tokenizes in this process. Only worth it for
+        prompt lists far longer than chunk_size
+
+    chunk_size : int
+        Number of strings handed to a worker at a time
+
     Returns
     -------
-    A two-dimensional tensor containing the resulting tokens, shape = [number of input strings, context_length]
+    tokens : np.ndarray, shape = [number of input strings, context_length]
+
+    eot_indices : np.ndarray, shape = [number of input strings], position of the EOT token in each row
     """
     if isinstance(texts, str):
         texts = [texts]
 
-    sot_token = _tokenizer.encoder["<|startoftext|>"]
-    eot_token = _tokenizer.encoder["<|endoftext|>"]
-    all_tokens = [[sot_token] + _tokenizer.encode(text) + [eot_token] for text in texts]
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
-
-    for i, tokens in enumerate(all_tokens):
-        if len(tokens) > context_length:
-            if truncate:
-                tokens = tokens[:context_length]
-                tokens[-1] = eot_token
-            else:
-                raise RuntimeError(f"Input {texts[i]} is too long for context length {context_length}")
-        result[i, :len(tokens)] = torch.tensor(tokens)
-
-    return result
+    tokens = np.zeros((len(texts), context_length), dtype=np.int64)
+    eot_indices = np.empty(len(texts), dtype=np.int64)
+
+    if num_workers > 0 and len(texts) > chunk_size:
+        starts = range(0, len(texts), chunk_size)
+        with ProcessPoolExecutor(num_workers) as pool:
+            futures = [
+                pool.submit(_tokenize_chunk, texts[start:start + chunk_size], context_length, truncate)
+                for start in starts
+            ]
+            for start, future in zip(starts, futures):
+                out, eot = future.result()
+                tokens[start:start + len(out)] = out
+                eot_indices[start:start + len(eot)] = eot
+    else:
+        _tokenize_into(tokens, eot_indices, texts, truncate)
+
+    return tokens, eot_indices
+
+
+def tokenize(texts: Union[str, List[str]], context_length: int = 77, truncate: bool = False) -> torch.LongTensor:
+    """
+    Returns the tokenized representation of given input string(s)
+
+    Parameters
+    ----------
+    texts : Union[str, List[str]]
+        An input string or a list of input strings to tokenize
+
+    context_length : int
+        The context length to use; all CLIP models use 77 as the context length
+
+    truncate: bool
+        Whether to truncate the text in case its encoding is longer than the context length
+
+    Returns
+    -------
+    A two-dimensional tensor containing the resulting tokens, shape = [number of input strings, context_length]
+    """
+    tokens, _ = tokenize_batch(texts, context_length, truncate)
+    return torch.from_numpy(tokens)
@@ -188,6 +188,15 @@ class ResidualAttentionBlock(nn.Module):
         return x
 
 
+def expand_prompts(prompts: torch.Tensor, batch_size: int):
+    # (n_ctx, width) -> (batch_size, n_ctx, width). Prompts of several seeds stacked as
+    # (n_seeds, n_ctx, width) go with a seed-major batch: seed s owns the s-th chunk of samples
+    if prompts.dim() == 2:
+        return prompts.expand(batch_size, -1, -1)
+    n_seeds = prompts.shape[0]
+    return prompts.unsqueeze(1).expand(-1, batch_size // n_seeds, -1, -1).reshape(batch_size, *prompts.shape[1:])
+
+
 class ResidualAttentionBlock_IVLP(nn.Module):
     def __init__(self, d_model: int, n_head: int, attn_mask: torch.Tensor = None, add_prompt=False,
                  text_layer=False, i=0, design_details=None):
@@ -235,7 +244,7 @@ class ResidualAttentionBlock_IVLP(nn.Module):
                 # Remove the outputs produced by learnable tokens of previous layer
                 prefix = x[0:x.shape[0] - self.n_ctx_visual, :, :]
                 # Create/configure learnable tokens of this layer
-                visual_context = self.VPT_shallow.expand(x.shape[1], -1, -1).permute(1, 0, 2).half()
+                visual_context = expand_prompts(self.VPT_shallow, x.shape[1]).permute(1, 0, 2).half()
                 # Add the learnable tokens of this layer with the input, by replacing the previous
                 # layer learnable tokens
                 x = torch.cat([prefix, visual_context], dim=0)
@@ -391,7 +400,8 @@ class VisionTransformer(nn.Module):
         self.ln_post = LayerNorm(width)
         self.proj = nn.Parameter(scale * torch.randn(width, output_dim))
 
-    def forward(self, x: torch.Tensor):
+    def stem(self, x: torch.Tensor):
+        # Image -> patch and class tokens with positional embeddings (NLD), before any prompt
         x = self.conv1(x)  # shape = [*, width, grid, grid]
         x = x.reshape(x.shape[0], x.shape[1], -1)  # shape = [*, width, grid ** 2]
         x = x.permute(0, 2, 1)  # shape = [*, grid ** 2, width]
@@ -400,11 +410,14 @@ class VisionTransformer(nn.Module):
                                                             device=x.device),
              x], dim=1)  # shape = [*, grid ** 2 + 1, width]
         x = x + self.positional_embedding.to(x.dtype)
+        return x
 
+    def add_prompts(self, x: torch.Tensor):
+        # Output of stem -> prompted token sequence in LND layout, i.e. the input of the first block
         # After positional embeddings, we will attach prompts with the model, remember only those
         # are trainable parameters here in whole image encoder.
         if self.VPT_shallow:
-            visual_ctx = self.VPT.expand(x.shape[0], -1, -1).half()
+            visual_ctx = expand_prompts(self.VPT, x.shape[0]).half()
             x = torch.cat([x, visual_ctx], dim=1)
         else:
             assert self.prompt_till_layer_visual == 0
@@ -413,16 +426,26 @@ class VisionTransformer(nn.Module):
         x = self.ln_pre(x)
 
         x = x.permute(1, 0, 2)  # NLD -> LND
-        x = self.transformer(x)
-        x = x.permute(1, 0, 2)  # LND -> NLD
+        return x
 
-        x = self.ln_post(x[:, 0, :])
+    def embed(self, x: torch.Tensor):
+        # Image -> prompted token sequence in LND layout
+        return self.add_prompts(self.stem(x))
+
+    def head(self, x: torch.Tensor):
+        # Output of any block (LND layout) -> projected class-token feature
+        x = self.ln_post(x[0, :, :])
 
         if self.proj is not None:
             x = x @ self.proj
 
         return x
 
+    def forward(self, x: torch.Tensor):
+        x = self.embed(x)
+        x = self.transformer(x)
+        return self.head(x)
+
 
 class VisionTransformer_MaPLe(nn.Module):
     def __init__(self, input_resolution: int, patch_size: int, width: int, layers: int, heads: int, output_dim: int,
@@ -0,0 +1,146 @@
+"""
+Where CLIP backbones and PromptKD teacher checkpoints live on disk.
+
+Backbones are looked up by name ("ViT-B/16", "ViT-L/14", ...): a local copy in
+one of ``MODEL_DIRS`` (e.g. ``./clip/ViT-B-16.pt``) wins over the download
+cache. The first load converts the original JIT archive into a plain state
+dict file next to it (``<name>.state.pt``, or in the download cache when that
+directory is read-only), which later processes memory-map instead of going
+through ``torch.jit.load``. Loaded state dicts are also kept in memory, so a
+process that builds many models (e.g. a sweep) reads every backbone once.
+Backbones published to the shared weight store (see ``clip.weight_store``)
+are attached from there instead.
+
+Usage:
+    python -m clip.registry convert ViT-B/16 ViT-L/14
+"""
+import argparse
+import os
+import os.path as osp
+import pickle
+
+import torch
+
+from .clip import _MODELS, _download, available_models
+from .weight_store import attach
+
+__all__ = ["model_path", "load_state_dict", "teacher_checkpoint", "clear_cache"]
+
+# Searched in order for local backbone checkpoints before downloading
+MODEL_DIRS = ["./clip"]
+DOWNLOAD_ROOT = osp.expanduser("~/.cache/clip")
+
+TEACHER_ROOT = "./teacher_model"
+# Teacher checkpoint per TRAINER.MODAL, relative to TEACHER_ROOT
+TEACHER_CHECKPOINTS = {
+    "base2novel": "{dataset}/VLPromptLearner/model-best.pth.tar",
+    "cross": "ImageNet-xd/VLPromptLearner_large/model.pth.tar-20",
+}
+
+_cache = {}
+
+
+def _filename(name):
+    return name.replace("/", "-")
+
+
+def model_path(name):
+    """Return the original checkpoint of a CLIP backbone, downloading it if
+    there is no local copy."""
+    for model_dir in MODEL_DIRS:
+        path = osp.join(model_dir, _filename(name) + ".pt")
+        if osp.isfile(path):
+            return path
+    if name not in _MODELS:
+        raise ValueError(f"Unknown CLIP backbone {name}; available models = {available_models()}")
+    return _download(_MODELS[name], DOWNLOAD_ROOT)
+
+
+def _load(path):
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except TypeError:
+        # torch < 2.1 has no mmap/weights_only
+        return torch.load(path, map_location="cpu")
+
+
+def _convert(source, target):
+    try:
+        # loading JIT archive
+        state_dict = torch.jit.load(source, map_location="cpu").eval().state_dict()
+    except RuntimeError:
+        state_dict = torch.load(source, map_location="cpu")
+
+    stat = os.stat(source)
+    converted = {"source": [stat.st_size, stat.st_mtime_ns], "state_dict": dict(state_dict)}
+    for path in [target, osp.join(DOWNLOAD_ROOT, osp.basename(target))]:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(osp.dirname(path), exist_ok=True)
+            torch.save(converted, tmp_path)
+            os.replace(tmp_path, path)
+            break
+        except OSError:
+            if osp.exists(tmp_path):
+                os.remove(tmp_path)
+    return converted["state_dict"]
+
+
+def _load_converted(source):
+    source = osp.abspath(source)
+    stat = os.stat(source)
+    filename = osp.splitext(osp.basename(source))[0] + ".state.pt"
+    target = osp.join(osp.dirname(source), filename)
+
+    for path in [target, osp.join(DOWNLOAD_ROOT, filename)]:
+        if not osp.isfile(path):
+            continue
+        try:
+            converted = _load(path)
+        except (RuntimeError, EOFError, pickle.UnpicklingError):
+            continue
+        if converted.get("source") == [stat.st_size, stat.st_mtime_ns]:
+            return converted["state_dict"]
+    return _convert(source, target)
+
+
+def load_state_dict(name):
+    """Return the state dict of a CLIP backbone (a name or a checkpoint path).
+
+    The result is a fresh dict over cached tensors: ``build_model`` may pop keys
+    from it, but the tensors themselves must not be modified in place.
+    """
+    if name not in _cache:
+        state_dict = attach(name)
+        if state_dict is None:
+            source = name if osp.isfile(name) else model_path(name)
+            state_dict = _load_converted(source)
+        _cache[name] = state_dict
+    return dict(_cache[name])
+
+
+def teacher_checkpoint(dataset, modal="base2novel", root=None):
+    """Return the path of the pretrained PromptKD teacher for a dataset."""
+    if modal not in TEACHER_CHECKPOINTS:
+        raise ValueError(f"No teacher checkpoint for TRAINER.MODAL={modal}; expected one of {list(TEACHER_CHECKPOINTS)}")
+    path = osp.join(root or TEACHER_ROOT, TEACHER_CHECKPOINTS[modal].format(dataset=dataset))
+    if not osp.isfile(path):
+        raise FileNotFoundError(f"Teacher checkpoint not found at {path}; see teacher_model/README.md")
+    return path
+
+
+def clear_cache():
+    _cache.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="pre-convert backbones to the fast state dict format")
+    convert.add_argument("names", type=str, nargs="+", help="backbone names, e.g. ViT-B/16")
+    args = parser.parse_args()
+
+    for name in args.names:
+        source = model_path(name)
+        _load_converted(source)
+        print(f"{name}: {source}")
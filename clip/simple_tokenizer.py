@@ -1,6 +1,9 @@
 import gzip
+import heapq
 import html
 import os
+import pickle
+from collections import OrderedDict
 from functools import lru_cache
 
 import ftfy
@@ -48,6 +51,9 @@ def get_pairs(word):
 
 
 def basic_clean(text):
+    if text.isascii() and text.isprintable() and "&" not in text:
+        # Plain printable ASCII has nothing for ftfy or html.unescape to fix
+        return text.strip()
     text = ftfy.fix_text(text)
     text = html.unescape(html.unescape(text))
     return text.strip()
@@ -59,63 +65,118 @@ def whitespace_clean(text):
     return text
 
 
+def build_vocab(bpe_path):
+    """Parse the BPE merges file into the encoder and the merge ranks."""
+    merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
+    merges = merges[1:49152-256-2+1]
+    merges = [tuple(merge.split()) for merge in merges]
+    vocab = list(bytes_to_unicode().values())
+    vocab = vocab + [v+'</w>' for v in vocab]
+    for merge in merges:
+        vocab.append(''.join(merge))
+    vocab.extend(['<|startoftext|>', '<|endoftext|>'])
+    encoder = dict(zip(vocab, range(len(vocab))))
+    bpe_ranks = dict(zip(merges, range(len(merges))))
+    return encoder, bpe_ranks
+
+
+def load_vocab(bpe_path):
+    """Load the encoder and the merge ranks from a pickled cache next to
+    ``bpe_path``, (re)building the cache when it is missing or stale."""
+    cache_path = bpe_path[:-len(".txt.gz")] + ".pkl" if bpe_path.endswith(".txt.gz") else bpe_path + ".pkl"
+    stat = os.stat(bpe_path)
+    source = (stat.st_size, stat.st_mtime_ns)
+
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        if cache["source"] == source:
+            return cache["encoder"], cache["bpe_ranks"]
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+
+    encoder, bpe_ranks = build_vocab(bpe_path)
+    cache = {"source": source, "encoder": encoder, "bpe_ranks": bpe_ranks}
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Read-only install: keep working without the cache
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return encoder, bpe_ranks
+
+
+@lru_cache()
+def get_tokenizer():
+    """Return the process-wide tokenizer, created on first use."""
+    return SimpleTokenizer()
+
+
 class SimpleTokenizer(object):
-    def __init__(self, bpe_path: str = default_bpe()):
+    def __init__(self, bpe_path: str = default_bpe(), cache_size: int = 100000):
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
-        merges = gzip.open(bpe_path).read().decode("utf-8").split('\n')
-        merges = merges[1:49152-256-2+1]
-        merges = [tuple(merge.split()) for merge in merges]
-        vocab = list(bytes_to_unicode().values())
-        vocab = vocab + [v+'</w>' for v in vocab]
-        for merge in merges:
-            vocab.append(''.join(merge))
-        vocab.extend(['<|startoftext|>', '<|endoftext|>'])
-        self.encoder = dict(zip(vocab, range(len(vocab))))
+        self.encoder, self.bpe_ranks = load_vocab(bpe_path)
         self.decoder = {v: k for k, v in self.encoder.items()}
-        self.bpe_ranks = dict(zip(merges, range(len(merges))))
-        self.cache = {'<|startoftext|>': '<|startoftext|>', '<|endoftext|>': '<|endoftext|>'}
+        self.special_tokens = {'<|startoftext|>': '<|startoftext|>', '<|endoftext|>': '<|endoftext|>'}
+        # LRU cache of token -> bpe string, bounded to cache_size entries
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
         self.pat = re.compile(r"""<\|startoftext\|>|<\|endoftext\|>|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""", re.IGNORECASE)
 
     def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token[:-1]) + ( token[-1] + '</w>',)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token+'</w>'
-
-        while True:
-            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                    new_word.append(first+second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
+        if token in self.special_tokens:
+            return self.special_tokens[token]
+        word = self.cache.get(token)
+        if word is not None:
+            self.cache.move_to_end(token)
+            return word
+
+        symbols = list(token[:-1]) + [token[-1] + '</w>']
+        n = len(symbols)
+        # Doubly linked list over symbol positions; merged-away positions are set to None
+        nxt = list(range(1, n + 1))
+        prv = list(range(-1, n - 1))
+
+        # Pending merges ordered by (rank, position). A merge always creates pairs
+        # of higher rank than its own, so this applies the merges in the same order
+        # as repeatedly merging every occurrence of the lowest-ranked pair.
+        heap = []
+        for i in range(n - 1):
+            rank = self.bpe_ranks.get((symbols[i], symbols[i + 1]))
+            if rank is not None:
+                heap.append((rank, i, symbols[i], symbols[i + 1]))
+        heapq.heapify(heap)
+
+        while heap:
+            rank, i, first, second = heapq.heappop(heap)
+            j = nxt[i]
+            # Symbols only ever grow, so a changed string means the entry is stale
+            if symbols[i] != first or j >= n or symbols[j] != second:
+                continue
+
+            symbols[i] = first + second
+            symbols[j] = None
+            nxt[i] = nxt[j]
+            if nxt[i] < n:
+                prv[nxt[i]] = i
+
+            if prv[i] >= 0:
+                rank = self.bpe_ranks.get((symbols[prv[i]], symbols[i]))
+                if rank is not None:
+                    heapq.heappush(heap, (rank, prv[i], symbols[prv[i]], symbols[i]))
+            if nxt[i] < n:
+                rank = self.bpe_ranks.get((symbols[i], symbols[nxt[i]]))
+                if rank is not None:
+                    heapq.heappush(heap, (rank, i, symbols[i], symbols[nxt[i]]))
+
+        word = ' '.join(symbol for symbol in symbols if symbol is not None)
         self.cache[token] = word
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
         return word
 
     def encode(self, text):
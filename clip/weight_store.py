@@ -0,0 +1,141 @@
+"""
+Frozen CLIP weights shared by all training processes on a host.
+
+One process publishes each backbone into ``ROOT`` (a tmpfs, /dev/shm by
+default) as a single flat file plus a JSON index:
+
+    python -m clip.weight_store publish ViT-B/16 ViT-L/14
+
+``clip.registry.load_state_dict`` then attaches to the published copy, mapping
+it copy-on-write, and ``share_weights`` points the frozen parameters of a built
+model at those pages, so concurrent runs hold one physical copy of the
+backbone and only their prompt parameters privately.
+"""
+import argparse
+import json
+import os
+import os.path as osp
+
+import torch
+
+__all__ = ["publish", "attach", "unpublish", "share_weights", "drop_unchanged"]
+
+ROOT = os.environ.get("CLIP_WEIGHT_STORE", "/dev/shm/clip-weights")
+ALIGNMENT = 64  # bytes; keeps every tensor offset a multiple of its element size
+
+
+def _paths(name, root=None):
+    base = osp.join(root or ROOT, name.replace("/", "-"))
+    return base + ".bin", base + ".json"
+
+
+def publish(name, state_dict, root=None):
+    """Write ``state_dict`` to the store under ``name``. The index is written
+    last, so readers never see a partially written store."""
+    data_path, index_path = _paths(name, root)
+    os.makedirs(osp.dirname(data_path), exist_ok=True)
+
+    tensors = {}
+    offset = 0
+    tmp_path = f"{data_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for key, tensor in state_dict.items():
+            tensor = tensor.detach().cpu().contiguous()
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            tensors[key] = {
+                "dtype": str(tensor.dtype).replace("torch.", ""),
+                "shape": list(tensor.shape),
+                "offset": offset,
+            }
+            f.seek(offset)
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+            offset += tensor.numel() * tensor.element_size()
+        f.truncate(offset)
+    os.replace(tmp_path, data_path)
+
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"nbytes": offset, "tensors": tensors}, f)
+    os.replace(tmp_path, index_path)
+    return data_path
+
+
+def attach(name, root=None):
+    """Return the published state dict of ``name`` as views into the store, or
+    None if it was not published. The mapping is private: an in-place write
+    copies the touched page for this process instead of changing the store."""
+    data_path, index_path = _paths(name, root)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    storage = torch.UntypedStorage.from_file(data_path, shared=False, nbytes=index["nbytes"])
+    state_dict = {}
+    for key, meta in index["tensors"].items():
+        tensor = torch.empty(0, dtype=getattr(torch, meta["dtype"]))
+        tensor.set_(storage, meta["offset"] // tensor.element_size(), meta["shape"])
+        state_dict[key] = tensor
+    return state_dict
+
+
+def unpublish(name, root=None):
+    for path in reversed(_paths(name, root)):
+        if osp.exists(path):
+            os.remove(path)
+
+
+def share_weights(model, state_dict, exclude=("VPT",)):
+    """Replace the parameters of ``model`` by the tensors of ``state_dict`` with the
+    same name, shape and dtype, skipping names that contain any of ``exclude``
+    (the trainable prompts). Returns the number of bytes now shared.
+
+    Shared parameters must stay frozen; ``.float()`` or ``.to(device)`` make
+    private copies again.
+    """
+    shared = 0
+    for name, param in model.named_parameters():
+        if any(pattern in name for pattern in exclude):
+            continue
+        tensor = state_dict.get(name)
+        if tensor is None or tensor.shape != param.shape or tensor.dtype != param.dtype:
+            continue
+        if param.data_ptr() != tensor.data_ptr():
+            param.data = tensor
+        shared += tensor.numel() * tensor.element_size()
+    return shared
+
+
+def drop_unchanged(model, state_dict):
+    """Return ``state_dict`` without the entries that equal the current weights of
+    ``model``. Loading those would be a no-op that still writes, and thereby
+    privately copies, the shared pages."""
+    own_state = model.state_dict()
+    output = {}
+    for key, value in state_dict.items():
+        own = own_state.get(key)
+        if own is not None and own.shape == value.shape and own.dtype == value.dtype \
+                and torch.equal(own, value.to(own.device)):
+            continue
+        output[key] = value
+    return output
+
+
+if __name__ == "__main__":
+    from .registry import _load_converted, model_path
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ["publish", "unpublish"]:
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("names", type=str, nargs="+", help="backbone names, e.g. ViT-B/16")
+    parser.add_argument("--root", type=str, default=None, help=f"store directory (default: {ROOT})")
+    args = parser.parse_args()
+
+    for name in args.names:
+        if args.command == "publish":
+            path = publish(name, _load_converted(model_path(name)), args.root)
+            print(f"{name}: {path} ({osp.getsize(path) / 2**20:.0f} MiB)")
+        else:
+            unpublish(name, args.root)
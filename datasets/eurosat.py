@@ -78,6 +78,8 @@ class EuroSAT(DatasetBase):
         for item_old in dataset_old:
             cname_old = item_old.classname
             cname_new = NEW_CLASSNAMES[cname_old]
-            item_new = Datum(impath=item_old.impath, label=item_old.label, classname=cname_new)
+            item_new = Datum(
+                impath=item_old.impath, label=item_old.label, classname=cname_new, check_file=False
+            )
             dataset_new.append(item_new)
         return dataset_new
@@ -3,7 +3,7 @@ import pickle
 from collections import OrderedDict
 
 from dassl.data.datasets import DATASET_REGISTRY, Datum, DatasetBase
-from dassl.utils import listdir_nohidden, mkdir_if_missing
+from dassl.utils import mkdir_if_missing, scan_dirs
 
 from .oxford_pets import OxfordPets
 
@@ -94,14 +94,18 @@ class ImageNet(DatasetBase):
     def read_data(self, classnames, split_dir):
         split_dir = os.path.join(self.image_dir, split_dir)  # 分别对应train, val
         folders = sorted(f.name for f in os.scandir(split_dir) if f.is_dir())
+        listings = scan_dirs(
+            [os.path.join(split_dir, folder) for folder in folders],
+            manifest=os.path.join(self.dataset_dir, "dir_manifest.json")
+        )
         items = []
 
         for label, folder in enumerate(folders):
-            imnames = listdir_nohidden(os.path.join(split_dir, folder))
+            imnames = listings[os.path.join(split_dir, folder)]
             classname = classnames[folder]
             for imname in imnames:
                 impath = os.path.join(split_dir, folder, imname)
-                item = Datum(impath=impath, label=label, classname=classname)
+                item = Datum(impath=impath, label=label, classname=classname, check_file=False)
                 items.append(item)
 
         return items
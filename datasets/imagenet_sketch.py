@@ -1,7 +1,7 @@
 import os
 
 from dassl.data.datasets import DATASET_REGISTRY, Datum, DatasetBase
-from dassl.utils import listdir_nohidden
+from dassl.utils import listdir_nohidden, scan_dirs
 
 from .imagenet import ImageNet
 
@@ -30,14 +30,18 @@ class ImageNetSketch(DatasetBase):
     def read_data(self, classnames):
         image_dir = self.image_dir
         folders = listdir_nohidden(image_dir, sort=True)
+        listings = scan_dirs(
+            [os.path.join(image_dir, folder) for folder in folders],
+            manifest=os.path.join(self.dataset_dir, "dir_manifest.json")
+        )
         items = []
 
         for label, folder in enumerate(folders):
-            imnames = listdir_nohidden(os.path.join(image_dir, folder))
+            imnames = listings[os.path.join(image_dir, folder)]
             classname = classnames[folder]
             for imname in imnames:
                 impath = os.path.join(image_dir, folder, imname)
-                item = Datum(impath=impath, label=label, classname=classname)
+                item = Datum(impath=impath, label=label, classname=classname, check_file=False)
                 items.append(item)
 
         return items
@@ -1,7 +1,7 @@
 import os
 
 from dassl.data.datasets import DATASET_REGISTRY, Datum, DatasetBase
-from dassl.utils import listdir_nohidden
+from dassl.utils import scan_dirs
 
 from .imagenet import ImageNet
 
@@ -31,16 +31,20 @@ class ImageNetV2(DatasetBase):
     def read_data(self, classnames):
         image_dir = self.image_dir
         folders = list(classnames.keys())
+        listings = scan_dirs(
+            [os.path.join(image_dir, str(label)) for label in range(1000)],
+            manifest=os.path.join(self.dataset_dir, "dir_manifest.json")
+        )
         items = []
 
         for label in range(1000):
             class_dir = os.path.join(image_dir, str(label))
-            imnames = listdir_nohidden(class_dir)
+            imnames = listings[class_dir]
             folder = folders[label]
             classname = classnames[folder]
             for imname in imnames:
                 impath = os.path.join(class_dir, imname)
-                item = Datum(impath=impath, label=label, classname=classname)
+                item = Datum(impath=impath, label=label, classname=classname, check_file=False)
                 items.append(item)
 
         return items
@@ -135,7 +135,8 @@ class OxfordPets(DatasetBase):
             out = []
             for impath, label, classname in items:
                 impath = os.path.join(path_prefix, impath)
-                item = Datum(impath=impath, label=int(label), classname=classname)
+                # Checked all at once if DATASET.CHECK_FILES is set
+                item = Datum(impath=impath, label=int(label), classname=classname, check_file=False)
                 out.append(item)
             return out
 
@@ -163,11 +164,7 @@ class OxfordPets(DatasetBase):
             return args
         
         dataset = args[0]
-        labels = set()
-        for item in dataset:
-            labels.add(item.label)
-        labels = list(labels)
-        labels.sort()
+        labels = sorted({item.label for item in dataset})
         n = len(labels)
         # Divide classes into two halves
         m = math.ceil(n / 2)
@@ -183,12 +180,13 @@ class OxfordPets(DatasetBase):
         for dataset in args:
             dataset_new = []
             for item in dataset:
-                if item.label not in selected:
+                if item.label not in relabeler:
                     continue
                 item_new = Datum(
                     impath=item.impath,
                     label=relabeler[item.label],
-                    classname=item.classname
+                    classname=item.classname,
+                    check_file=False
                 )
                 dataset_new.append(item_new)
             output.append(dataset_new)
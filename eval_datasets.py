@@ -0,0 +1,205 @@
+"""
+Evaluate one model on several datasets in a single process.
+
+The model (and its checkpoint) is built once from --dataset-config-file, whose
+classes form the shared classifier, e.g. the 1000 ImageNet classes. Each target
+dataset is matched onto it by classname, so ImageNet-A/R (200 classes) reuse the
+1000-class text features instead of re-encoding a classifier of their own.
+Target datasets are built in the background and the data loader of the next
+dataset starts loading while the current one is evaluated.
+
+Usage:
+    python eval_datasets.py --root $DATA --trainer PromptKD \
+        --dataset-config-file configs/datasets/imagenet.yaml \
+        --config-file configs/trainers/PromptKD/vit_b16_c2_ep20_batch8_4+4ctx_cross_datasets.yaml \
+        --model-dir output/imagenet/PromptKD/... --load-epoch 20 \
+        --target-config-files configs/datasets/imagenetv2.yaml configs/datasets/imagenet_sketch.yaml \
+            configs/datasets/imagenet_a.yaml configs/datasets/imagenet_r.yaml \
+        TRAINER.MODAL cross
+"""
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from tabulate import tabulate
+
+from dassl.utils import setup_logger, set_random_seed
+from dassl.data.datasets import build_dataset
+from dassl.data.data_manager import build_data_loader
+from dassl.data.transforms import build_transform
+from dassl.evaluation import build_evaluator
+from dassl.engine import build_trainer
+
+from train import setup_cfg, print_args
+
+
+def map_classes(source_classnames, target_classnames):
+    """Return, for every target class, the index of the source class with the
+    same name, or None if the target classes are exactly the source classes.
+    Repeated names are matched in order of appearance."""
+    positions = defaultdict(list)
+    for i, name in enumerate(source_classnames):
+        positions[name].append(i)
+
+    seen = defaultdict(int)
+    indices = []
+    for name in target_classnames:
+        if seen[name] >= len(positions[name]):
+            raise ValueError(f"Class '{name}' does not exist in the evaluated model's classes")
+        indices.append(positions[name][seen[name]])
+        seen[name] += 1
+
+    if indices == list(range(len(source_classnames))):
+        return None
+    return indices
+
+
+class ClassSubsetEvaluator:
+    """Evaluate only the classifier columns of the target classes, in target
+    label order."""
+
+    def __init__(self, evaluator, class_indices):
+        self.evaluator = evaluator
+        self.class_indices = torch.tensor(class_indices)
+
+    def reset(self):
+        self.evaluator.reset()
+
+    def process(self, mo, gt):
+        self.evaluator.process(mo[:, self.class_indices.to(mo.device)], gt)
+
+    def evaluate(self):
+        return self.evaluator.evaluate()
+
+
+class StartedLoader:
+    """A data loader whose first iterator is created up front, so that its
+    workers load batches while the previous dataset is still being evaluated."""
+
+    def __init__(self, data_loader):
+        self.data_loader = data_loader
+        self.dataset = data_loader.dataset
+        self._iterator = iter(data_loader)
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __iter__(self):
+        iterator, self._iterator = self._iterator, None
+        return iterator if iterator is not None else iter(self.data_loader)
+
+
+def target_cfg(cfg, config_file):
+    cfg = cfg.clone()
+    cfg.defrost()
+    cfg.merge_from_file(config_file)
+    cfg.freeze()
+    return cfg
+
+
+def build_target(cfg, tfm_test):
+    dataset = build_dataset(cfg)
+    data_loader = build_data_loader(
+        cfg,
+        sampler_type=cfg.DATALOADER.TEST.SAMPLER,
+        data_source=dataset.test,
+        batch_size=cfg.DATALOADER.TEST.BATCH_SIZE,
+        tfm=tfm_test,
+        is_train=False,
+    )
+    return dataset, data_loader
+
+
+def main(args):
+    cfg = setup_cfg(args)
+    if cfg.SEED >= 0:
+        print("Setting fixed seed: {}".format(cfg.SEED))
+        set_random_seed(cfg.SEED)
+    setup_logger(cfg.OUTPUT_DIR)
+
+    if torch.cuda.is_available() and cfg.USE_CUDA:
+        torch.backends.cudnn.benchmark = True
+
+    print_args(args, cfg)
+
+    trainer = build_trainer(cfg)
+    if args.model_dir:
+        trainer.load_model(args.model_dir, epoch=args.load_epoch)
+    source_classnames = trainer.dm.dataset.classnames
+    tfm_test = build_transform(cfg, is_train=False)
+
+    cfgs = [target_cfg(cfg, config_file) for config_file in args.target_config_files]
+    # Folder scans run one after another in the background, overlapping the evaluation
+    with ThreadPoolExecutor(1) as pool:
+        targets = [pool.submit(build_target, cfg_t, tfm_test) for cfg_t in cfgs]
+
+        table = []
+        next_loader = None
+        for i, cfg_t in enumerate(cfgs):
+            dataset, data_loader = targets[i].result()
+            loader = next_loader if next_loader is not None else StartedLoader(data_loader)
+            next_loader = None
+            if i + 1 < len(cfgs) and targets[i + 1].done():
+                next_loader = StartedLoader(targets[i + 1].result()[1])
+
+            evaluator = build_evaluator(cfg_t, lab2cname=dataset.lab2cname)
+            class_indices = map_classes(source_classnames, dataset.classnames)
+            if class_indices is not None:
+                print(f"Mapping the {len(class_indices)} classes of {cfg_t.DATASET.NAME} onto the model's classes")
+                evaluator = ClassSubsetEvaluator(evaluator, class_indices)
+
+            print(f"** Dataset: {cfg_t.DATASET.NAME} **")
+            trainer.test_loader = loader
+            trainer.evaluator = evaluator
+            accuracy = trainer.test(split="test")
+            table.append([cfg_t.DATASET.NAME, len(dataset.test), dataset.num_classes, f"{accuracy:.2f}"])
+
+    print(tabulate(table, headers=["Dataset", "Images", "Classes", "Accuracy (%)"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", type=str, default="", help="path to dataset")
+    parser.add_argument("--output-dir", type=str, default="", help="output directory")
+    parser.add_argument(
+        "--seed", type=int, default=-1, help="only positive value enables a fixed seed"
+    )
+    parser.add_argument(
+        "--config-file", type=str, default="", help="path to config file"
+    )
+    parser.add_argument(
+        "--dataset-config-file",
+        type=str,
+        default="",
+        help="config file of the dataset whose classes the model is built on",
+    )
+    parser.add_argument(
+        "--target-config-files",
+        type=str,
+        nargs="+",
+        required=True,
+        help="config files of the datasets to evaluate",
+    )
+    parser.add_argument("--trainer", type=str, default="", help="name of trainer")
+    parser.add_argument("--backbone", type=str, default="", help="name of CNN backbone")
+    parser.add_argument("--head", type=str, default="", help="name of head")
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default="",
+        help="load model from this directory (zero-shot if empty)",
+    )
+    parser.add_argument(
+        "--load-epoch", type=int, help="load model weights at this epoch for evaluation"
+    )
+    parser.add_argument(
+        "opts",
+        default=None,
+        nargs=argparse.REMAINDER,
+        help="modify config options using the command-line",
+    )
+    args = parser.parse_args()
+    # Options of train.py that have no meaning here
+    args.resume = ""
+    args.source_domains = args.target_domains = args.transforms = None
+    main(args)
@@ -3,24 +3,16 @@ import sys
 import argparse
 import torch
 
-from clip.simple_tokenizer import SimpleTokenizer
+from clip.simple_tokenizer import get_tokenizer
 from clip import clip
+from clip.registry import load_state_dict
 
 # "ViT-B/16"
 # "RN50"
 def load_clip_to_cpu(backbone_name="ViT-B/16"):
-    url = clip._MODELS[backbone_name]
-    model_path = clip._download(url)
+    state_dict = load_state_dict(backbone_name)
 
-    try:
-        # loading JIT archive
-        model = torch.jit.load(model_path, map_location="cpu").eval()
-        state_dict = None
-
-    except RuntimeError:
-        state_dict = torch.load(model_path, map_location="cpu")
-
-    model = clip.build_model(state_dict or model.state_dict())
+    model = clip.build_model(state_dict)
 
     return model
 
@@ -37,7 +29,7 @@ assert os.path.exists(fpath)
 
 print(f"Return the top-{topk} matched words")
 
-tokenizer = SimpleTokenizer()
+tokenizer = get_tokenizer()
 clip_model = load_clip_to_cpu()
 token_embedding = clip_model.token_embedding.weight
 print(f"Size of token embedding: {token_embedding.shape}")
@@ -0,0 +1,191 @@
+"""
+Run a grid of trainings, datasets x seeds, in one long-lived process.
+
+Every run is the train.py run with the same options and writes to the same
+output directory as the per-run scripts (e.g. scripts/promptkd/base2new_train.sh).
+Whatever does not change between runs is loaded once: the CLIP backbones
+(clip.registry), the tokenizer, the dataset splits and, for PromptKD, the
+teacher and its text features while consecutive runs share a dataset.
+
+With --jobs N, N runs train concurrently in threads, e.g. to fill a GPU with
+several small datasets. Concurrent runs share the global random state, so
+they are not reproducible one by one.
+
+Usage:
+    python sweep.py --root $DATA --trainer PromptKD \
+        --config-file configs/trainers/PromptKD/vit_b16_c2_ep20_batch8_4+4ctx.yaml \
+        --datasets caltech101 dtd eurosat --seeds 1 2 3 \
+        DATASET.NUM_SHOTS 0 TRAINER.MODAL base2novel TRAINER.PROMPTKD.KD_WEIGHT 1000.0
+"""
+import argparse
+import copy
+import datetime
+import os.path as osp
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from tabulate import tabulate
+
+from dassl.utils import set_random_seed, mkdir_if_missing
+from dassl.data.datasets import cache_datasets
+from dassl.engine import build_trainer
+
+from train import setup_cfg, print_args
+
+DEFAULT_OUTPUT_DIR = "output/base2new/train_base/{dataset}/shots_{shots}/{trainer}/{cfg}/seed_{seed}"
+
+
+def dataset_key(cfg):
+    # The options read by datasets/*.py; few-shot splits are sampled per seed
+    seed = cfg.SEED if cfg.DATASET.NUM_SHOTS > 0 else None
+    return cfg.DATASET.dump(), seed, cfg.TRAINER.NAME, cfg.TRAINER.MODAL
+
+
+class RunLog:
+    """Output of one run, written to the console and to the run's log.txt."""
+
+    def __init__(self, console, output_dir):
+        fpath = osp.join(output_dir, "log.txt")
+        if osp.exists(fpath):
+            # make sure the existing log file is not over-written
+            fpath += time.strftime("-%Y-%m-%d-%H-%M-%S")
+        mkdir_if_missing(output_dir)
+        self.console = console
+        self.file = open(fpath, "w")
+
+    def write(self, msg):
+        self.console.write(msg)
+        self.file.write(msg)
+
+    def flush(self):
+        self.console.flush()
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ThreadStdout:
+    """sys.stdout that sends what a thread prints to the log of its run."""
+
+    def __init__(self, console):
+        self.console = console
+        self.local = threading.local()
+
+    def write(self, msg):
+        getattr(self.local, "log", self.console).write(msg)
+
+    def flush(self):
+        getattr(self.local, "log", self.console).flush()
+
+
+def run_cfg(args, dataset, seed):
+    run_args = copy.copy(args)
+    run_args.dataset_config_file = osp.join(args.dataset_config_dir, f"{dataset}.yaml")
+    run_args.seed = seed
+    run_args.output_dir = ""
+    cfg = setup_cfg(run_args)
+
+    cfg.defrost()
+    cfg.OUTPUT_DIR = args.output_dir.format(
+        dataset=dataset,
+        seed=seed,
+        shots=cfg.DATASET.NUM_SHOTS,
+        trainer=cfg.TRAINER.NAME,
+        cfg=osp.splitext(osp.basename(args.config_file))[0],
+    )
+    cfg.freeze()
+    return cfg
+
+
+def run(args, dataset, seed, stdout):
+    cfg = run_cfg(args, dataset, seed)
+    log = RunLog(stdout.console, cfg.OUTPUT_DIR)
+    stdout.local.log = log
+    start = time.time()
+    try:
+        if cfg.SEED >= 0:
+            print("Setting fixed seed: {}".format(cfg.SEED))
+            set_random_seed(cfg.SEED)
+        print_args(args, cfg)
+        trainer = build_trainer(cfg)
+        trainer.train()
+        status = "done"
+    except Exception:
+        traceback.print_exc(file=log)
+        status = "failed"
+    finally:
+        trainer = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        del stdout.local.log
+        log.close()
+
+    elapsed = str(datetime.timedelta(seconds=round(time.time() - start)))
+    return [dataset, seed, status, elapsed, cfg.OUTPUT_DIR]
+
+
+def main(args):
+    if torch.cuda.is_available():
+        torch.backends.cudnn.benchmark = True
+
+    # Dataset splits are read once per dataset (and per seed for few-shot splits)
+    cache_datasets(dataset_key)
+    stdout = ThreadStdout(sys.stdout)
+    sys.stdout = stdout
+
+    grid = [(dataset, seed) for dataset in args.datasets for seed in args.seeds]
+    print(f"Running {len(grid)} trainings ({len(args.datasets)} datasets x {len(args.seeds)} seeds), "
+          f"{args.jobs} at a time")
+    with ThreadPoolExecutor(args.jobs) as pool:
+        futures = [pool.submit(run, args, dataset, seed, stdout) for dataset, seed in grid]
+        table = [future.result() for future in futures]
+
+    print(tabulate(table, headers=["Dataset", "Seed", "Status", "Time", "Output"]))
+    if any(row[2] != "done" for row in table):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", type=str, default="", help="path to dataset")
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=DEFAULT_OUTPUT_DIR,
+        help="output directory of every run, formatted with {dataset}, {seed}, {shots}, {trainer} and {cfg}",
+    )
+    parser.add_argument(
+        "--datasets", type=str, nargs="+", required=True, help="dataset names, e.g. caltech101 dtd"
+    )
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1, 2, 3], help="seeds of every dataset")
+    parser.add_argument(
+        "--dataset-config-dir",
+        type=str,
+        default="configs/datasets",
+        help="directory of the <dataset>.yaml config files",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="number of runs trained concurrently")
+    parser.add_argument(
+        "--config-file", type=str, default="", help="path to config file"
+    )
+    parser.add_argument(
+        "--transforms", type=str, nargs="+", help="data augmentation methods"
+    )
+    parser.add_argument("--trainer", type=str, default="", help="name of trainer")
+    parser.add_argument("--backbone", type=str, default="", help="name of CNN backbone")
+    parser.add_argument("--head", type=str, default="", help="name of head")
+    parser.add_argument(
+        "opts",
+        default=None,
+        nargs=argparse.REMAINDER,
+        help="modify config options using the command-line",
+    )
+    args = parser.parse_args()
+    # Options of train.py that have no meaning here
+    args.resume = ""
+    args.source_domains = args.target_domains = None
+    main(args)
@@ -0,0 +1,89 @@
+"""
+Throughput of image decoding plus transforms, with full-size and with reduced
+(JPEG draft mode) decoding, and how much the test-time inputs differ.
+
+To check that accuracy is unchanged, evaluate a trained model with both
+settings, e.g.:
+    python train.py ... --eval-only --model-dir $MODEL INPUT.REDUCED_DECODE False
+    python train.py ... --eval-only --model-dir $MODEL INPUT.REDUCED_DECODE True
+
+Usage:
+    python tools/benchmark_decode.py --images $DATA/food-101/images --limit 500
+"""
+import os
+import os.path as osp
+import sys
+import time
+import argparse
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), "..", "Dassl.pytorch"))
+
+from dassl.config import get_cfg_default
+from dassl.data.transforms import build_transform, decode_size
+from dassl.utils import read_image
+
+
+def find_images(root, limit):
+    impaths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.lower().endswith((".jpg", ".jpeg")):
+                impaths.append(osp.join(dirpath, filename))
+                if len(impaths) == limit:
+                    return impaths
+    return impaths
+
+
+def throughput(impaths, tfm, size):
+    start = time.time()
+    for impath in impaths:
+        tfm(read_image(impath, size))
+    return len(impaths) / (time.time() - start)
+
+
+def main(args):
+    cfg = get_cfg_default()
+    cfg.INPUT.SIZE = (args.size, args.size)
+    cfg.INPUT.TRANSFORMS = args.transforms
+    impaths = find_images(args.images, args.limit)
+    print(f"{len(impaths)} JPEGs from {args.images}")
+
+    table = []
+    for is_train in [False, True]:
+        tfm = build_transform(cfg, is_train=is_train)
+        size = decode_size(tfm)
+        full = throughput(impaths, tfm, None)
+        reduced = throughput(impaths, tfm, size)
+        table.append((
+            "train" if is_train else "test", size, full, reduced
+        ))
+
+    # Test-time inputs are deterministic, so they can be compared directly
+    tfm = build_transform(cfg, is_train=False)
+    size = decode_size(tfm)
+    diffs = [
+        (tfm(read_image(impath)) - tfm(read_image(impath, size))).abs().mean().item()
+        for impath in impaths
+    ]
+
+    print()
+    for name, size, full, reduced in table:
+        print(f"{name}: decode size {size}, full {full:.0f} img/s, reduced {reduced:.0f} img/s "
+              f"({reduced / full:.2f}x)")
+    print(f"test inputs: mean abs difference {sum(diffs) / len(diffs):.4f} (normalized units)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=str, required=True, help="directory searched for JPEGs")
+    parser.add_argument("--limit", type=int, default=500, help="number of images")
+    parser.add_argument("--size", type=int, default=224, help="INPUT.SIZE")
+    parser.add_argument(
+        "--transforms",
+        type=str,
+        nargs="+",
+        default=["random_resized_crop", "random_flip", "normalize"],
+        help="INPUT.TRANSFORMS",
+    )
+    args = parser.parse_args()
+    main(args)
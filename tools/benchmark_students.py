@@ -0,0 +1,112 @@
+"""
+Throughput of the PromptKD student image encoders.
+
+Builds each student exactly as PromptKD does (prompted CLIP image encoder +
+projector into the teacher space) and times inference on random images.
+
+Throughput only depends on the architecture: with --random-weights the
+students are built from the CLIP hyperparameters below instead of the
+pretrained checkpoints (e.g. where they cannot be downloaded). On CPU the
+students run in fp32, on GPU in CLIP's fp16.
+
+Usage:
+    python tools/benchmark_students.py --students ViT-B/16 ViT-B/32 RN50
+    python tools/benchmark_students.py --device cpu --random-weights --batch-size 8 --iters 5
+"""
+import os.path as osp
+import sys
+import time
+import argparse
+import torch
+from tabulate import tabulate
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), ".."))
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), "..", "Dassl.pytorch"))
+
+from dassl.config import get_cfg_default
+from train import extend_cfg
+from clip.model import CLIP, convert_weights
+from trainers.promptkd import CustomCLIP, load_clip_to_cpu
+
+# embed_dim, image_resolution, vision_layers, vision_width, vision_patch_size
+# (the text encoder is the same for all: width 512, 8 heads, 12 layers)
+ARCHITECTURES = {
+    "ViT-B/16": (512, 224, 12, 768, 16),
+    "ViT-B/32": (512, 224, 12, 768, 32),
+    "RN50": (1024, 224, (3, 4, 6, 3), 64, None),
+}
+
+
+def random_clip(cfg):
+    """CLIP of STUDENT_NAME with random weights, prompted as by load_clip_to_cpu."""
+    design_details = {"trainer": 'IVLP',
+                      "vision_depth": cfg.TRAINER.PROMPTKD.PROMPT_DEPTH_VISION,
+                      "language_depth": cfg.TRAINER.PROMPTKD.PROMPT_DEPTH_TEXT,
+                      "vision_ctx": cfg.TRAINER.PROMPTKD.N_CTX_VISION,
+                      "language_ctx": cfg.TRAINER.PROMPTKD.N_CTX_TEXT}
+    embed_dim, resolution, layers, width, patch_size = ARCHITECTURES[cfg.TRAINER.PROMPTKD.STUDENT_NAME]
+    model = CLIP(embed_dim, resolution, layers, width, patch_size, 77, 49408, 512, 8, 12, design_details)
+    convert_weights(model)
+    return model.eval()
+
+
+@torch.no_grad()
+def benchmark(cfg, args, device):
+    clip_model = random_clip(cfg) if args.random_weights else load_clip_to_cpu(cfg)
+    model = CustomCLIP(cfg, [], clip_model, args.teacher_dim).to(device).eval()
+    if device.type == "cpu":
+        # fp16 kernels are slow or missing on CPU
+        model.float()
+        model.dtype = torch.float32
+    n_params = sum(p.numel() for p in model.parameters())
+
+    image = torch.randn(args.batch_size, 3, *cfg.INPUT.SIZE, device=device)
+    for _ in range(args.warmup):
+        model(image)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+    start = time.time()
+    for _ in range(args.iters):
+        model(image)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.time() - start
+
+    return n_params, args.batch_size * args.iters / elapsed, 1000 * elapsed / args.iters
+
+
+def main(args):
+    device = torch.device(args.device)
+    print(f"Students run on {device}, batch size {args.batch_size}")
+
+    table = []
+    for name in args.students:
+        cfg = get_cfg_default()
+        extend_cfg(cfg)
+        cfg.TRAINER.NAME = "PromptKD"
+        cfg.TRAINER.PROMPTKD.STUDENT_NAME = name
+        if name.startswith("RN"):
+            # A ModifiedResNet has no blocks to prompt
+            cfg.TRAINER.PROMPTKD.PROMPT_DEPTH_VISION = 0
+        n_params, throughput, latency = benchmark(cfg, args, device)
+        table.append([name, f"{n_params / 1e6:.1f}", f"{throughput:.1f}", f"{latency:.2f}"])
+
+    print(tabulate(table, headers=["Student", "Params (M)", "Images/s", "ms/batch"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--students", type=str, nargs="+", default=["ViT-B/16", "ViT-B/32", "RN50"]
+    )
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--random-weights", action="store_true", help="skip the pretrained checkpoints")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument(
+        "--teacher-dim", type=int, default=768, help="embedding dim of the teacher (768 for ViT-L/14)"
+    )
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,55 @@
+"""
+Throughput of the CLIP BPE tokenizer on prompt ensembles.
+
+Encodes every IMAGENET_TEMPLATES prompt for every class name, the workload of
+building a zero-shot text classifier, with a cold token cache each run.
+
+Usage:
+    python tools/benchmark_tokenizer.py --classnames $DATA/imagenet/classnames.txt
+"""
+import os.path as osp
+import sys
+import time
+import argparse
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), ".."))
+
+from clip.simple_tokenizer import SimpleTokenizer
+from trainers.imagenet_templates import IMAGENET_TEMPLATES
+
+
+def read_classnames(path):
+    # Same format as datasets/imagenet.py: "<folder> <class name>" per line
+    classnames = []
+    with open(path, "r") as f:
+        for line in f.readlines():
+            line = line.strip().split(" ")
+            classnames.append(" ".join(line[1:]))
+    return classnames
+
+
+def main(args):
+    classnames = read_classnames(args.classnames)
+    prompts = [template.format(c) for template in IMAGENET_TEMPLATES for c in classnames]
+    print(f"{len(prompts)} prompts ({len(IMAGENET_TEMPLATES)} templates x {len(classnames)} classes)")
+
+    times = []
+    for _ in range(args.repeats):
+        tokenizer = SimpleTokenizer()
+        start = time.time()
+        for prompt in prompts:
+            tokenizer.encode(prompt)
+        times.append(time.time() - start)
+
+    best = min(times)
+    print(f"best of {args.repeats}: {best:.3f}s, {len(prompts) / best:.0f} prompts/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--classnames", type=str, required=True, help="path to imagenet/classnames.txt"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args)
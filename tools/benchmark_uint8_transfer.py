@@ -0,0 +1,182 @@
+"""
+Measure what DATALOADER.UINT8 saves: workers return uint8 images instead of
+normalized float32 ones, and the trainer converts them on the device.
+
+IPC bandwidth: the workers return ready-made image tensors, so the time goes
+into moving them from the workers to the main process (shared memory,
+collation and pinning). Reported as images/s and MB/s of image data.
+
+Loader throughput: images are read and transformed as in training, then
+moved to the device and converted as in SimpleTrainer.prepare_input.
+
+Usage:
+    python tools/benchmark_uint8_transfer.py --workers 8 12 16
+    python tools/benchmark_uint8_transfer.py --images $DATA/imagenet/images/train --limit 4096
+"""
+import os
+import os.path as osp
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import torch
+from PIL import Image
+from tabulate import tabulate
+from torch.utils.data import Dataset
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), "..", "Dassl.pytorch"))
+
+from dassl.config import get_cfg_default
+from dassl.data.data_manager import build_data_loader
+from dassl.data.datasets import Datum
+from dassl.data.transforms import build_transform, build_input_transform
+
+
+def find_images(root, limit):
+    impaths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                impaths.append(osp.join(dirpath, filename))
+                if len(impaths) == limit:
+                    return impaths
+    return impaths
+
+
+def synthetic_image(seed, width=500, height=375):
+    rng = np.random.RandomState(seed)
+    img = rng.randint(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    return Image.fromarray(img).resize((width, height), Image.BILINEAR)
+
+
+class TensorDataset(Dataset):
+    """``length`` copies of one image tensor, as DatasetWrapper outputs."""
+
+    def __init__(self, img, length):
+        self.img = img
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return {"img": self.img.clone(), "label": 0}
+
+
+def measure(loader, n_batches, device, input_tfm=None):
+    """Images/s and MB/s of image data over ``n_batches`` batches. The first
+    batch of every worker (start-up) is not counted."""
+    warmup = max(1, loader.num_workers)
+    n_imgs, n_bytes, start = 0, 0, None
+    for i, batch in enumerate(loader):
+        img = batch["img"].to(device, non_blocking=True)
+        if input_tfm is not None:
+            img = input_tfm(img)
+        if i < warmup:
+            start = time.time()
+            continue
+        n_imgs += len(img)
+        n_bytes += batch["img"].numel() * batch["img"].element_size()
+        if i == warmup + n_batches - 1:
+            break
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.time() - start
+    return n_imgs / elapsed, n_bytes / elapsed / 2**20
+
+
+def ipc_bandwidth(args, workers, dtype, device):
+    size = args.size
+    if dtype == torch.uint8:
+        img = torch.randint(0, 256, (3, size, size), dtype=torch.uint8)
+    else:
+        img = torch.rand(3, size, size)
+    loader = torch.utils.data.DataLoader(
+        TensorDataset(img, args.batch_size * (args.batches + workers)),
+        batch_size=args.batch_size,
+        num_workers=workers,
+        pin_memory=device.type == "cuda",
+    )
+    return measure(loader, args.batches, device)
+
+
+def loader_throughput(cfg, data_source, args, workers, uint8, device):
+    cfg = cfg.clone()
+    cfg.DATALOADER.NUM_WORKERS = workers
+    cfg.DATALOADER.UINT8 = uint8
+    loader = build_data_loader(
+        cfg,
+        sampler_type="RandomSampler",
+        data_source=data_source,
+        batch_size=args.batch_size,
+        tfm=build_transform(cfg, is_train=True),
+        is_train=True
+    )
+    return measure(loader, args.batches, device, build_input_transform(cfg))
+
+
+def main(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Batches are moved to {device}")
+
+    table = []
+    for workers in args.workers:
+        f32 = ipc_bandwidth(args, workers, torch.float32, device)
+        u8 = ipc_bandwidth(args, workers, torch.uint8, device)
+        table.append([
+            workers, f"{f32[0]:.0f}", f"{f32[1]:.0f}", f"{u8[0]:.0f}", f"{u8[1]:.0f}",
+            f"{u8[0] / f32[0]:.2f}x"
+        ])
+    print(f"\nIPC: {args.size}x{args.size} images, batch size {args.batch_size}")
+    print(tabulate(
+        table,
+        headers=["Workers", "float32 img/s", "float32 MB/s", "uint8 img/s", "uint8 MB/s", "Speed-up"]
+    ))
+
+    cfg = get_cfg_default()
+    cfg.INPUT.SIZE = (args.size, args.size)
+    cfg.INPUT.TRANSFORMS = args.transforms
+    cfg.USE_CUDA = device.type == "cuda"
+
+    tmp_dir = None
+    if args.images:
+        impaths = find_images(args.images, args.limit)
+    else:
+        tmp_dir = tempfile.TemporaryDirectory()
+        impaths = []
+        for i in range(args.limit):
+            impath = osp.join(tmp_dir.name, f"{i}.jpg")
+            synthetic_image(i).save(impath, quality=90)
+            impaths.append(impath)
+    data_source = [Datum(impath=impath) for impath in impaths]
+
+    table = []
+    for workers in args.workers:
+        f32 = loader_throughput(cfg, data_source, args, workers, False, device)
+        u8 = loader_throughput(cfg, data_source, args, workers, True, device)
+        table.append([workers, f"{f32[0]:.0f}", f"{u8[0]:.0f}", f"{u8[0] / f32[0]:.2f}x"])
+    print(f"\nTraining loader ({len(impaths)} images, batch size {args.batch_size})")
+    print(tabulate(table, headers=["Workers", "float32 img/s", "uint8 img/s", "Speed-up"]))
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=str, default="", help="directory of training images (default: synthetic)")
+    parser.add_argument("--limit", type=int, default=8192, help="number of images for the loader test")
+    parser.add_argument("--size", type=int, default=224, help="INPUT.SIZE")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--batches", type=int, default=50, help="batches timed per setting")
+    parser.add_argument("--workers", type=int, nargs="+", default=[8, 12, 16])
+    parser.add_argument(
+        "--transforms",
+        type=str,
+        nargs="+",
+        default=["random_resized_crop", "random_flip", "normalize"],
+        help="INPUT.TRANSFORMS",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,212 @@
+"""
+Compare the batched training transforms (INPUT.BATCH_TRANSFORM) with the
+per-sample PIL transforms: do the augmented images follow the same
+distribution, and how fast are the data loaders.
+
+Distribution: the same image is augmented many times by both pipelines and
+per-sample statistics are compared with two-sample Kolmogorov-Smirnov tests.
+A coordinate image (red = x, green = y) turns crop position, size, flips and
+geometric augmentations into statistics; a textured color image covers the
+color operations.
+Large p-values mean the test finds no difference.
+
+Throughput: training batches per second for each number of workers.
+
+Usage:
+    python tools/check_batch_transforms.py --transforms random_resized_crop random_flip normalize
+    python tools/check_batch_transforms.py --transforms random_resized_crop random_flip randaugment_fixmatch normalize
+    python tools/check_batch_transforms.py --images $DATA/imagenet/images/train --workers 0 4 8
+"""
+import os
+import os.path as osp
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import torch
+from PIL import Image
+from scipy.stats import ks_2samp
+from tabulate import tabulate
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), "..", "Dassl.pytorch"))
+
+from dassl.config import get_cfg_default
+from dassl.data.data_manager import BatchTransformLoader, build_data_loader
+from dassl.data.datasets import Datum
+from dassl.data.transforms import build_batch_transform, build_precrop_transform, build_transform
+
+
+def coordinate_image(width, height):
+    x = np.linspace(0, 255, width)[None, :].repeat(height, 0)
+    y = np.linspace(0, 255, height)[:, None].repeat(width, 1)
+    img = np.stack([x, y, np.full_like(x, 128)], axis=2)
+    return Image.fromarray(img.round().astype(np.uint8))
+
+
+def texture_image(width, height, seed=0):
+    rng = np.random.RandomState(seed)
+    img = rng.randint(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    return Image.fromarray(img).resize((width, height), Image.BILINEAR)
+
+
+def augment(cfg, img, n, batched, device, batch_size=64):
+    """``n`` augmented, unnormalized copies of ``img``, shape (n, 3, H, W)."""
+    if not batched:
+        tfm = build_transform(cfg, is_train=True)
+        return torch.stack([tfm(img) for _ in range(n)])
+    precrop = build_precrop_transform(cfg)(img).to(device)
+    batch_tfm = build_batch_transform(cfg)
+    out = []
+    for start in range(0, n, batch_size):
+        m = min(batch_size, n - start)
+        imgs = precrop.unsqueeze(0).expand(m, -1, -1, -1)
+        img_sizes = torch.tensor([[img.height, img.width]]).expand(m, -1)
+        out.append(batch_tfm(imgs, img_sizes).cpu())
+    return torch.cat(out)
+
+
+def coordinate_stats(imgs):
+    x, y = imgs[:, 0], imgs[:, 1]
+    return {
+        "mean x": x.mean(dim=(1, 2)),
+        "mean y": y.mean(dim=(1, 2)),
+        "range x": x.amax(dim=(1, 2)) - x.amin(dim=(1, 2)),
+        "range y": y.amax(dim=(1, 2)) - y.amin(dim=(1, 2)),
+        "x increases": (x[:, :, -1] - x[:, :, 0]).mean(dim=1),
+    }
+
+
+def color_stats(imgs):
+    stats = {}
+    for c, name in enumerate("RGB"):
+        stats[f"mean {name}"] = imgs[:, c].mean(dim=(1, 2))
+        stats[f"std {name}"] = imgs[:, c].std(dim=(1, 2))
+    stats["saturation"] = (imgs.amax(dim=1) - imgs.amin(dim=1)).mean(dim=(1, 2))
+    return stats
+
+
+def check_distribution(cfg, n, device):
+    # Statistics are taken before normalization
+    choices = [choice for choice in cfg.INPUT.TRANSFORMS if choice != "normalize"]
+    cfg = cfg.clone()
+    cfg.INPUT.TRANSFORMS = choices
+    table = []
+    tests = [
+        (coordinate_image(500, 375), coordinate_stats),
+        (texture_image(320, 240), color_stats),
+    ]
+    for img, stats_fn in tests:
+        ref = stats_fn(augment(cfg, img, n, False, device))
+        out = stats_fn(augment(cfg, img, n, True, device))
+        for name in ref:
+            # Rounded, so that identical images give identical statistics
+            # whatever the memory layout of the batch
+            result = ks_2samp(ref[name].numpy().round(5), out[name].numpy().round(5))
+            table.append([
+                name, f"{ref[name].mean():.4f}", f"{out[name].mean():.4f}",
+                f"{result.statistic:.4f}", f"{result.pvalue:.3f}"
+            ])
+    print(tabulate(table, headers=["Statistic", "PIL mean", "Batched mean", "KS", "p-value"]))
+
+
+def find_images(root, limit):
+    impaths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                impaths.append(osp.join(dirpath, filename))
+                if len(impaths) == limit:
+                    return impaths
+    return impaths
+
+
+def throughput(cfg, data_source, batched, n_batches, device):
+    cfg = cfg.clone()
+    cfg.INPUT.BATCH_TRANSFORM = batched
+    if batched:
+        tfm = build_precrop_transform(cfg)
+    else:
+        tfm = build_transform(cfg, is_train=True)
+    loader = build_data_loader(
+        cfg,
+        sampler_type="RandomSampler",
+        data_source=data_source,
+        batch_size=cfg.DATALOADER.TRAIN_X.BATCH_SIZE,
+        tfm=tfm,
+        is_train=True
+    )
+    if batched:
+        loader = BatchTransformLoader(loader, build_batch_transform(cfg), device)
+
+    n_imgs, start = 0, None
+    for i, batch in enumerate(loader):
+        img = batch["img"].to(device)
+        if i == 0:
+            # Worker start-up is not counted
+            start = time.time()
+            continue
+        n_imgs += len(img)
+        if i == n_batches:
+            break
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return n_imgs / (time.time() - start)
+
+
+def main(args):
+    cfg = get_cfg_default()
+    cfg.INPUT.SIZE = (args.size, args.size)
+    cfg.INPUT.TRANSFORMS = args.transforms
+    cfg.INPUT.INTERPOLATION = args.interpolation
+    cfg.DATALOADER.TRAIN_X.BATCH_SIZE = args.batch_size
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Batched transforms run on {device}")
+
+    print(f"\nDistribution of {args.samples} augmentations per image")
+    check_distribution(cfg, args.samples, device)
+
+    tmp_dir = None
+    if args.images:
+        impaths = find_images(args.images, args.limit)
+    else:
+        tmp_dir = tempfile.TemporaryDirectory()
+        impaths = []
+        for i in range(args.limit):
+            impath = osp.join(tmp_dir.name, f"{i}.jpg")
+            texture_image(500, 375, seed=i).save(impath, quality=90)
+            impaths.append(impath)
+    data_source = [Datum(impath=impath) for impath in impaths]
+
+    table = []
+    for workers in args.workers:
+        cfg.DATALOADER.NUM_WORKERS = workers
+        per_sample = throughput(cfg, data_source, False, args.batches, device)
+        batched = throughput(cfg, data_source, True, args.batches, device)
+        table.append([workers, f"{per_sample:.0f}", f"{batched:.0f}", f"{batched / per_sample:.2f}x"])
+    print(f"\nTraining images/s ({len(impaths)} images, batch size {args.batch_size})")
+    print(tabulate(table, headers=["Workers", "Per-sample", "Batched", "Speed-up"]))
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=str, default="", help="directory of training images (default: synthetic)")
+    parser.add_argument("--limit", type=int, default=512, help="number of images for the throughput test")
+    parser.add_argument("--size", type=int, default=224, help="INPUT.SIZE")
+    parser.add_argument("--interpolation", type=str, default="bilinear", help="INPUT.INTERPOLATION")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=20, help="batches timed per setting")
+    parser.add_argument("--samples", type=int, default=2000, help="augmentations per image for the KS tests")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4, 8])
+    parser.add_argument(
+        "--transforms",
+        type=str,
+        nargs="+",
+        default=["random_resized_crop", "random_flip", "colorjitter", "randomgrayscale", "normalize"],
+        help="INPUT.TRANSFORMS",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,80 @@
+"""
+Pack the splits of a dataset into tar shards (see dassl.data.shards) for
+training with DATALOADER.SHARDS.DIR.
+
+The splits are built exactly as train.py builds them, so the same config
+files and options must be given (in particular DATASET.NUM_SHOTS,
+DATASET.SUBSAMPLE_CLASSES and --seed, which decide the items of a split).
+Splits that were not packed are still read from the image files.
+
+Usage:
+    python tools/make_shards.py --root $DATA --output $DATA/shards \
+        --dataset-config-file configs/datasets/imagenet.yaml \
+        --config-file configs/trainers/PromptKD/vit_b16_c2_ep20_batch8_4+4ctx.yaml \
+        --trainer PromptKD --splits train_x DATASET.NUM_SHOTS 0
+"""
+import os.path as osp
+import sys
+import argparse
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), ".."))
+
+from dassl.data.datasets import build_dataset
+from dassl.data.shards import write_shards
+from dassl.utils import set_random_seed
+
+from train import setup_cfg
+
+
+def main(args):
+    cfg = setup_cfg(args)
+    if cfg.SEED >= 0:
+        set_random_seed(cfg.SEED)
+    dataset = build_dataset(cfg)
+
+    for split in args.splits:
+        data_source = getattr(dataset, split)
+        if not data_source:
+            print(f"{split}: empty, skipped")
+            continue
+        directory = write_shards(args.output, data_source, shard_mb=args.shard_mb)
+        print(f"{split}: {len(data_source):,} images in {directory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", type=str, default="", help="path to dataset")
+    parser.add_argument("--output", type=str, required=True, help="DATALOADER.SHARDS.DIR")
+    parser.add_argument(
+        "--splits",
+        type=str,
+        nargs="+",
+        default=["train_x"],
+        help="splits to pack: train_x, train_u, val, test",
+    )
+    parser.add_argument("--shard-mb", type=int, default=1024, help="approximate size of a shard")
+    parser.add_argument(
+        "--seed", type=int, default=-1, help="only positive value enables a fixed seed"
+    )
+    parser.add_argument(
+        "--config-file", type=str, default="", help="path to config file"
+    )
+    parser.add_argument(
+        "--dataset-config-file",
+        type=str,
+        default="",
+        help="path to config file for dataset setup",
+    )
+    parser.add_argument("--trainer", type=str, default="", help="name of trainer")
+    parser.add_argument(
+        "opts",
+        default=None,
+        nargs=argparse.REMAINDER,
+        help="modify config options using the command-line",
+    )
+    args = parser.parse_args()
+    # Options of train.py that do not change the splits
+    args.output_dir = args.resume = ""
+    args.source_domains = args.target_domains = args.transforms = None
+    args.backbone = args.head = ""
+    main(args)
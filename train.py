@@ -103,6 +103,11 @@ def extend_cfg(cfg):
     cfg.TRAINER.COCOOP.CTX_INIT = ""  # initialization words
     cfg.TRAINER.COCOOP.PREC = "fp16"  # fp16, fp32, amp
 
+    # Config for ZeroshotCLIP
+    cfg.TRAINER.ZSCLIP = CN()
+    cfg.TRAINER.ZSCLIP.CACHE_DIR = ""  # cache image embeddings here; "" re-encodes images every test
+    cfg.TRAINER.ZSCLIP.CHUNK_SIZE = 8192  # cached embeddings classified per matmul
+
     # Config for MaPLe
     cfg.TRAINER.MAPLE = CN()
     cfg.TRAINER.MAPLE.N_CTX = 2  # number of context vectors
@@ -155,10 +160,25 @@ def extend_cfg(cfg):
     cfg.TRAINER.PROMPTKD.KD_WEIGHT= 1.0
     cfg.TRAINER.PROMPTKD.TEMPERATURE = 1.0
     cfg.TRAINER.PROMPTKD.TEACHER_NAME = "ViT/L-14"
+    cfg.TRAINER.PROMPTKD.STUDENT_NAME = "ViT-B/16"  # ViT-B/16, ViT-B/32, RN50, ...
+    # Pretrained vision blocks (0-based) kept in a depth-pruned student, e.g. [0, 2, 4, 6, 8, 10]; [] keeps all
+    cfg.TRAINER.PROMPTKD.STUDENT_LAYERS = []
     # 添加新配置
     cfg.TRAINER.PROMPTKD.LOGIT_STANDARDIZATION = True
     cfg.TRAINER.PROMPTKD.ADAPTIVE_TEMPERATURE = True
     cfg.TRAINER.PROMPTKD.TEMP_LEARNING_RATE = 1e-4
+    # Early exit: student blocks (1-based) followed by an extra distilled head, e.g. [4, 8]
+    cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS = []
+    # At inference a sample exits once its softmax margin (top-1 minus top-2) reaches this value;
+    # 0 runs every block (the exits are only reported)
+    cfg.TRAINER.PROMPTKD.EARLY_EXIT_THRESHOLD = 0.5
+    # Students distilled together from one teacher pass, each given as config overrides of
+    # TRAINER.PROMPTKD.* / OPTIM.*, e.g. ["OPTIM.LR 0.005", "TRAINER.PROMPTKD.STUDENT_LAYERS [0,2,4,6,8,10]"];
+    # [] trains the single student described by the config itself
+    cfg.TRAINER.PROMPTKD.STUDENTS = []
+    # Train seeds SEED, SEED+1, ... together: their prompts are stacked and share one batched forward
+    # pass (and the data order); each seed is evaluated and checkpointed as VLPromptLearner_seed<seed>
+    cfg.TRAINER.PROMPTKD.NUM_SEEDS = 1
 
 def setup_cfg(args):
     cfg = get_cfg_default()
@@ -13,28 +13,18 @@ from dassl.utils import load_pretrained_weights, load_checkpoint
 from dassl.optim import build_optimizer, build_lr_scheduler
 
 from clip import clip
-from clip.simple_tokenizer import SimpleTokenizer as _Tokenizer
-
-_tokenizer = _Tokenizer()
+from clip.registry import load_state_dict
+from clip.simple_tokenizer import get_tokenizer
 
 
 def load_clip_to_cpu(cfg):
     backbone_name = cfg.MODEL.BACKBONE.NAME
-    url = clip._MODELS[backbone_name]
-    model_path = clip._download(url)
-
-    try:
-        # loading JIT archive
-        model = torch.jit.load(model_path, map_location="cpu").eval()
-        state_dict = None
-
-    except RuntimeError:
-        state_dict = torch.load(model_path, map_location="cpu")
+    state_dict = load_state_dict(backbone_name)
     design_details = {"trainer": 'CoCoOp',
                       "vision_depth": 0,
                       "language_depth": 0, "vision_ctx": 0,
                       "language_ctx": 0}
-    model = clip.build_model(state_dict or model.state_dict(), design_details)
+    model = clip.build_model(state_dict, design_details)
 
     return model
 
@@ -105,10 +95,10 @@ class PromptLearner(nn.Module):
             self.meta_net.half()
 
         classnames = [name.replace("_", " ") for name in classnames]
-        name_lens = [len(_tokenizer.encode(name)) for name in classnames]
+        name_lens = [len(get_tokenizer().encode(name)) for name in classnames]
         prompts = [prompt_prefix + " " + name + "." for name in classnames]
 
-        tokenized_prompts = torch.cat([clip.tokenize(p) for p in prompts])  # (n_cls, n_tkn)
+        tokenized_prompts = clip.tokenize(prompts)  # (n_cls, n_tkn)
         with torch.no_grad():
             embedding = clip_model.token_embedding(tokenized_prompts).type(dtype)
 
@@ -279,7 +269,7 @@ class CoCoOp(TrainerX):
     def parse_batch_train(self, batch):
         input = batch["img"]
         label = batch["label"]
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         label = label.to(self.device)
         return input, label
 
@@ -1,5 +1,9 @@
 import copy
+import os
 import os.path as osp
+import random
+import threading
+from contextlib import contextmanager
 import numpy as np
 import torch
 import torch.nn as nn
@@ -7,56 +11,54 @@ from torch.nn import functional as F
 from torch.cuda.amp import GradScaler, autocast
 
 from dassl.engine import TRAINER_REGISTRY, TrainerX
-from dassl.utils import load_pretrained_weights, load_checkpoint
+from dassl.data.data_manager import build_data_loader
+from dassl.data.transforms import build_transform
+from dassl.evaluation import build_evaluator
+from dassl.utils import load_pretrained_weights, load_checkpoint, set_random_seed
 from dassl.optim import build_optimizer, build_lr_scheduler
 from clip import clip
-from clip.simple_tokenizer import SimpleTokenizer as _Tokenizer
+from clip.registry import load_state_dict, teacher_checkpoint
+from clip.weight_store import share_weights, drop_unchanged
 from .imagenet_templates import IMAGENET_TEMPLATES
 from tqdm import tqdm
+from tabulate import tabulate
 import math
 
 from clip.model import VisionTransformer, convert_weights
 
-_tokenizer = _Tokenizer()
 
 class Feature_Trans_Module_two_layer(nn.Module):
-    def __init__(self, input_dim=100, out_dim=256):
+    def __init__(self, input_dim=100, out_dim=256, n_seeds=1):
         super(Feature_Trans_Module_two_layer, self).__init__()
 
+        # n_seeds > 1 holds one projector per seed as convolution groups, applied
+        # to a seed-major batch (see stack_seeds)
+        self.n_seeds = n_seeds
         self.conv1 = nn.Sequential(
-            nn.Conv2d(input_dim, out_dim, 1),
-            nn.BatchNorm2d(out_dim),
+            nn.Conv2d(input_dim * n_seeds, out_dim * n_seeds, 1, groups=n_seeds),
+            nn.BatchNorm2d(out_dim * n_seeds),
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_dim, out_dim, 1)
+            nn.Conv2d(out_dim * n_seeds, out_dim * n_seeds, 1, groups=n_seeds)
         )
     def forward(self, input_feat):
-        
+        if self.n_seeds > 1:
+            # (n_seeds * B, D) -> (B, n_seeds * D): the seeds become channel groups
+            input_feat = input_feat.reshape(self.n_seeds, -1, input_feat.shape[-1]).transpose(0, 1)
+            input_feat = input_feat.reshape(input_feat.shape[0], -1)
+
         final_feat = self.conv1(input_feat.unsqueeze(-1).unsqueeze(-1))
-        
-        return final_feat.squeeze(-1).squeeze(-1)
+        final_feat = final_feat.squeeze(-1).squeeze(-1)
+
+        if self.n_seeds > 1:
+            final_feat = final_feat.reshape(final_feat.shape[0], self.n_seeds, -1).transpose(0, 1)
+            final_feat = final_feat.reshape(-1, final_feat.shape[-1])
+        return final_feat
         
 def load_clip_to_cpu_teacher(cfg, zero_shot_model=False):
     backbone_name = cfg.TRAINER.PROMPTKD.TEACHER_NAME
-    # url = clip._MODELS[backbone_name]
-    
-    if backbone_name == "ViT-B/16":
-        model_path = './clip/ViT-B-16.pt'
-    elif backbone_name == "ViT-L/14":
-        model_path = './clip/ViT-L-14.pt'
-    elif backbone_name == "ViT-B/32":
-        model_path = './clip/ViT-B-32.pt'
-    else:
-        print('enter the wrong teacher name.')
-    
-    print(f"CLIP Teacher name is {backbone_name}")
-    
-    try:
-        # loading JIT archive
-        model = torch.jit.load(model_path, map_location="cpu").eval()
-        state_dict = None
+    state_dict = load_state_dict(backbone_name)
 
-    except RuntimeError:
-        state_dict = torch.load(model_path, map_location="cpu")
+    print(f"CLIP Teacher name is {backbone_name}")
 
     # We default use PromptSRC to pretrain our teacher model
     design_details = {"trainer": 'IVLP',
@@ -65,43 +67,121 @@ def load_clip_to_cpu_teacher(cfg, zero_shot_model=False):
                         "vision_ctx": 4,
                         "language_ctx": 4}
     
-    model = clip.build_model(state_dict or model.state_dict(), design_details)
-    # Initialize design_details for teacher model configuration
-    design_details = {
-        'trainer': 'D-Mixer',  # Match your trainer type
-        'vision_ctx': 16,      # Adjust based on your configuration
-        'language_ctx': 16,    # Adjust based on your configuration
-        'maple_length': 16     # Adjust based on your configuration
-    }
-    teacher_design = design_details.copy()
-    teacher_design['trainer'] = 'CoOp'  # 强制教师模型使用标准注意力
-    model = build_model(state_dict, teacher_design)
+    model = clip.build_model(state_dict, design_details)
+    # Frozen weights point at the host-wide copy (see clip.weight_store)
+    share_weights(model, state_dict)
     return model
 
 # 加载学生模型
 def load_clip_to_cpu(cfg, zero_shot_model=False):
     backbone_name = cfg.TRAINER.PROMPTKD.STUDENT_NAME
-    # url = clip._MODELS[backbone_name]
-    model_path = './clip/ViT-B-16.pt'
-    
-    try:
-        # loading JIT archive
-        model = torch.jit.load(model_path, map_location="cpu").eval()
-        state_dict = None
+    state_dict = load_state_dict(backbone_name)
 
-    except RuntimeError:
-        state_dict = torch.load(model_path, map_location="cpu")
+    print(f"CLIP Student name is {backbone_name}")
 
     design_details = {"trainer": 'IVLP',
                       "vision_depth": cfg.TRAINER.PROMPTKD.PROMPT_DEPTH_VISION,
                       "language_depth": cfg.TRAINER.PROMPTKD.PROMPT_DEPTH_TEXT,
                       "vision_ctx": cfg.TRAINER.PROMPTKD.N_CTX_VISION,
                       "language_ctx": cfg.TRAINER.PROMPTKD.N_CTX_TEXT}
-    model = clip.build_model(state_dict or model.state_dict(), design_details)
+
+    layers = list(cfg.TRAINER.PROMPTKD.STUDENT_LAYERS)
+    if layers:
+        # Depth-pruned student: keep only the selected pretrained blocks, renumbered
+        # from 0. Deep VPT prompts follow the new positions (PROMPT_DEPTH_VISION).
+        assert layers == sorted(set(layers)), "STUDENT_LAYERS must be strictly increasing"
+        print(f"Keeping pretrained vision blocks {layers}")
+        state_dict = select_blocks(state_dict, layers, "visual.transformer.resblocks.")
+
+    model = clip.build_model(state_dict, design_details)
+    share_weights(model, state_dict)
 
     return model
 
 
+def select_blocks(state_dict, layers, prefix):
+    """Keep the blocks ``layers`` under ``prefix`` and renumber them 0..len(layers)-1."""
+    n_layers = len({k[len(prefix):].split(".")[0] for k in state_dict if k.startswith(prefix)})
+    assert 0 <= layers[0] and layers[-1] < n_layers, f"Block indices must lie in [0, {n_layers - 1}]"
+    new_index = {str(old): str(new) for new, old in enumerate(layers)}
+
+    output = {}
+    for key, value in state_dict.items():
+        if key.startswith(prefix):
+            index, rest = key[len(prefix):].split(".", 1)
+            if index not in new_index:
+                continue
+            key = prefix + new_index[index] + "." + rest
+        output[key] = value
+    return output
+
+
+def stack_projectors(projs):
+    """Pack per-seed projectors into one grouped projector; the weights and
+    statistics of ``projs`` become views of the packed ones."""
+    conv = projs[0].conv1[0]
+    packed = Feature_Trans_Module_two_layer(conv.in_channels, conv.out_channels, n_seeds=len(projs))
+    convert_weights(packed)
+    packed.to(conv.weight.device)
+
+    for seed, proj in enumerate(projs):
+        for module, packed_module in zip(proj.modules(), packed.modules()):
+            for tensors, packed_tensors in [(module._parameters, packed_module._parameters),
+                                            (module._buffers, packed_module._buffers)]:
+                for key, tensor in tensors.items():
+                    if tensor is None or tensor.dim() == 0:
+                        continue
+                    n = tensor.shape[0]
+                    view = packed_tensors[key].data[seed * n:(seed + 1) * n]
+                    view.copy_(tensor.data)
+                    tensor.data = view
+    return packed
+
+
+@contextmanager
+def fork_seed(seed):
+    """Seed all RNGs with ``seed`` inside the block and restore their
+    previous state afterwards."""
+    py_state, np_state = random.getstate(), np.random.get_state()
+    with torch.random.fork_rng(devices=range(torch.cuda.device_count())):
+        set_random_seed(seed)
+        try:
+            yield
+        finally:
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+
+
+def stack_seeds(models):
+    """Build one CustomCLIP that trains the prompts of ``models``, which differ
+    only in their initialization, in a single forward pass.
+
+    The prompts are stacked along a new leading seed dimension and the
+    projectors become grouped ones. The trainable tensors of ``models`` turn
+    into views of the stacked ones, so every seed is still evaluated and saved
+    on its own. The stacked model shares the frozen weights of models[0] and
+    takes the stem ``tokens`` of a seed-major batch (see CustomCLIP.forward).
+    """
+    frozen = {id(p): p for name, p in models[0].named_parameters() if "VPT" not in name}
+    stacked = copy.deepcopy(models[0], frozen)
+
+    for name, _ in models[0].image_encoder.named_parameters():
+        if "VPT" not in name:
+            continue
+        packed = nn.Parameter(torch.stack([model.image_encoder.get_parameter(name).data for model in models]))
+        owner, _, attr = name.rpartition(".")
+        setattr(stacked.image_encoder.get_submodule(owner), attr, packed)
+        for seed, model in enumerate(models):
+            model.image_encoder.get_parameter(name).data = packed.data[seed]
+
+    stacked.VPT_image_trans = stack_projectors([model.VPT_image_trans for model in models])
+    if stacked.exit_layers:
+        stacked.VPT_exit_heads = nn.ModuleList(
+            [stack_projectors([model.VPT_exit_heads[i] for model in models]) for i in range(len(stacked.exit_layers))]
+        )
+    return stacked
+
+
 class TextEncoder(nn.Module):
     def __init__(self, clip_model):
         super().__init__()
@@ -170,7 +250,7 @@ class VLPromptLearner(nn.Module):
 
         classnames = [name.replace("_", " ") for name in classnames]
         prompts = [prompt_prefix + " " + name + "." for name in classnames]
-        tokenized_prompts = torch.cat([clip.tokenize(p) for p in prompts])  # (n_cls, n_tkn)
+        tokenized_prompts = clip.tokenize(prompts)  # (n_cls, n_tkn)
         
         print(f'classnames size is {len(classnames)}')
 
@@ -239,8 +319,14 @@ class VLPromptLearner(nn.Module):
 
         return prompts
 
+def softmax_margin(logits):
+    """Top-1 minus top-2 softmax probability of every row of ``logits``."""
+    top2 = logits.float().softmax(dim=-1).topk(2, dim=-1).values
+    return top2[:, 0] - top2[:, 1]
+
+
 class CustomCLIP(nn.Module):
-    def __init__(self, cfg, classnames, clip_model):
+    def __init__(self, cfg, classnames, clip_model, teacher_dim=768):
         super().__init__()
         self.image_encoder = clip_model.visual
         
@@ -248,22 +334,118 @@ class CustomCLIP(nn.Module):
         self.dtype = clip_model.dtype
         self.total_epochs = cfg.OPTIM.MAX_EPOCH
         self.n_cls = len(classnames)
-        
-        self.VPT_image_trans = Feature_Trans_Module_two_layer(512, 768)
-       
+
+        # Project the student's image embedding into the teacher's joint space
+        student_dim = self.image_encoder.output_dim
+        self.VPT_image_trans = Feature_Trans_Module_two_layer(student_dim, teacher_dim)
+
         self.cfg = cfg
-        
-        self.VPT_image_trans = self.VPT_image_trans.cuda()
+
+        # The student is moved to its device by PromptKD.build_student
         convert_weights(self.VPT_image_trans)
 
-    def forward(self, image, label=None):
+        # Early exits: block k (1-based) of the student is followed by a lightweight
+        # projector that maps its class token into the teacher's text space
+        self.exit_layers = list(cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS)
+        if self.exit_layers:
+            assert isinstance(self.image_encoder, VisionTransformer), "Early exits need a ViT student"
+            n_layers = self.image_encoder.transformer.layers
+            assert self.exit_layers == sorted(set(self.exit_layers)), "EARLY_EXIT_LAYERS must be strictly increasing"
+            assert 0 < self.exit_layers[0] and self.exit_layers[-1] < n_layers, \
+                f"EARLY_EXIT_LAYERS must lie in [1, {n_layers - 1}]"
+            self.VPT_exit_heads = nn.ModuleList(
+                [Feature_Trans_Module_two_layer(student_dim, teacher_dim) for _ in self.exit_layers]
+            )
+            convert_weights(self.VPT_exit_heads)
+
+    def forward(self, image, label=None, return_exits=False, tokens=None):
+        # tokens: optionally image_encoder.stem(image), computed once for all
+        # students that share this frozen backbone
         logit_scale = self.logit_scale.exp()
-        
-        image_features = self.image_encoder(image.type(self.dtype))
-        image_features = self.VPT_image_trans(image_features)
-        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
 
-        return image_features, logit_scale
+        if not return_exits and tokens is None:
+            image_features = self.image_encoder(image.type(self.dtype))
+            image_features = self.VPT_image_trans(image_features)
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+
+            return image_features, logit_scale
+
+        if tokens is None:
+            x = self.image_encoder.embed(image.type(self.dtype))
+        else:
+            x = self.image_encoder.add_prompts(tokens)
+
+        if not return_exits:
+            return self.exit_features(self.image_encoder.transformer(x), len(self.exit_layers)), logit_scale
+
+        # Features of every exit, ordered as EARLY_EXIT_LAYERS, with the final layer last
+        features = []
+        for i, block in enumerate(self.image_encoder.transformer.resblocks, 1):
+            x = block(x)
+            if i in self.exit_layers:
+                features.append(self.exit_features(x, self.exit_layers.index(i)))
+        features.append(self.exit_features(x, len(self.exit_layers)))
+
+        return features, logit_scale
+
+    def exit_features(self, x, exit_idx):
+        proj = self.VPT_exit_heads[exit_idx] if exit_idx < len(self.exit_layers) else self.VPT_image_trans
+        image_features = proj(self.image_encoder.head(x))
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+
+    @torch.no_grad()
+    def forward_early_exit(self, image, text_features, threshold):
+        """Classify ``image`` and stop each sample at the first exit whose
+        softmax margin (top-1 minus top-2 probability) reaches ``threshold``.
+
+        Samples that exit are dropped from the batch, so the remaining blocks
+        only run on the undecided ones.
+
+        Returns the logits and, per sample, the number of blocks executed.
+        """
+        logit_scale = self.logit_scale.exp()
+        n_layers = self.image_encoder.transformer.layers
+        logits = image.new_zeros(image.shape[0], text_features.shape[0], dtype=text_features.dtype)
+        depth = torch.full((image.shape[0],), n_layers, dtype=torch.long, device=image.device)
+        active = torch.arange(image.shape[0], device=image.device)
+
+        x = self.image_encoder.embed(image.type(self.dtype))
+        for i, block in enumerate(self.image_encoder.transformer.resblocks, 1):
+            x = block(x)
+            if i not in self.exit_layers:
+                continue
+            exit_logits = logit_scale * self.exit_features(x, self.exit_layers.index(i)) @ text_features.t()
+            done = softmax_margin(exit_logits) >= threshold
+            logits[active[done]] = exit_logits[done].type(logits.dtype)
+            depth[active[done]] = i
+            active = active[~done]
+            x = x[:, ~done]
+            if active.numel() == 0:
+                return logits, depth
+
+        final_logits = logit_scale * self.exit_features(x, len(self.exit_layers)) @ text_features.t()
+        logits[active] = final_logits.type(logits.dtype)
+
+        return logits, depth
+
+    def early_exit(self, exit_logits, threshold):
+        """Apply the decision of ``forward_early_exit`` to the logits of every
+        exit (ordered as EARLY_EXIT_LAYERS, final layer last), e.g. from one
+        ``return_exits`` pass.
+
+        Returns the logits and, per sample, the number of blocks executed.
+        """
+        n_layers = self.image_encoder.transformer.layers
+        logits = exit_logits[-1].clone()
+        depth = torch.full((logits.shape[0],), n_layers, dtype=torch.long, device=logits.device)
+        undecided = torch.ones(logits.shape[0], dtype=torch.bool, device=logits.device)
+        for layer, layer_logits in zip(self.exit_layers, exit_logits[:-1]):
+            done = undecided & (softmax_margin(layer_logits) >= threshold)
+            logits[done] = layer_logits[done].type(logits.dtype)
+            depth[done] = layer
+            undecided &= ~done
+
+        return logits, depth
 
 
 class CustomCLIP_teacher(nn.Module):
@@ -275,6 +457,8 @@ class CustomCLIP_teacher(nn.Module):
         self.text_encoder = TextEncoder(clip_model).cuda()
         self.logit_scale = clip_model.logit_scale
         self.dtype = clip_model.dtype
+        # The teacher is frozen, so its text classifier is computed once (see PromptKD.teacher_text_features)
+        self.text_features = None
   
     def forward(self, image=None, label=None):
         
@@ -318,6 +502,60 @@ class AdaptiveTemperature(nn.Module):
         temp = self.mlp(torch.cat([std_t.unsqueeze(0), std_s.unsqueeze(0)]).float())
         return 0.1 + 9.9 * temp  # 将温度限制在0.1-10范围内
 
+class Student:
+    """A student of a PromptKD run: its config, model, optimizer, scheduler
+    and distillation temperature. Filled in by PromptKD.build_student."""
+
+    def __init__(self, name, cfg):
+        self.name = name
+        self.cfg = cfg
+        self.best_result = -np.inf
+
+
+# Options that configure the shared teacher or the shared training loop
+SHARED_STUDENT_KEYS = ["TRAINER.PROMPTKD.TEACHER_NAME", "TRAINER.PROMPTKD.STUDENTS", "OPTIM.MAX_EPOCH"]
+
+
+def student_cfgs(cfg):
+    """Return a (model name, config) pair per entry of TRAINER.PROMPTKD.STUDENTS,
+    each the run's config with the entry's "KEY VALUE ..." overrides applied,
+    per seed if NUM_SEEDS > 1, or the single student described by ``cfg``."""
+    n_seeds = cfg.TRAINER.PROMPTKD.NUM_SEEDS
+    if n_seeds > 1:
+        assert not cfg.TRAINER.PROMPTKD.STUDENTS, "NUM_SEEDS cannot be combined with STUDENTS"
+        output = []
+        for i in range(n_seeds):
+            student_cfg = cfg.clone()
+            student_cfg.defrost()
+            student_cfg.SEED = cfg.SEED + i if cfg.SEED >= 0 else -1
+            student_cfg.freeze()
+            output.append((f"VLPromptLearner_seed{cfg.SEED + i if cfg.SEED >= 0 else i}", student_cfg))
+        return output
+
+    if not cfg.TRAINER.PROMPTKD.STUDENTS:
+        return [("VLPromptLearner", cfg)]
+
+    output = []
+    for i, overrides in enumerate(cfg.TRAINER.PROMPTKD.STUDENTS):
+        opts = overrides.split()
+        for key in opts[0::2]:
+            assert key.startswith(("TRAINER.PROMPTKD.", "OPTIM.")), \
+                f"Students can only override TRAINER.PROMPTKD.* and OPTIM.*, got {key}"
+            assert key not in SHARED_STUDENT_KEYS, f"{key} is shared by all students"
+        student_cfg = cfg.clone()
+        student_cfg.defrost()
+        student_cfg.merge_from_list(opts)
+        student_cfg.TRAINER.PROMPTKD.STUDENTS = []
+        student_cfg.freeze()
+        output.append((f"VLPromptLearner_{i}", student_cfg))
+    return output
+
+
+# The teacher of the last PromptKD run in this process (see PromptKD.build_teacher)
+_teachers = {}
+_teacher_lock = threading.Lock()
+
+
 @TRAINER_REGISTRY.register()
 class PromptKD(TrainerX):
     def check_cfg(self, cfg):
@@ -328,49 +566,109 @@ class PromptKD(TrainerX):
         
         classnames = self.dm.dataset.classnames
         self.n_cls = len(classnames)
-        
-        print(f"Loading CLIP (backbone: {cfg.MODEL.BACKBONE.NAME})")
-        clip_model = load_clip_to_cpu(cfg)
 
-        clip_model_teacher = load_clip_to_cpu_teacher(cfg)
+        self.train_modal = cfg.TRAINER.MODAL
+        self.model_teacher = self.build_teacher(classnames)
+        teacher_dim = self.model_teacher.text_encoder.text_projection.shape[1]
+
+        # Every student is trained from the same teacher outputs (see forward_backward)
+        self.students = []
+        for name, student_cfg in student_cfgs(cfg):
+            if cfg.TRAINER.PROMPTKD.NUM_SEEDS > 1 and student_cfg.SEED >= 0:
+                # The seeds differ in the initialization of their prompts and projectors;
+                # the run's own SEED still governs the data order and training
+                with fork_seed(student_cfg.SEED):
+                    student = self.build_student(name, student_cfg, classnames, teacher_dim)
+            else:
+                student = self.build_student(name, student_cfg, classnames, teacher_dim)
+            self.students.append(student)
+            if cfg.TRAINER.PROMPTKD.NUM_SEEDS > 1:
+                assert isinstance(student.module.image_encoder, VisionTransformer), \
+                    "NUM_SEEDS > 1 needs a ViT student (the seeds share its patch embedding)"
+
+        self.stacked = None
+        if cfg.TRAINER.PROMPTKD.NUM_SEEDS > 1:
+            print(f"Stacking the prompts of {len(self.students)} seeds")
+            self.stacked = stack_seeds([student.module for student in self.students])
+            trainable_list = nn.ModuleList([self.stacked])
+            optim = build_optimizer(trainable_list, cfg.OPTIM)
+            sched = build_lr_scheduler(optim, cfg.OPTIM)
+            self.stacked_scaler = GradScaler() if cfg.TRAINER.PROMPTKD.PREC == "amp" else None
+            for student in self.students:
+                # Every seed checkpoint holds the state of the shared optimizer
+                student.optim, student.sched = optim, sched
+
+        for student in self.students:
+            self.register_model(student.name, student.module, student.optim, student.sched)
+        # self.model, self.optim, ... belong to the student being trained or evaluated
+        self.set_student(self.students[0])
+        self.scalar_prefix = ""
+
+        # Cosine scheduler
+        self.total_epochs = cfg.OPTIM.MAX_EPOCH
+        self.step_counter = 1
+        N = cfg.OPTIM.MAX_EPOCH
+
+        self.base2novel_loader = None
+
+    def build_teacher(self, classnames):
+        """Return the frozen, pretrained teacher. The last one built is kept,
+        so that the next run in the same process (e.g. another seed in
+        sweep.py) reuses it along with its text features."""
+        cfg = self.cfg
+        model_path = teacher_checkpoint(cfg.DATASET.NAME, cfg.TRAINER.MODAL)
+        key = (cfg.TRAINER.PROMPTKD.TEACHER_NAME, osp.abspath(model_path), os.stat(model_path).st_mtime_ns,
+               cfg.TRAINER.MODAL, cfg.TRAINER.PROMPTKD.N_CTX_TEXT, cfg.TRAINER.PROMPTKD.CTX_INIT,
+               tuple(classnames), str(self.device))
+        with _teacher_lock:
+            if key in _teachers:
+                print("Reusing the teacher of the previous run")
+                return _teachers[key]
+
+            clip_model_teacher = load_clip_to_cpu_teacher(cfg)
+            model_teacher = CustomCLIP_teacher(cfg, classnames, clip_model_teacher)
+
+            checkpoint = load_checkpoint(model_path)
+            state_dict = checkpoint["state_dict"]
+
+            if "prompt_learner.token_prefix" in state_dict:
+                del state_dict["prompt_learner.token_prefix"]
+            if "prompt_learner.token_prefix2" in state_dict:
+                del state_dict["prompt_learner.token_prefix2"]
+
+            if "prompt_learner.token_suffix" in state_dict:
+                del state_dict["prompt_learner.token_suffix"]
+            if "prompt_learner.token_suffix2" in state_dict:
+                del state_dict["prompt_learner.token_suffix2"]
+
+            # Only the prompts differ from the pretrained CLIP weights shared with other runs
+            state_dict = drop_unchanged(model_teacher, state_dict)
+            model_teacher.load_state_dict(state_dict, strict=False)
+            model_teacher.to(self.device)
+            model_teacher.eval()
+
+            _teachers.clear()
+            _teachers[key] = model_teacher
+            return model_teacher
+
+    def build_student(self, name, cfg, classnames, teacher_dim):
+        assert cfg.TRAINER.PROMPTKD.PREC in ["fp16", "fp32", "amp"]
+        student = Student(name, cfg)
+
+        print(f"Loading CLIP (backbone: {cfg.TRAINER.PROMPTKD.STUDENT_NAME})")
+        clip_model = load_clip_to_cpu(cfg)
 
         if cfg.TRAINER.PROMPTKD.PREC == "fp32" or cfg.TRAINER.PROMPTKD.PREC == "amp":
             # CLIP's default precision is fp16
             clip_model.float()
 
         print("Building custom CLIP")
-        self.model = CustomCLIP(cfg, classnames, clip_model)
+        model = CustomCLIP(cfg, classnames, clip_model, teacher_dim)
 
-        self.model_teacher = CustomCLIP_teacher(cfg, classnames, clip_model_teacher)
-        
-        if cfg.TRAINER.MODAL == "base2novel":
-            model_path = './teacher_model/'+str(cfg.DATASET.NAME)+'/VLPromptLearner/model-best.pth.tar'
-        elif cfg.TRAINER.MODAL == "cross":
-            model_path = './teacher_model/ImageNet-xd/VLPromptLearner_large/model.pth.tar-20'
-            
-        self.train_modal = cfg.TRAINER.MODAL
-        
-        checkpoint = load_checkpoint(model_path)
-        state_dict = checkpoint["state_dict"]
-        
-        if "prompt_learner.token_prefix" in state_dict:
-            del state_dict["prompt_learner.token_prefix"]
-        if "prompt_learner.token_prefix2" in state_dict:
-            del state_dict["prompt_learner.token_prefix2"]
-
-        if "prompt_learner.token_suffix" in state_dict:
-            del state_dict["prompt_learner.token_suffix"]
-        if "prompt_learner.token_suffix2" in state_dict:
-            del state_dict["prompt_learner.token_suffix2"]
-        
-        self.model_teacher.load_state_dict(state_dict, strict=False)
-        self.model_teacher.to(self.device)
-        self.model_teacher.eval()
-        
         print("Turning off gradients in both the image and the text encoder")
         name_to_update = "prompt_learner"
 
-        for name, param in self.model.named_parameters():
+        for name, param in model.named_parameters():
             if name_to_update not in name:
                 # Make sure that VPT prompts are updated
                 if "VPT" in name:
@@ -383,48 +681,90 @@ class PromptKD(TrainerX):
 
         # Double check
         enabled = set()
-        for name, param in self.model.named_parameters():
+        for name, param in model.named_parameters():
             if param.requires_grad:
                 enabled.add(name)
         print(f"Parameters to be updated: {enabled}")
         print(f"Parameters count: {len(enabled)}")
         if cfg.MODEL.INIT_WEIGHTS:
-            load_pretrained_weights(self.model, cfg.MODEL.INIT_WEIGHTS)
-
-        self.model.to(self.device)
+            load_pretrained_weights(model, cfg.MODEL.INIT_WEIGHTS)
+
+        # Students with the same frozen backbone keep a single copy of it on the device
+        student.weights_key = (cfg.TRAINER.PROMPTKD.STUDENT_NAME, tuple(cfg.TRAINER.PROMPTKD.STUDENT_LAYERS),
+                               cfg.TRAINER.PROMPTKD.PREC)
+        for other in self.students:
+            if other.weights_key == student.weights_key:
+                share_weights(model, dict(other.module.named_parameters()))
+                break
+        # ... and a ViT stem (patch embedding) computed once per batch
+        student.stem_key = None
+        if isinstance(model.image_encoder, VisionTransformer):
+            student.stem_key = (cfg.TRAINER.PROMPTKD.STUDENT_NAME, cfg.TRAINER.PROMPTKD.PREC)
+
+        model.to(self.device)
         # NOTE: only give prompt_learner to the optimizer
 
-        self.trainable_list = nn.ModuleList([])
-        self.trainable_list.append(self.model)
+        trainable_list = nn.ModuleList([])
+        trainable_list.append(model)
 
-        self.optim = build_optimizer(self.trainable_list, cfg.OPTIM)
-        self.sched = build_lr_scheduler(self.optim, cfg.OPTIM)
-        self.register_model("VLPromptLearner", self.model, self.optim, self.sched)
-        
-        # Cosine scheduler
-        self.total_epochs = cfg.OPTIM.MAX_EPOCH
-        self.step_counter = 1
-        N = cfg.OPTIM.MAX_EPOCH
-        
-        self.scaler = GradScaler() if cfg.TRAINER.PROMPTKD.PREC == "amp" else None
+        student.module = model
+        student.optim = build_optimizer(trainable_list, cfg.OPTIM)
+        student.sched = build_lr_scheduler(student.optim, cfg.OPTIM)
+
+        student.scaler = GradScaler() if cfg.TRAINER.PROMPTKD.PREC == "amp" else None
         # Note that multi-gpu training could be slow because CLIP's size is
         # big, which slows down the copy operation in DataParallel
         device_count = torch.cuda.device_count()
         if device_count > 1:
             print(f"Multiple GPUs detected (n_gpus={device_count}), use all of them!")
-            self.model = nn.DataParallel(self.model)
+            model = nn.DataParallel(model)
+        student.model = model
 
-        if self.cfg.TRAINER.PROMPTKD.ADAPTIVE_TEMPERATURE:
-            self.temperature = self.cfg.TRAINER.PROMPTKD.TEMPERATURE
+        student.temperature = cfg.TRAINER.PROMPTKD.TEMPERATURE
+        student.temp_module = None
+        if cfg.TRAINER.PROMPTKD.ADAPTIVE_TEMPERATURE:
             # 初始化自适应温度模块，修正输入维度为2
-            self.temp_module = AdaptiveTemperature(input_dim=2).to(self.device)
-        else:
-            self.temperature = self.cfg.TRAINER.PROMPTKD.TEMPERATURE
+            student.temp_module = AdaptiveTemperature(input_dim=2).to(self.device)
+
+        return student
+
+    def set_student(self, student):
+        self.student = student
+        self.model = student.model
+        self.optim = student.optim
+        self.sched = student.sched
+        self.scaler = student.scaler
+        self.temperature = student.temperature
+        self.temp_module = student.temp_module
+
+    @contextmanager
+    def use_student(self, student):
+        """Run the single-student code paths on ``student``, with its config."""
+        previous, cfg = self.student, self.cfg
+        self.set_student(student)
+        self.cfg = student.cfg
+        if len(self.students) > 1:
+            self.scalar_prefix = f"{student.name}/"
+        try:
+            yield student
+        finally:
+            self.set_student(previous)
+            self.cfg = cfg
+            self.scalar_prefix = ""
+
+    def get_student_by_name(self, name):
+        for student in self.students:
+            if student.name == name:
+                return student
+        raise KeyError(name)
+
+    def write_scalar(self, tag, scalar_value, global_step=None):
+        super().write_scalar(self.scalar_prefix + tag, scalar_value, global_step)
 
     def parse_batch_train(self, batch):
         input = batch["img"]
         label = batch["label"]
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         label = label.to(self.device)
         return input, label
 
@@ -462,12 +802,133 @@ class PromptKD(TrainerX):
             if "prompt_learner.token_suffix2" in state_dict:
                 del state_dict["prompt_learner.token_suffix2"]
                 
+            with self.use_student(self.get_student_by_name(name)):
+                state_dict = self.remap_student_blocks(state_dict)
+
             print("Loading weights to {} " 'from "{}" (epoch = {})'.format(name, model_path, epoch))
             # set strict=False
             self._models[name].load_state_dict(state_dict, strict=False)
 
+    def remap_student_blocks(self, state_dict):
+        """Load a checkpoint of the full-depth student into a depth-pruned one
+        by keeping the blocks listed in STUDENT_LAYERS."""
+        layers = list(self.cfg.TRAINER.PROMPTKD.STUDENT_LAYERS)
+        prefix = "image_encoder.transformer.resblocks."
+        indices = [int(k[len(prefix):].split(".")[0]) for k in state_dict if k.startswith(prefix)]
+        n_layers = self.get_student().image_encoder.transformer.layers
+        if layers and indices and max(indices) >= n_layers:
+            print(f"Checkpoint has {max(indices) + 1} student blocks, keeping {layers}")
+            state_dict = select_blocks(state_dict, layers, prefix)
+        return state_dict
+
+    def use_base2novel_pass(self):
+        # Early-exit reports are per split, so they keep the separate passes
+        return self.train_modal == "base2novel" and not self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS
+
+    def after_epoch(self):
+        last_epoch = (self.epoch + 1) == self.max_epoch
+        do_test = not self.cfg.TEST.NO_TEST
+        meet_checkpoint_freq = (
+            (self.epoch + 1) % self.cfg.TRAIN.CHECKPOINT_FREQ == 0
+            if self.cfg.TRAIN.CHECKPOINT_FREQ > 0 else False
+        )
+
+        # Each student selects and saves its own best model
+        for student in self.students:
+            with self.use_student(student):
+                if do_test and self.cfg.TEST.FINAL_MODEL == "best_val":
+                    if self.use_base2novel_pass():
+                        # Base and novel accuracy come from the same pass. The best model is
+                        # selected on the base (*val*) accuracy only; the novel (*test*)
+                        # accuracy and the harmonic mean are logged, never used for selection
+                        curr_result = self.test_base2novel()["base"]
+                    else:
+                        curr_result = self.test_student(split="val")
+                    if curr_result > student.best_result:
+                        student.best_result = curr_result
+                        self.save_model(
+                            self.epoch,
+                            self.output_dir,
+                            val_result=curr_result,
+                            model_name="model-best.pth.tar",
+                            names=student.name
+                        )
+
+                if meet_checkpoint_freq or last_epoch:
+                    self.save_model(self.epoch, self.output_dir, names=student.name)
+
+    @torch.no_grad()
+    def test_base2novel(self):
+        """Evaluate the base (*val*) and novel (*test*) classes in a single pass
+        over both splits, scoring every image once against the teacher's
+        classifier over all classes. Returns the base and novel accuracy and
+        their harmonic mean. Only run by after_epoch; test() keeps evaluating
+        TEST.SPLIT on its own."""
+        self.set_model_mode("eval")
+        dataset = self.dm.dataset
+        if self.base2novel_loader is None:
+            self.base2novel_loader = build_data_loader(
+                self.cfg,
+                sampler_type=self.cfg.DATALOADER.TEST.SAMPLER,
+                data_source=dataset.val + dataset.test,
+                batch_size=self.cfg.DATALOADER.TEST.BATCH_SIZE,
+                tfm=build_transform(self.cfg, is_train=False),
+                is_train=False,
+            )
+
+        n_base_cls = math.ceil(self.n_cls / 2)
+        n_base = len(dataset.val)
+        lab2cname = {i: c for i, c in enumerate(dataset.classnames[n_base_cls:])}
+        evaluator_base = self.evaluator
+        evaluator_novel = build_evaluator(self.cfg, lab2cname=lab2cname)
+        evaluator_base.reset()
+        evaluator_novel.reset()
+        text_features = self.teacher_text_features()
+
+        print("Evaluate on the *val* (base) and *test* (novel) sets")
+
+        for batch in tqdm(self.base2novel_loader):
+            image, label = self.parse_batch_test(batch)
+            output = self.model_inference(image, text_features)
+            # Items before n_base come from the base split
+            is_base = (batch["index"] < n_base).to(self.device)
+            if is_base.any():
+                evaluator_base.process(output[is_base, :n_base_cls], label[is_base])
+            if not is_base.all():
+                evaluator_novel.process(output[~is_base, n_base_cls:], label[~is_base])
+
+        print("Base classes:")
+        base = evaluator_base.evaluate()["accuracy"]
+        print("Novel classes:")
+        novel = evaluator_novel.evaluate()["accuracy"]
+        hm = 2 * base * novel / (base + novel) if base + novel > 0 else 0.0
+        print(f"* harmonic mean: {hm:.2f}%")
+
+        self.write_scalar("val/accuracy", base, self.epoch)
+        self.write_scalar("test/accuracy", novel, self.epoch)
+        self.write_scalar("test/harmonic_mean", hm, self.epoch)
+
+        return {"base": base, "novel": novel, "harmonic_mean": hm}
+
     @torch.no_grad()
     def test(self, split=None):
+        """Evaluate every student; with several students the best result is
+        returned."""
+        if len(self.students) == 1:
+            return self.test_student(split)
+
+        results = []
+        for student in self.students:
+            print(f"** Student {student.name} **")
+            with self.use_student(student):
+                results.append(self.test_student(split))
+
+        table = [[student.name, f"{result:.2f}"] for student, result in zip(self.students, results)]
+        print(tabulate(table, headers=["Student", "Result"]))
+        return max(results)
+
+    @torch.no_grad()
+    def test_student(self, split=None):
         """A generic testing pipeline."""
         self.set_model_mode("eval")
         self.evaluator.reset()
@@ -484,24 +945,37 @@ class PromptKD(TrainerX):
             data_loader = self.test_loader
 
         print(f"Evaluate on the *{split}* set")
-        
+
+        n_exits = len(self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS)
+        if n_exits:
+            exit_correct = torch.zeros(n_exits + 1, dtype=torch.long)
+            early_exit_depth, total = 0, 0
+
         for batch_idx, batch in enumerate(tqdm(data_loader)):
             image, label = self.parse_batch_test(batch)
-            
-            with torch.no_grad():
-                tea_image_features, tea_text_features, tea_logits = self.model_teacher(image, label)
-                
-            image_ft, logit_scale = self.model(image, label)
-            
-            if self.train_modal == "base2novel":
-                if split == "val":
-                    output = logit_scale * image_ft @ tea_text_features[:math.ceil(self.n_cls / 2),:].t()
-                elif split == "test":
-                    output = logit_scale * image_ft @ tea_text_features[math.ceil(self.n_cls / 2):,:].t()
-            elif self.train_modal == "cross" :
-                output = logit_scale * image_ft @ tea_text_features.t()
-            
-            self.evaluator.process(output, label) 
+
+            text_features = self.split_text_features(self.teacher_text_features(), split)
+
+            if n_exits:
+                # One pass through every block gives the accuracy of each exit; the
+                # early-exit output (as from model_inference) is derived from it
+                image_fts, logit_scale = self.model(image, label, return_exits=True)
+                exit_logits = [logit_scale * image_ft @ text_features.t() for image_ft in image_fts]
+                for i, logits in enumerate(exit_logits):
+                    exit_correct[i] += (logits.argmax(dim=-1) == label).sum().item()
+
+                if self.use_early_exit():
+                    output, depth = self.get_student().early_exit(
+                        exit_logits, self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_THRESHOLD
+                    )
+                    early_exit_depth += depth.sum().item()
+                else:
+                    output = exit_logits[-1]
+                total += label.numel()
+            else:
+                output = self.model_inference(image, text_features)
+
+            self.evaluator.process(output, label)
 
         results = self.evaluator.evaluate()
 
@@ -509,44 +983,79 @@ class PromptKD(TrainerX):
             tag = f"{split}/{k}"
             self.write_scalar(tag, v, self.epoch)
 
-        return list(results.values())[0]
+        if n_exits:
+            self.report_early_exit(split, exit_correct, results["accuracy"], early_exit_depth, total)
 
-    def forward_backward(self, batch):
-        input, label = self.parse_batch_train(batch)
-        loss_summary = {}
-
-        # 添加调试信息
-        #print(f"Input shape: {input.shape}")
-        #print(f"Label shape: {label.shape}")
-        #print(f"Label min: {label.min()}, Label max: {label.max()}")
-        #print(f"Number of classes: {self.n_cls}")
-
-        # 教师模型前向传播
-        with torch.no_grad():
-            tea_image_features, tea_text_features, tea_logits = self.model_teacher(input, label)
-
-        # 学生模型前向传播
-        image_ft, logit_scale = self.model(input, label)
+        return list(results.values())[0]
 
-        # 计算学生模型的logits
+    @torch.no_grad()
+    def teacher_text_features(self):
+        """Return the normalized text features of the teacher's prompted
+        classifier over all classnames, computed on first use."""
+        teacher = self.model_teacher
+        if teacher.text_features is None:
+            prompts = teacher.prompt_learner()
+            text_features = teacher.text_encoder(prompts.cuda(), teacher.tokenized_prompts.cuda())
+            teacher.text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        return teacher.text_features
+
+    def use_early_exit(self):
+        # A threshold of 0 runs every block at inference
+        cfg = self.cfg.TRAINER.PROMPTKD
+        return bool(cfg.EARLY_EXIT_LAYERS) and cfg.EARLY_EXIT_THRESHOLD > 0
+
+    def model_inference(self, image, text_features=None):
+        if text_features is None:
+            text_features = self.teacher_text_features()
+        if self.use_early_exit():
+            # Blocks after a sample's exit are skipped
+            logits, _ = self.get_student().forward_early_exit(
+                image, text_features, self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_THRESHOLD
+            )
+            return logits
+        image_ft, logit_scale = self.model(image)
+        return logit_scale * image_ft @ text_features.t()
+
+    def get_student(self):
+        if isinstance(self.model, nn.DataParallel):
+            return self.model.module
+        return self.model
+
+    def split_text_features(self, text_features, split):
+        """Select the classifier of the evaluated split: in base2novel mode
+        *val* holds the base classes and *test* the novel ones."""
         if self.train_modal == "base2novel":
-            # 修改此处，确保输出类别数能覆盖所有标签值
-            required_classes = label.max().item() + 1
-            # 确保不超过总类别数
-            required_classes = min(required_classes, self.n_cls)
-            output = logit_scale * image_ft @ tea_text_features[:required_classes,:].t()
-            # 同步教师logits与学生输出的类别数量
-            tea_logits = tea_logits[:, :required_classes]
-            #print(f"Using {required_classes} classes for output")
-        elif self.train_modal == "cross":
-            output = logit_scale * image_ft @ tea_text_features.t()
-
-        # 添加调试信息
-        #print(f"Output shape: {output.shape}")
-
+            if split == "val":
+                return text_features[:math.ceil(self.n_cls / 2), :]
+            elif split == "test":
+                return text_features[math.ceil(self.n_cls / 2):, :]
+        return text_features
+
+    def report_early_exit(self, split, exit_correct, early_exit_acc, early_exit_depth, total):
+        """Print accuracy and compute (fraction of student blocks executed)
+        for every exit and, if enabled, for the thresholded early-exit
+        inference."""
+        n_layers = self.get_student().image_encoder.transformer.layers
+        threshold = self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_THRESHOLD
+        exit_layers = list(self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS) + [n_layers]
+
+        table = []
+        for layer, correct in zip(exit_layers, exit_correct.tolist()):
+            acc = 100.0 * correct / total
+            table.append([f"exit@{layer}", f"{acc:.2f}", f"{layer / n_layers:.2f}"])
+            self.write_scalar(f"{split}/accuracy_exit{layer}", acc, self.epoch)
+
+        if self.use_early_exit():
+            compute = early_exit_depth / (total * n_layers)
+            table.append([f"early exit (margin>={threshold})", f"{early_exit_acc:.2f}", f"{compute:.2f}"])
+            self.write_scalar(f"{split}/accuracy_early_exit", early_exit_acc, self.epoch)
+            self.write_scalar(f"{split}/compute_early_exit", compute, self.epoch)
+
+        print(tabulate(table, headers=["Head", "Accuracy (%)", "Relative compute"]))
+
+    def distill_loss(self, output, tea_logits, label):
         # 计算分类损失
         loss_cls = F.cross_entropy(output, label)
-        loss_summary['loss_cls'] = loss_cls.item()
 
         # 知识蒸馏损失
         if self.cfg.TRAINER.PROMPTKD.LOGIT_STANDARDIZATION:
@@ -567,11 +1076,92 @@ class PromptKD(TrainerX):
         loss_kd = F.kl_div(F.log_softmax(student_logits_norm / temp, dim=1),
                            F.softmax(tea_logits_norm / temp, dim=1),
                            reduction='batchmean') * (temp ** 2)
-        loss_summary['loss_kd'] = loss_kd.item()
 
-        # 总损失
-        loss = loss_cls + self.cfg.TRAINER.PROMPTKD.KD_WEIGHT * loss_kd
-        loss_summary['loss'] = loss.item()
+        return loss_cls, loss_kd
+
+    def forward_backward(self, batch):
+        input, label = self.parse_batch_train(batch)
+
+        # 教师模型前向传播
+        with torch.no_grad():
+            tea_image_features, tea_text_features, tea_logits = self.model_teacher(input, label)
+
+        if len(self.students) == 1:
+            return self.student_step(input, label, tea_text_features, tea_logits)
+
+        if self.stacked is not None:
+            return self.stacked_step(input, label, tea_text_features, tea_logits)
+
+        # The teacher runs once for all students. The prompt-free ViT stem is
+        # shared by students with the same backbone; the blocks are not, as the
+        # prompts enter every block's input.
+        loss_summary = {}
+        stems = {}
+        for i, student in enumerate(self.students):
+            tokens = None
+            if student.stem_key is not None:
+                if student.stem_key not in stems:
+                    with torch.no_grad():
+                        image_encoder = student.module.image_encoder
+                        stems[student.stem_key] = image_encoder.stem(input.type(student.module.dtype))
+                tokens = stems[student.stem_key]
+
+            with self.use_student(student):
+                summary = self.student_step(input, label, tea_text_features, tea_logits, tokens)
+            for k, v in summary.items():
+                loss_summary[f"s{i}_{k}"] = v
+
+        return loss_summary
+
+    def stacked_step(self, input, label, tea_text_features, tea_logits):
+        """Update all seeds with one forward pass of the stacked model over a
+        seed-major batch holding the batch once per seed."""
+        n_seeds = len(self.students)
+        batch_size = input.shape[0]
+
+        with torch.no_grad():
+            tokens = self.stacked.image_encoder.stem(input.type(self.stacked.dtype)).repeat(n_seeds, 1, 1)
+        if self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS:
+            image_fts, logit_scale = self.stacked(None, return_exits=True, tokens=tokens)
+        else:
+            image_ft, logit_scale = self.stacked(None, tokens=tokens)
+            image_fts = [image_ft]
+
+        # The seeds' parameters are disjoint, so the gradient of the summed loss
+        # is the gradient of every seed's own loss
+        loss = 0
+        loss_summary = {}
+        for seed, student in enumerate(self.students):
+            seed_fts = [image_ft[seed * batch_size:(seed + 1) * batch_size] for image_ft in image_fts]
+            with self.use_student(student):
+                seed_loss, summary = self.student_loss(seed_fts, logit_scale, label, tea_text_features, tea_logits)
+            loss = loss + seed_loss
+            for k, v in summary.items():
+                loss_summary[f"s{seed}_{k}"] = v
+
+        optim = self.students[0].optim
+        self.stacked.zero_grad()
+        if self.cfg.TRAINER.PROMPTKD.PREC == 'amp':
+            self.stacked_scaler.scale(loss).backward()
+            self.stacked_scaler.step(optim)
+            self.stacked_scaler.update()
+        else:
+            loss.backward()
+            optim.step()
+
+        return loss_summary
+
+    def student_step(self, input, label, tea_text_features, tea_logits, tokens=None):
+        """Update the current student (self.model) from the teacher outputs."""
+        # 学生模型前向传播
+        if self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS:
+            # Every exit is distilled from the same teacher logits; the final layer comes last
+            image_fts, logit_scale = self.model(input, label, return_exits=True, tokens=tokens)
+        else:
+            image_ft, logit_scale = self.model(input, label, tokens=tokens)
+            image_fts = [image_ft]
+
+        loss, loss_summary = self.student_loss(image_fts, logit_scale, label, tea_text_features, tea_logits)
 
         # 反向传播
         self.model.zero_grad()
@@ -585,4 +1175,37 @@ class PromptKD(TrainerX):
 
         return loss_summary
 
+    def student_loss(self, image_fts, logit_scale, label, tea_text_features, tea_logits):
+        """Distillation loss of the current student's exits ``image_fts``."""
+        loss_summary = {}
+
+        # 计算学生模型的logits
+        if self.train_modal == "base2novel":
+            # 修改此处，确保输出类别数能覆盖所有标签值
+            required_classes = label.max().item() + 1
+            # 确保不超过总类别数
+            required_classes = min(required_classes, self.n_cls)
+            text_features = tea_text_features[:required_classes,:]
+            # 同步教师logits与学生输出的类别数量
+            tea_logits = tea_logits[:, :required_classes]
+        elif self.train_modal == "cross":
+            text_features = tea_text_features
+
+        kd_weight = self.cfg.TRAINER.PROMPTKD.KD_WEIGHT
+        exit_layers = self.cfg.TRAINER.PROMPTKD.EARLY_EXIT_LAYERS
+
+        loss = 0
+        for i, image_ft in enumerate(image_fts):
+            output = logit_scale * image_ft @ text_features.t()
+            loss_cls, loss_kd = self.distill_loss(output, tea_logits, label)
+            loss_head = loss_cls + kd_weight * loss_kd
+            loss = loss + loss_head
+            if i < len(exit_layers):
+                loss_summary[f'loss_exit{exit_layers[i]}'] = loss_head.item()
+
+        loss_summary['loss_cls'] = loss_cls.item()
+        loss_summary['loss_kd'] = loss_kd.item()
+        # 总损失
+        loss_summary['loss'] = loss.item()
 
+        return loss, loss_summary
@@ -10,38 +10,28 @@ from dassl.engine import TRAINER_REGISTRY, TrainerX
 from dassl.utils import load_pretrained_weights, load_checkpoint
 from dassl.optim import build_optimizer, build_lr_scheduler
 from clip import clip
-from clip.simple_tokenizer import SimpleTokenizer as _Tokenizer
+from clip.registry import load_state_dict
+from clip.simple_tokenizer import get_tokenizer
 from .imagenet_templates import IMAGENET_TEMPLATES
 
-_tokenizer = _Tokenizer()
-
 
 def load_clip_to_cpu(cfg, zero_shot_model=False):
     backbone_name = cfg.MODEL.BACKBONE.NAME
-    url = clip._MODELS[backbone_name]
-    model_path = clip._download(url)
-    
-    try:
-        # loading JIT archive
-        model = torch.jit.load(model_path, map_location="cpu").eval()
-        state_dict = None
-
-    except RuntimeError:
-        state_dict = torch.load(model_path, map_location="cpu")
+    state_dict = load_state_dict(backbone_name)
     if not zero_shot_model:
         design_details = {"trainer": 'IVLP',
                           "vision_depth": cfg.TRAINER.PROMPTSRC.PROMPT_DEPTH_VISION,
                           "language_depth": cfg.TRAINER.PROMPTSRC.PROMPT_DEPTH_TEXT,
                           "vision_ctx": cfg.TRAINER.PROMPTSRC.N_CTX_VISION,
                           "language_ctx": cfg.TRAINER.PROMPTSRC.N_CTX_TEXT}
-        model = clip.build_model(state_dict or model.state_dict(), design_details)
+        model = clip.build_model(state_dict, design_details)
     else:
         # Return original CLIP model for generating frozen VL features
         design_details = {"trainer": 'IVLP',
                           "vision_depth": 0,
                           "language_depth": 0, "vision_ctx": 0,
                           "language_ctx": 0}
-        model = clip.build_model(state_dict or model.state_dict(), design_details)
+        model = clip.build_model(state_dict, design_details)
         return model
     return model
 
@@ -106,10 +96,10 @@ class VLPromptLearner(nn.Module):
         self.ctx = nn.Parameter(ctx_vectors)
 
         classnames = [name.replace("_", " ") for name in classnames]
-        name_lens = [len(_tokenizer.encode(name)) for name in classnames]
+        name_lens = [len(get_tokenizer().encode(name)) for name in classnames]
         prompts = [prompt_prefix + " " + name + "." for name in classnames]
 
-        tokenized_prompts = torch.cat([clip.tokenize(p) for p in prompts])  # (n_cls, n_tkn)
+        tokenized_prompts = clip.tokenize(prompts)  # (n_cls, n_tkn)
         # Also create frozen CLIP
         clip_model_temp = load_clip_to_cpu(cfg, True).float().cuda()
         clip_model_temp_image = load_clip_to_cpu(cfg, True)
@@ -119,10 +109,10 @@ class VLPromptLearner(nn.Module):
             # Now pre-compute the frozen VL embeddings
             all_teacher_features = []
             # Using multiple text templates to ensure textual diversity during training
-            for single_template in IMAGENET_TEMPLATES:
-                x = [single_template.replace("{}", name) for name in classnames]
-                x_tokenized = torch.cat([clip.tokenize(p) for p in x])
-                text_features = clip_model_temp.encode_text(x_tokenized.cuda())
+            x = [single_template.replace("{}", name) for single_template in IMAGENET_TEMPLATES for name in classnames]
+            x_tokenized = clip.tokenize(x).view(len(IMAGENET_TEMPLATES), n_cls, -1)
+            for single_template_tokenized in x_tokenized:
+                text_features = clip_model_temp.encode_text(single_template_tokenized.cuda())
                 all_teacher_features.append(text_features.unsqueeze(1))
 
         self.fixed_embeddings = torch.cat(all_teacher_features, dim=1).mean(dim=1)
@@ -362,7 +352,7 @@ class PromptSRC(TrainerX):
     def parse_batch_train(self, batch):
         input = batch["img"]
         label = batch["label"]
-        input = input.to(self.device)
+        input = self.prepare_input(input)
         label = label.to(self.device)
         return input, label
 
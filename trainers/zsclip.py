@@ -1,8 +1,14 @@
+import hashlib
+import os
+import os.path as osp
+import numpy as np
 import torch
 import torch.nn as nn
+from tqdm import tqdm
 
 from dassl.engine import TRAINER_REGISTRY, TrainerX
 from dassl.optim import build_optimizer, build_lr_scheduler
+from dassl.utils import mkdir_if_missing
 
 from clip import clip
 from clip.model import convert_weights
@@ -42,7 +48,7 @@ class ZeroshotCLIP(TrainerX):
         temp = CUSTOM_TEMPLATES[cfg.DATASET.NAME]
         prompts = [temp.format(c.replace("_", " ")) for c in classnames]
         print(f"Prompts: {prompts}")
-        prompts = torch.cat([clip.tokenize(p) for p in prompts])
+        prompts = clip.tokenize(prompts)
         prompts = prompts.to(self.device)
 
         with torch.no_grad():
@@ -52,13 +58,90 @@ class ZeroshotCLIP(TrainerX):
         self.text_features = text_features
         self.clip_model = clip_model
 
-    def model_inference(self, image):
+    def encode_image(self, image):
         image_features = self.clip_model.encode_image(image)
-        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+
+    def model_inference(self, image):
+        image_features = self.encode_image(image)
         logit_scale = self.clip_model.logit_scale.exp()
         logits = logit_scale * image_features @ self.text_features.t()
         return logits
 
+    def get_split_loader(self, split):
+        if split == "val" and self.val_loader is not None:
+            return "val", self.val_loader
+        return "test", self.test_loader
+
+    def image_features(self, split):
+        """Return the normalized image embeddings of a split as a read-only
+        (n_images, dim) fp16 memmap under TRAINER.ZSCLIP.CACHE_DIR, encoding
+        the split on first use. The file is keyed by the backbone, the test
+        transform and the image list, so a change to any of them re-encodes."""
+        cfg = self.cfg
+        split, data_loader = self.get_split_loader(split)
+        dataset = data_loader.dataset
+
+        key = hashlib.sha1()
+        key.update(cfg.MODEL.BACKBONE.NAME.encode())
+        key.update(repr(dataset.transform).encode())
+        for item in dataset.data_source:
+            key.update(item.impath.encode())
+        cache_dir = osp.join(cfg.TRAINER.ZSCLIP.CACHE_DIR, cfg.DATASET.NAME)
+        fpath = osp.join(cache_dir, f"{split}_{key.hexdigest()[:16]}.npy")
+
+        if not osp.exists(fpath):
+            print(f"Encoding the *{split}* set to {fpath}")
+            mkdir_if_missing(cache_dir)
+            dim = self.clip_model.visual.output_dim
+            tmp_fpath = f"{fpath}.{os.getpid()}.tmp"
+            features = np.lib.format.open_memmap(
+                tmp_fpath, mode="w+", dtype=np.float16, shape=(len(dataset), dim)
+            )
+            with torch.no_grad():
+                for batch in tqdm(data_loader):
+                    image_features = self.encode_image(self.prepare_input(batch["img"]))
+                    features[batch["index"].numpy()] = image_features.cpu().numpy()
+            features.flush()
+            del features
+            os.replace(tmp_fpath, fpath)
+
+        labels = np.array([item.label for item in dataset.data_source])
+        return np.load(fpath, mmap_mode="r"), labels
+
+    @torch.no_grad()
+    def evaluate_text_features(self, text_features, split=None):
+        """Evaluate a classifier given by normalized text features (a template,
+        an ensemble, learned prompts, ...) on the cached image embeddings."""
+        if split is None:
+            split = self.cfg.TEST.SPLIT
+        features, labels = self.image_features(split)
+        split, _ = self.get_split_loader(split)
+        print(f"Evaluate on the *{split}* set (cached image features)")
+
+        self.evaluator.reset()
+        logit_scale = self.clip_model.logit_scale.exp()
+        text_features = text_features.to(self.device)
+        chunk_size = self.cfg.TRAINER.ZSCLIP.CHUNK_SIZE
+        for start in range(0, len(features), chunk_size):
+            image_features = torch.from_numpy(np.array(features[start:start + chunk_size]))
+            image_features = image_features.to(self.device, text_features.dtype)
+            logits = logit_scale * image_features @ text_features.t()
+            label = torch.from_numpy(labels[start:start + chunk_size]).to(self.device)
+            self.evaluator.process(logits, label)
+
+        results = self.evaluator.evaluate()
+        for k, v in results.items():
+            tag = f"{split}/{k}"
+            self.write_scalar(tag, v, self.epoch)
+
+        return list(results.values())[0]
+
+    def test(self, split=None):
+        if not self.cfg.TRAINER.ZSCLIP.CACHE_DIR:
+            return super().test(split)
+        return self.evaluate_text_features(self.text_features, split)
+
 
 @TRAINER_REGISTRY.register()
 class ZeroshotCLIP2(ZeroshotCLIP):
@@ -85,11 +168,12 @@ class ZeroshotCLIP2(ZeroshotCLIP):
         num_temp = len(self.templates)
         print(f"Prompt ensembling (n={num_temp})")
 
+        prompts = [temp.format(c.replace("_", " ")) for temp in self.templates for c in classnames]
+        prompts = clip.tokenize(prompts).view(num_temp, len(classnames), -1)
+
         mean_text_features = 0
-        for i, temp in enumerate(self.templates):
-            prompts = [temp.format(c.replace("_", " ")) for c in classnames]
-            prompts = torch.cat([clip.tokenize(p) for p in prompts]).to(self.device)
-            text_features = clip_model.encode_text(prompts)
+        for temp_prompts in prompts:
+            text_features = clip_model.encode_text(temp_prompts.to(self.device))
             text_features = text_features / text_features.norm(dim=-1, keepdim=True)
             mean_text_features = mean_text_features + text_features
         mean_text_features = mean_text_features / num_temp